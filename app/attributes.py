@@ -0,0 +1,49 @@
+from django.db.models import Prefetch
+
+from app.models import ProductAttribute
+
+_key_field = ProductAttribute._meta.get_field('key')
+_value_field = ProductAttribute._meta.get_field('value')
+
+
+def attributes_prefetch():
+    # one query for the attribute rows with their keys and values joined in
+    return Prefetch('attributes', queryset=ProductAttribute.objects.select_related('key', 'value'))
+
+
+def prefetched_attributes(product):
+    """The product's prefetched attributes if their keys and values came along, else None."""
+    attributes = getattr(product, '_prefetched_objects_cache', {}).get('attributes')
+    if attributes is None:
+        return None
+    attributes = list(attributes)
+    if all(_key_field.is_cached(attribute) and _value_field.is_cached(attribute) for attribute in attributes):
+        return attributes
+    return None
+
+
+def load_attributes(products):
+    """
+    ``{product id: [ProductAttribute, ...]}`` with keys and values loaded, for a whole page of products.
+
+    Products fetched with ``attributes_prefetch()`` or ``prefetch_related('attributes__key',
+    'attributes__value')`` are read from their prefetch cache, all the others share one query.
+    """
+    loaded = {}
+    missing = []
+    for product in products:
+        attributes = prefetched_attributes(product)
+        if attributes is None:
+            missing.append(product.pk)
+            attributes = []
+        loaded[product.pk] = attributes
+
+    if missing:
+        rows = ProductAttribute.objects.filter(product_id__in=missing).select_related('key', 'value').order_by('pk')
+        for attribute in rows:
+            loaded[attribute.product_id].append(attribute)
+    return loaded
+
+
+def as_dict(attributes):
+    return {attribute.key.key: attribute.value.value for attribute in attributes}
@@ -0,0 +1,204 @@
+import threading
+import time
+from array import array
+
+from django.core.cache import cache
+
+from app import singleflight
+
+# entries can live for hours, a write moves readers to a new key instead of deleting old ones
+DETAIL_TIMEOUT = 60 * 60 * 6
+LIST_TIMEOUT = 60 * 60 * 6
+
+# a counter a read created only has to outlive the entries keyed by it, one per made-up slug
+# doesn't pile up; a bumped counter is kept longer, delta chains and Last-Modified run along it
+READ_GENERATION_TIMEOUT = max(DETAIL_TIMEOUT, LIST_TIMEOUT)
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+# deltas only have to outlive the time it takes every process to read once more
+DELTA_TIMEOUT = 60 * 60
+# a process that fell further behind than this rebuilds instead of replaying
+MAX_DELTAS = 64
+
+# everything rendered from the whole category / group table
+CATEGORY_LIST_TAG = 'categories'
+GROUP_LIST_TAG = 'groups'
+
+
+def product_tag(slug):
+    return f'product:{slug}'
+
+
+def group_tag(slug):
+    return f'group:{slug}'
+
+
+def category_tag(slug):
+    return f'category:{slug}'
+
+
+def generation_key(tag):
+    return f'gen:{tag}'
+
+
+def clock_generation():
+    # generations are microsecond timestamps of the last change, which also makes them usable for
+    # Last-Modified. A counter that was evicted restarts from the clock, never from an old value
+    return time.time_ns() // 1000
+
+
+def generation_time(generation):
+    return generation / 1_000_000
+
+
+def generations(tags):
+    """Current generation of every tag, one get_many round trip."""
+    keys = [generation_key(tag) for tag in tags]
+    current = cache.get_many(keys)
+    missing = [key for key in keys if key not in current]
+    for key in missing:
+        cache.add(key, clock_generation(), READ_GENERATION_TIMEOUT)
+    if missing:
+        current.update(cache.get_many(missing))
+    return [current.get(key, 0) for key in keys]
+
+
+def bump(*tags):
+    """
+    Invalidate everything built from ``tags`` by moving their generation forward.
+
+    One increment per tag however many entries were cached under it; the old
+    entries are never read again and expire on their own TTL. The increment moves the
+    counter up to the current clock so it keeps telling when the tag last changed.
+    """
+    now = clock_generation()
+    for tag in tags:
+        _advance(generation_key(tag), now)
+
+
+def advance(tag):
+    """
+    Bump a single tag and return ``(previous, new)`` generation.
+
+    The pair is exact even under concurrent bumps, INCR is atomic. None when the counter
+    was missing and had to be restarted from the clock.
+    """
+    return _advance(generation_key(tag), clock_generation())
+
+
+def _advance(key, now):
+    try:
+        # INCR by 0 reads the shared tier, the per-process copy of the counter can be seconds old
+        # and a step computed from it would push the counter into the future
+        current = cache.incr(key, 0)
+        step = max(1, now - current)
+        new = cache.incr(key, step)
+    except ValueError:
+        cache.add(key, now, GENERATION_TIMEOUT)
+        return None
+    # INCR of the file and database backends is a get and a set, which puts the default timeout
+    # back on the counter
+    cache.touch(key, GENERATION_TIMEOUT)
+    return new - step, new
+
+
+def delta_key(tag, generation):
+    return f'delta:{tag}:{generation}'
+
+
+def publish_delta(tag, delta):
+    """
+    Bump ``tag`` and store ``delta`` under the new generation.
+
+    Each delta remembers the generation it was published on top of, so a process
+    holding state built at an older generation can replay the chain with ``deltas_since``.
+    """
+    bumped = advance(tag)
+    if bumped is not None:
+        previous, new = bumped
+        cache.set(delta_key(tag, new), (previous, delta), DELTA_TIMEOUT)
+
+
+def deltas_since(tag, since, current):
+    """The deltas published between generations ``since`` and ``current``, oldest first, None if the chain is broken."""
+    chain = []
+    generation = current
+    while generation > since:
+        entry = cache.get(delta_key(tag, generation)) if len(chain) < MAX_DELTAS else None
+        if entry is None:
+            return None
+        generation, delta = entry
+        chain.append(delta)
+    if generation != since:
+        # the counter was restarted or bumped without a delta
+        return None
+    chain.reverse()
+    return chain
+
+
+def versioned_key(prefix, parts, tags):
+    stamp = '.'.join(str(generation) for generation in generations(tags))
+    return ':'.join([prefix, *(str(part) for part in parts), stamp])
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0,
+        }
+
+
+class ResultIdCache:
+    """
+    Caches the ordered primary keys of a list page instead of the rows themselves.
+
+    An entry is a compact ``array('q')`` of ids plus whatever page state the view needs
+    (cursors, count). Rows are hydrated fresh on every hit, so per-user fields and
+    prices never come out of the cache.
+    """
+
+    def __init__(self, prefix, timeout):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.stats = CacheStats()
+
+    def get_or_fill(self, parts, tags, fill):
+        """
+        Return ``(entry, status)`` for the page described by ``parts``.
+
+        ``fill`` returns ``(ids, state)`` and runs once per key however many requests miss together.
+        """
+        key = versioned_key(self.prefix, parts, tags)
+        stale_key = ':'.join([self.prefix, *(str(part) for part in parts), 'stale'])
+
+        def build_entry():
+            ids, state = fill()
+            return {'ids': array('q', ids), **state}
+
+        entry, status = singleflight.get_or_fill(key, build_entry, self.timeout, stale_key=stale_key)
+        self.stats.record(status != singleflight.MISS)
+        return entry, status
+
+
+def hydrate(queryset, ids):
+    # one IN query (batched by in_bulk if needed), then put the rows back in cached order
+    rows = queryset.in_bulk(list(ids))
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+product_list_cache = ResultIdCache('product_list', timeout=LIST_TIMEOUT)
@@ -0,0 +1,262 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_missing = object()
+
+# one local tier per LOCATION and process, Django hands out a backend instance per thread
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+class LocalTier:
+    """Size bounded LRU of pickled values, shared by every thread of the process."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (pickled value, fresh until, stale until)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0}
+        self.shared_stats = {'hits': 0, 'misses': 0}
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-revalidate')
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return _missing, False
+            pickled, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return pickled, False
+            if now < stale_until:
+                self.stats['stale_hits'] += 1
+                return pickled, True
+            self._pop(key)
+            self.stats['misses'] += 1
+            return _missing, False
+
+    def set(self, key, pickled, fresh_until, stale_until):
+        size = len(pickled)
+        with self.lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (pickled, fresh_until, stale_until)
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._pop(oldest)
+                self.stats['evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def as_dict(self):
+        with self.lock:
+            return {**self.stats, 'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes}
+
+
+class TieredCache(BaseCache):
+    """
+    A per-process LRU in front of a shared cache alias.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'app.cache_backends.TieredCache',
+            'LOCATION': 'catalog',
+            'OPTIONS': {
+                'SHARED': 'shared',               # alias of the backend behind the LRU
+                'LOCAL_MAX_BYTES': 32 * 1024 * 1024,
+                'LOCAL_TIMEOUT': 5,               # seconds a value is trusted without asking the shared tier
+                'STALE_WHILE_REVALIDATE': 30,     # seconds an expired local value may still be served
+                'SHARED_ONLY': ('gen:', 'lock:'), # key prefixes never kept locally
+            },
+        },
+        'shared': {...},
+    }
+
+    Writes go through to the shared tier, so other processes see them after at most LOCAL_TIMEOUT.
+    Generation counters and singleflight locks must be seen by every process at once, keys
+    starting with a SHARED_ONLY prefix are read and written in the shared tier alone.
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__(params)
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.stale_timeout = options.get('STALE_WHILE_REVALIDATE', 0)
+        self.shared_only = tuple(options.get('SHARED_ONLY', ('gen:', 'lock:')))
+        with _local_tiers_lock:
+            if location not in _local_tiers:
+                _local_tiers[location] = LocalTier(options.get('LOCAL_MAX_BYTES', 32 * 1024 * 1024))
+            self.local = _local_tiers[location]
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _is_local(self, key):
+        return not key.startswith(self.shared_only)
+
+    def _record_shared(self, hit):
+        with self.local.lock:
+            self.local.shared_stats['hits' if hit else 'misses'] += 1
+
+    def _store_local(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self._is_local(key):
+            return
+        local_key = self.make_and_validate_key(key, version=version)
+        now = time.monotonic()
+        fresh_until = now + self.local_timeout
+        expires_at = self.get_backend_timeout(timeout)
+        if expires_at is not None:
+            # never keep a value locally past its expiry in the shared tier
+            fresh_until = min(fresh_until, now + expires_at - time.time())
+            if fresh_until <= now:
+                self.local.delete(local_key)
+                return
+        stale_until = fresh_until + self.stale_timeout if self.stale_timeout else fresh_until
+        self.local.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), fresh_until, stale_until)
+
+    def _revalidate(self, key, version, local_key):
+        with self.local.lock:
+            if local_key in self.local.refreshing:
+                return
+            self.local.refreshing.add(local_key)
+
+        def refresh():
+            try:
+                value = self.shared.get(key, _missing, version=version)
+                self._record_shared(value is not _missing)
+                if value is _missing:
+                    self.local.delete(local_key)
+                else:
+                    self._store_local(key, value, version=version)
+            finally:
+                with self.local.lock:
+                    self.local.refreshing.discard(local_key)
+
+        self.local.executor.submit(refresh)
+
+    def get(self, key, default=None, version=None):
+        if self._is_local(key):
+            local_key = self.make_and_validate_key(key, version=version)
+            pickled, stale = self.local.get(local_key, time.monotonic())
+            if pickled is not _missing:
+                if stale:
+                    self._revalidate(key, version, local_key)
+                return pickle.loads(pickled)
+
+        value = self.shared.get(key, _missing, version=version)
+        self._record_shared(value is not _missing)
+        if value is _missing:
+            return default
+        self._store_local(key, value, version=version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        now = time.monotonic()
+        for key in keys:
+            if not self._is_local(key):
+                remote.append(key)
+                continue
+            local_key = self.make_and_validate_key(key, version=version)
+            pickled, stale = self.local.get(local_key, now)
+            if pickled is _missing:
+                remote.append(key)
+                continue
+            if stale:
+                self._revalidate(key, version, local_key)
+            found[key] = pickle.loads(pickled)
+
+        if remote:
+            values = self.shared.get_many(remote, version=version)
+            for key in remote:
+                self._record_shared(key in values)
+            for key, value in values.items():
+                self._store_local(key, value, version=version)
+            found.update(values)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self._store_local(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._store_local(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._store_local(key, value, timeout, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.local.delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if self._is_local(key):
+            pickled, _ = self.local.get(self.make_and_validate_key(key, version=version), time.monotonic())
+            if pickled is not _missing:
+                return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        # counters live in the shared tier, the local copy is just dropped
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.decr(key, delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        local = self.local.as_dict()
+        with self.local.lock:
+            shared = dict(self.local.shared_stats)
+        return {'local': local, 'shared': shared}
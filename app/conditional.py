@@ -0,0 +1,65 @@
+import hashlib
+import time
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from app import singleflight
+from app.cache import generation_time, generations
+from app.db import recently_changed, use_primary
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified for read views, computed without touching the response body.
+
+    Every change to the data a view renders bumps one of its cache tags, so the tags'
+    generations plus the request's own variant (host, query string, user) identify the
+    body exactly. Generations are timestamps of the last change, the newest one is the
+    Last-Modified date. Handlers call ``conditional_response`` first and return its
+    result when it isn't None.
+    """
+    etag = None
+    last_modified = None
+
+    def get_condition_tags(self):
+        raise NotImplementedError
+
+    def get_condition_variant(self, request):
+        # absolute urls in the body depend on the host, pages and filters on the query string
+        return [request.build_absolute_uri()]
+
+    def conditional_response(self, request):
+        return self.evaluate_conditions(request, generations(self.get_condition_tags()))
+
+    def evaluate_conditions(self, request, current):
+        if recently_changed(current):
+            # replicas may not have the change yet
+            use_primary()
+        parts = [*self.get_condition_variant(request), *current]
+        self.etag = '"%s"' % hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+        # never in the future, even if a counter got ahead of the clock
+        self.last_modified = int(min(generation_time(max(current)), time.time()))
+        return get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+
+    def add_condition_headers(self, response):
+        if self.etag is None or response.status_code not in (200, 304):
+            return response
+        patch_vary_headers(response, ['Authorization'])
+        if response.get('X-Cache') == singleflight.STALE:
+            # served while the current generation is being filled, the body predates it; its
+            # validators would answer every later request with 304 and pin the client to the old
+            # body. A pre-rendered body keeps the ETag of its own bytes
+            return response
+        response['ETag'] = self.etag
+        response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        return self.add_condition_headers(super().finalize_response(request, response, *args, **kwargs))
+
+
+class PerUserConditionalGetMixin(ConditionalGetMixin):
+    # is_liked differs per user, liking a product bumps its tags so the user id is enough here
+    def get_condition_variant(self, request):
+        return [*super().get_condition_variant(request), request.user.pk or 0]
@@ -0,0 +1,102 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+
+from app.cache import generation_time
+
+# alias the current request reads from, None for the primary
+_read_alias = ContextVar('read_alias', default=None)
+
+SQLITE_PRAGMAS = [
+    # readers don't block the writer and the writer doesn't block readers
+    'PRAGMA journal_mode = WAL',
+    # with WAL a commit is still atomic and durable up to the last checkpoint, without the fsync per commit
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 20000',
+    'PRAGMA cache_size = -20000',  # KiB
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 134217728',
+]
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+@contextmanager
+def reading_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def use_primary():
+    """Send the rest of the current ``reading_from`` block's reads to the primary."""
+    _read_alias.set(None)
+
+
+def recently_changed(current):
+    """True if one of the generations in ``current`` is younger than the replicas' lag."""
+    return time.time() - generation_time(max(current)) < settings.REPLICA_LAG
+
+
+class ReplicaRouter:
+    """
+    Reads of the catalog read views go to a replica, everything else to the primary.
+
+    Only views using ``ReplicaReadMixin`` read from replicas, a view that writes and then
+    reads what it wrote never sees a replica that hasn't caught up yet, and neither does a
+    read inside ``atomic()`` on the primary. Migrations run on
+    the primary alone, the replicas get them through replication.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        # inside a transaction on the primary a read has to see what the transaction wrote
+        if alias is not None and connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """
+    Serve safe requests from a replica picked for the whole request.
+
+    ``ConditionalGetMixin.conditional_response`` switches back to the primary when the
+    view's data changed less than ``REPLICA_LAG`` seconds ago, so a lagging replica can't
+    fill the response caches with rows from before the change.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        aliases = replica_aliases()
+        if request.method not in SAFE_METHODS or not aliases:
+            return super().dispatch(request, *args, **kwargs)
+        with reading_from(random.choice(aliases)):
+            return super().dispatch(request, *args, **kwargs)
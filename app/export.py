@@ -0,0 +1,48 @@
+from itertools import islice
+
+from rest_framework.renderers import JSONRenderer
+
+from app.planner import plan_queryset
+from app.renderers import ndjson_line
+from app.serializers import ProductExportSerializer
+
+# rows fetched per round trip and serialized together; with a server-side cursor (PostgreSQL)
+# this bounds the memory an export holds, however many products it streams
+CHUNK_SIZE = 500
+# products in the first rendered chunk, small so the first bytes go out within milliseconds
+FIRST_CHUNK = 20
+
+
+def chunks(iterable, size, first=None):
+    """Lists of ``size`` items from ``iterable``, the first one ``first`` items long."""
+    iterator = iter(iterable)
+    take = first or size
+    while chunk := list(islice(iterator, take)):
+        yield chunk
+        take = size
+
+
+def export_products(queryset, format='ndjson', context=None, chunk_size=CHUNK_SIZE):
+    """
+    Bytes of the products in ``queryset``, as NDJSON lines or a JSON array, in primary key order.
+
+    A generator for StreamingHttpResponse: rows are read with ``iterator()`` and rendered
+    ``chunk_size`` at a time, nothing but the current chunk is held in memory.
+    """
+    queryset = plan_queryset(queryset, ProductExportSerializer).order_by('pk')
+    rows = queryset.iterator(chunk_size=chunk_size)
+    if format == 'json':
+        # out before the first query, the client sees the response start right away
+        yield b'['
+        separator = b''
+        renderer = JSONRenderer()
+        for chunk in chunks(rows, chunk_size, FIRST_CHUNK):
+            data = ProductExportSerializer(chunk, many=True, context=context).data
+            # the rendered list without its brackets, chunks joined by commas
+            yield separator + renderer.render(data)[1:-1]
+            separator = b','
+        yield b']'
+    else:
+        for chunk in chunks(rows, chunk_size, FIRST_CHUNK):
+            data = ProductExportSerializer(chunk, many=True, context=context).data
+            yield b''.join(ndjson_line(item) for item in data)
@@ -0,0 +1,285 @@
+import threading
+from array import array
+from urllib.parse import urlencode
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from app.cache import bump, deltas_since, generations, publish_delta
+from app.db import reading_from
+from app.models import ProductAttribute
+
+# bumped when attribute keys or values are renamed or deleted, every index is rebuilt
+FACETS_TAG = 'facets'
+# a posting becomes a bitmap once it covers more than 1/SPARSE_FACTOR of the group,
+# below that a set of positions is smaller than a bitmap as wide as the group
+SPARSE_FACTOR = 256
+# above this many matches the filter is left to the database, an IN list that long costs
+# more to send and parse than the join, and SQLite caps the number of bound parameters
+MAX_IN_IDS = 900
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def facet_tag(group_id):
+    return f'facets:group:{group_id}'
+
+
+def to_bitmap(positions, width):
+    bits = bytearray(width // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def bitmap_positions(bitmap):
+    digits = bin(bitmap)[:1:-1]  # lowest bit first
+    return [position for position, digit in enumerate(digits) if digit == '1']
+
+
+class FacetIndex:
+    """
+    Inverted index of one group's attributes: key -> value -> products having that value.
+
+    Products are numbered densely inside the group, a posting is either a set of those
+    positions or, once it covers enough of the group, an int used as a bitmap. Filters
+    and counts are then bitwise ANDs and popcounts instead of joins over the EAV tables.
+    """
+
+    def __init__(self, generations):
+        self.generations = generations
+        self.lock = threading.Lock()
+        self.positions = {}  # product id -> position
+        self.product_ids = array('q')  # position -> product id
+        self.postings = {}  # key -> {value: set of positions or bitmap}
+
+    def position(self, product_id):
+        position = self.positions.get(product_id)
+        if position is None:
+            position = self.positions[product_id] = len(self.product_ids)
+            self.product_ids.append(product_id)
+        return position
+
+    def add(self, product_id, key, value):
+        position = self.position(product_id)
+        values = self.postings.setdefault(key, {})
+        posting = values.setdefault(value, set())
+        if isinstance(posting, int):
+            values[value] = posting | (1 << position)
+        else:
+            posting.add(position)
+
+    def remove(self, product_id, key, value):
+        position = self.positions.get(product_id)
+        posting = self.postings.get(key, {}).get(value)
+        if position is None or posting is None:
+            return
+        if isinstance(posting, int):
+            self.postings[key][value] = posting & ~(1 << position)
+        else:
+            posting.discard(position)
+
+    def compact(self):
+        """Turn the dense postings into bitmaps, called once after a bulk load."""
+        width = len(self.product_ids)
+        for values in self.postings.values():
+            for value, posting in values.items():
+                if isinstance(posting, set) and len(posting) * SPARSE_FACTOR > width:
+                    values[value] = to_bitmap(posting, width)
+
+    def apply(self, ops):
+        # a product can hold the same key and value in two rows, deleting one of them keeps the bit
+        kept = stored_rows([(product_id, key, value) for added, product_id, key, value in ops if not added])
+        for added, product_id, key, value in ops:
+            if added:
+                self.add(product_id, key, value)
+            elif (product_id, key, value) not in kept:
+                self.remove(product_id, key, value)
+
+    def selection(self, key, values):
+        """Bitmap of the products having any of ``values`` for ``key``."""
+        width = len(self.product_ids)
+        bitmap = 0
+        for value in values:
+            posting = self.postings.get(key, {}).get(value)
+            if isinstance(posting, int):
+                bitmap |= posting
+            elif posting:
+                bitmap |= to_bitmap(posting, width)
+        return bitmap
+
+    def match(self, filters):
+        """Ids of the products matching every key of ``filters`` (values of one key are ORed)."""
+        with self.lock:
+            bitmap = None
+            for key, values in filters.items():
+                selected = self.selection(key, values)
+                bitmap = selected if bitmap is None else bitmap & selected
+                if not bitmap:
+                    return []
+            return [self.product_ids[position] for position in bitmap_positions(bitmap)]
+
+    def counts(self, filters):
+        """
+        Number of matching products per key and value.
+
+        Counts for a key ignore that key's own filter, so picking "red" still shows how
+        many products are "blue" instead of collapsing the facet to one value.
+        """
+        with self.lock:
+            selections = {key: self.selection(key, values) for key, values in filters.items()}
+            result = {}
+            for key, values in self.postings.items():
+                other = [selected for name, selected in selections.items() if name != key]
+                bitmap = None
+                for selected in other:
+                    bitmap = selected if bitmap is None else bitmap & selected
+                result[key] = self.value_counts(values, bitmap)
+            return result
+
+    def value_counts(self, values, bitmap):
+        members = None
+        counts = {}
+        for value, posting in values.items():
+            if bitmap is None:
+                count = posting.bit_count() if isinstance(posting, int) else len(posting)
+            elif isinstance(posting, int):
+                count = (posting & bitmap).bit_count()
+            else:
+                if members is None:
+                    members = set(bitmap_positions(bitmap))
+                count = len(posting & members)
+            if count:
+                counts[value] = count
+        return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+
+
+def build_index(group_id, current):
+    index = FacetIndex(current)
+    rows = (
+        ProductAttribute.objects.filter(product__group_id=group_id)
+        .values_list('product_id', 'key__key', 'value__value')
+        .iterator(chunk_size=5000)
+    )
+    for product_id, key, value in rows:
+        index.add(product_id, key, value)
+    index.compact()
+    return index
+
+
+def catch_up(index, group_id, current):
+    """Replay the deltas other processes published since ``index`` was built, False if some are gone."""
+    if current[1] != index.generations[1]:
+        return False
+    chain = deltas_since(facet_tag(group_id), index.generations[0], current[0])
+    if chain is None:
+        return False
+    with index.lock:
+        for ops in chain:
+            index.apply(ops)
+        index.generations = current
+    return True
+
+
+class _Slot:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+
+
+def get_index(group_id):
+    """The up to date index of a group, built on first use and kept per process."""
+    current = tuple(generations([facet_tag(group_id), FACETS_TAG]))
+    with _indexes_lock:
+        slot = _indexes.setdefault(group_id, _Slot())
+    # one thread per group rebuilds, the others wait for it instead of running the same query
+    with slot.lock:
+        index = slot.index
+        if index is not None and (index.generations == current or catch_up(index, group_id, current)):
+            return index
+        # generations are read before the rows, deltas committed meanwhile are replayed on the next call;
+        # a replica could be missing rows older than those generations, the index is built from the primary
+        with reading_from(None):
+            slot.index = build_index(group_id, current)
+        return slot.index
+
+
+def attribute_row(pk):
+    """``(group_id, product_id, key, value)`` of a stored ProductAttribute, the shape the index works with."""
+    return (
+        ProductAttribute.objects.filter(pk=pk)
+        .values_list('product__group_id', 'product_id', 'key__key', 'value__value')
+        .first()
+    )
+
+
+def stored_rows(rows):
+    """The ``(product_id, key, value)`` tuples of ``rows`` that some ProductAttribute still holds."""
+    if not rows:
+        return set()
+    # deltas are published after the commit, the primary has it
+    with reading_from(None):
+        stored = (
+            ProductAttribute.objects.filter(product_id__in={row[0] for row in rows})
+            .values_list('product_id', 'key__key', 'value__value')
+        )
+        return set(rows).intersection(stored)
+
+
+def invalidate(*group_ids):
+    # no delta is published, processes holding these indexes rebuild them on next use
+    tags = [facet_tag(group_id) for group_id in group_ids]
+    transaction.on_commit(lambda: bump(*tags))
+
+
+def record_changes(removed=None, added=None):
+    """
+    Queue index updates for one ProductAttribute change, published once the transaction commits.
+
+    ``removed`` and ``added`` are ``(group_id, product_id, key, value)`` tuples.
+    """
+    changes = [(False, removed)] if removed is not None else []
+    if added is not None:
+        changes.append((True, added))
+    publish_on_commit(changes)
+
+
+def record_additions(rows):
+    """Queue the index updates for many new ProductAttribute rows, one delta per group."""
+    publish_on_commit([(True, row) for row in rows])
+
+
+def publish_on_commit(changes):
+    deltas = {}
+    for added_flag, (group_id, *attribute) in changes:
+        deltas.setdefault(group_id, []).append((added_flag, *attribute))
+    for group_id, ops in deltas.items():
+        transaction.on_commit(lambda group_id=group_id, ops=ops: publish_delta(facet_tag(group_id), ops))
+
+
+def parse_filters(query_params):
+    """``?attr[color]=red&attr[color]=blue&attr[ram]=8GB`` -> ``{'color': ['blue', 'red'], 'ram': ['8GB']}``."""
+    filters = {}
+    for param in query_params:
+        if param.startswith('attr[') and param.endswith(']'):
+            values = sorted({value for value in query_params.getlist(param) if value})
+            if values:
+                filters[param[5:-1]] = values
+    return dict(sorted(filters.items()))
+
+
+def filter_key(filters):
+    # percent-encoded, a value holding ',', ';' or '=' can't be taken for two values or another key
+    return urlencode([(key, value) for key, values in filters.items() for value in values])
+
+
+def filter_products(queryset, group_id, filters):
+    ids = get_index(group_id).match(filters)
+    if len(ids) <= MAX_IN_IDS:
+        return queryset.filter(pk__in=ids)
+    for key, values in filters.items():
+        queryset = queryset.filter(Exists(ProductAttribute.objects.filter(
+            product=OuterRef('pk'), key__key=key, value__value__in=values,
+        )))
+    return queryset
@@ -0,0 +1,141 @@
+import io
+import logging
+from pathlib import PurePosixPath
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage, ImageOps
+
+from app import tasks
+from app.cache import bump
+
+logger = logging.getLogger(__name__)
+
+# srcset widths, an original narrower than the widest one also gets a variant at its own width
+WIDTHS = (160, 320, 640, 1280)
+DERIVATIVES_DIR = 'derivatives'
+# (format, file extension, save options); PNG replaces JPEG for images with transparency
+WEBP = ('WEBP', 'webp', {'quality': 80, 'method': 4})
+JPEG = ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True})
+PNG = ('PNG', 'png', {'optimize': True})
+# threads of the backfill command, Pillow releases the GIL while it resizes and encodes
+WORKERS = 2
+
+
+def derivative_name(name, width, extension):
+    # the original's extension stays in the directory, x.jpg and x.png don't share their variants
+    return f'{DERIVATIVES_DIR}/{PurePosixPath(name)}/{width}.{extension}'
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def encode(image, format, options):
+    buffer = io.BytesIO()
+    image.save(buffer, format, **options)
+    return buffer.getvalue()
+
+
+def store(name, content):
+    # storage.save would pick another name instead of replacing an older rendering
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, ContentFile(content))
+
+
+def render(name):
+    """
+    Render the derivatives of the stored image ``name``.
+
+    Returns what ends up in the model's ``variants`` field: the original's size and, per
+    format, ``[width, height, storage name]`` of each variant, narrowest first.
+    """
+    with default_storage.open(name, 'rb') as file, PILImage.open(file) as original:
+        full_width = original.width
+        # a JPEG is decoded at the smallest scale that still covers the widest variant
+        original.draft('RGB', (WIDTHS[-1], WIDTHS[-1] * original.height // max(original.width, 1)))
+        scale = full_width / original.width
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if has_alpha(image) else 'RGB')
+
+    width, height = image.size
+    widths = [target for target in WIDTHS if target < width]
+    if width <= WIDTHS[-1]:
+        widths.append(width)
+    formats = [WEBP, PNG if image.mode == 'RGBA' else JPEG]
+    sources = {extension: [] for _, extension, _ in formats}
+
+    # widest first, each variant is resized from the previous one instead of the full original
+    current = image
+    for target in sorted(widths, reverse=True):
+        size = (target, max(1, round(height * target / width)))
+        if current.size != size:
+            current = current.resize(size, PILImage.LANCZOS, reducing_gap=3.0)
+        for format, extension, options in formats:
+            stored = store(derivative_name(name, target, extension), encode(current, format, options))
+            sources[extension].insert(0, [size[0], size[1], stored])
+    return {'source': name, 'width': round(width * scale), 'height': round(height * scale), 'sources': sources}
+
+
+def generate(model, pk, tags):
+    """
+    Render the variants of one row's image and store them, unless the image was replaced meanwhile.
+
+    Runs on the caller's connection, eagerly run tasks share it with the request. Closing it
+    is up to whoever owns the thread.
+    """
+    name = model.objects.filter(pk=pk).values_list('image', flat=True).first()
+    if not name:
+        return
+    try:
+        variants = render(name)
+    except (OSError, ValueError, PILImage.DecompressionBombError) as error:
+        logger.warning('No variants for %s %s (%s): %s', model.__name__, pk, name, error)
+        return
+    # update() sends no post_save, the receiver that queued this isn't triggered again
+    if model.objects.filter(pk=pk, image=name).update(variants=variants):
+        bump(*tags)
+
+
+@tasks.register('images.render', priority=-1)
+def render_task(model, pk, tags):
+    generate(apps.get_model(model), pk, tags)
+
+
+def schedule(instance, tags):
+    """Queue the rendering of ``instance``'s image variants, a worker picks it up once the transaction commits."""
+    label = instance._meta.label
+    tasks.enqueue(
+        'images.render', {'model': label, 'pk': instance.pk, 'tags': tags},
+        dedupe_key=f'images.render:{label}:{instance.pk}',
+    )
+
+
+def needs_variants(instance):
+    return bool(instance.image) and (instance.variants or {}).get('source') != instance.image.name
+
+
+def srcset(request, image, variants):
+    """
+    ``{'width', 'height', 'srcset': {extension: 'url 160w, url 320w, ...'}}`` for an image field.
+
+    None while the variants of the current image haven't been rendered yet, clients then
+    fall back to the original.
+    """
+    if not image or not variants or variants.get('source') != image.name:
+        return None
+
+    def url(name):
+        url = default_storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    return {
+        'width': variants['width'],
+        'height': variants['height'],
+        'srcset': {
+            extension: ', '.join(f'{url(name)} {width}w' for width, _, name in sources)
+            for extension, sources in variants['sources'].items()
+        },
+    }
@@ -0,0 +1,261 @@
+import codecs
+import csv
+import json
+import math
+import time
+from pathlib import PurePath
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app import facets, search, suggest
+from app.cache import bump, category_tag, group_tag
+from app.models import AttributeKey, AttributeValue, Group, ImportRun, Product, ProductAttribute
+from app.slugs import SlugAllocator
+
+FORMATS = ('csv', 'jsonl')
+CHUNK_SIZE = 1000
+# CSV columns named "attr:<key>" hold the attribute values, JSONL records have an "attributes" object
+ATTRIBUTE_PREFIX = 'attr:'
+# errors past this many are counted but not kept
+MAX_REPORTED_ERRORS = 100
+# a chunk whose slugs were taken by a concurrent insert is retried with freshly looked up suffixes
+WRITE_ATTEMPTS = 3
+
+
+def detect_format(filename, declared=None):
+    declared = declared or {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(PurePath(filename).suffix.lower())
+    if declared not in FORMATS:
+        raise ValueError(f'Unknown format, expected one of {", ".join(FORMATS)}')
+    return declared
+
+
+def read_records(stream, format):
+    """
+    Records of a binary ``stream``, read lazily: dicts for CSV, undecoded lines for JSONL.
+
+    JSONL lines are decoded by ``ProductImporter.clean`` so a broken line fails alone.
+    """
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if format == 'csv':
+        yield from csv.DictReader(lines)
+    else:
+        for line in lines:
+            if line.strip():
+                yield line
+
+
+def number(value, field):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a number')
+    if not math.isfinite(value):
+        raise ValueError(f'{field} must be a number')
+    return value
+
+
+def start_run(name, source='', restart=False):
+    """The ImportRun called ``name``, created if needed; ``restart`` starts it over from the first record."""
+    run, created = ImportRun.objects.get_or_create(name=name, defaults={'source': source})
+    if restart and not created:
+        run.position = run.created = run.failed = 0
+        run.finished_at = None
+        run.source = source or run.source
+        run.save()
+    return run
+
+
+class ProductImporter:
+    """
+    Writes records into Product and ProductAttribute with ``bulk_create``, ``chunk_size`` records per transaction.
+
+    Groups, attribute keys and attribute values are resolved through in-memory maps and
+    slugs come from a SlugAllocator, so a chunk costs a handful of queries whatever its
+    size. The run's position is saved in the transaction of each chunk: after a failure
+    the same run continues after the last committed chunk, nothing is imported twice.
+
+    bulk_create sends no signals, each chunk queues the cache, facet, search and
+    suggestion updates the Product and ProductAttribute receivers would have.
+    """
+
+    def __init__(self, run, chunk_size=CHUNK_SIZE, progress=None):
+        self.run = run
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.groups = {}  # slug and lower-cased name -> (pk, slug, category slug)
+        for pk, slug, name, category_slug in Group.objects.values_list('pk', 'slug', 'name', 'category__slug'):
+            self.groups.setdefault(name.lower(), (pk, slug, category_slug))
+        for group in list(self.groups.values()):
+            self.groups[group[1]] = group
+        self.keys = {}  # key -> AttributeKey pk
+        self.values = {}  # value -> AttributeValue pk
+        self.slugs = SlugAllocator(Product)
+        self.errors = []  # (record number, message)
+        self.processed = 0
+        self.created = 0
+        self.started = time.perf_counter()
+
+    def import_records(self, records):
+        skip = self.run.position
+        chunk = []
+        for number, record in enumerate(records, 1):
+            if number <= skip:
+                continue
+            chunk.append((number, record))
+            if len(chunk) >= self.chunk_size:
+                self.write_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.write_chunk(chunk)
+        self.run.finished_at = timezone.now()
+        self.run.save(update_fields=['finished_at', 'updated_at'])
+        return self
+
+    def write_chunk(self, chunk):
+        rows = []
+        failed = []
+        for number, record in chunk:
+            try:
+                rows.append(self.clean(record))
+            except ValueError as error:
+                failed.append((number, str(error)))
+
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                with transaction.atomic():
+                    self.save_rows(rows)
+                    ImportRun.objects.filter(pk=self.run.pk).update(
+                        position=chunk[-1][0], created=F('created') + len(rows), failed=F('failed') + len(failed),
+                        updated_at=timezone.now(),
+                    )
+                break
+            except IntegrityError:
+                if attempt == WRITE_ATTEMPTS:
+                    raise
+                # rolled back: the suffixes handed out and the keys or values created are gone too
+                self.slugs.forget()
+                self.keys.clear()
+                self.values.clear()
+
+        self.run.refresh_from_db(fields=['position', 'created', 'failed', 'updated_at'])
+        self.processed += len(chunk)
+        self.created += len(rows)
+        self.errors.extend(failed[:MAX_REPORTED_ERRORS - len(self.errors)])
+        if self.progress is not None:
+            self.progress(self)
+
+    def clean(self, record):
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except json.JSONDecodeError as error:
+                raise ValueError(f'invalid JSON: {error.msg}')
+            if not isinstance(record, dict):
+                raise ValueError('expected a JSON object')
+            attributes = record.get('attributes') or {}
+            if not isinstance(attributes, dict):
+                raise ValueError('attributes must be an object')
+        else:
+            attributes = {
+                column[len(ATTRIBUTE_PREFIX):]: value
+                for column, value in record.items() if column and column.startswith(ATTRIBUTE_PREFIX)
+            }
+
+        name = str(record.get('name') or '').strip()
+        if not name:
+            raise ValueError('name is required')
+        if len(name) > 300:
+            raise ValueError('name is longer than 300 characters')
+        price = number(record.get('price'), 'price')
+        discount = number(record.get('discount') or 0, 'discount')
+        if price < 0:
+            raise ValueError('price must not be negative')
+        if not 0 <= discount <= 100:
+            raise ValueError('discount must be between 0 and 100')
+        group = str(record.get('group') or '').strip()
+        group = self.groups.get(group) or self.groups.get(group.lower())
+        if group is None:
+            raise ValueError(f'unknown group {record.get("group")!r}')
+
+        cleaned = []
+        for key, value in attributes.items():
+            key, value = str(key).strip(), str(value if value is not None else '').strip()
+            if not key or not value:
+                continue
+            if len(key) > 200 or len(value) > 200:
+                raise ValueError(f'attribute {key[:50]!r} is longer than 200 characters')
+            cleaned.append((key, value))
+        return {
+            'name': name,
+            'description': str(record.get('description') or ''),
+            'price': price,
+            'discount': discount,
+            'group': group,
+            'attributes': cleaned,
+        }
+
+    def resolve(self, model, field, known, names):
+        """pk of every name in ``names``, the ones missing from ``model`` are created."""
+        missing = set(names) - set(known)
+        if missing:
+            model.objects.bulk_create([model(**{field: name}) for name in missing], ignore_conflicts=True)
+            known.update(model.objects.filter(**{f'{field}__in': missing}).values_list(field, 'pk'))
+        return known
+
+    def save_rows(self, rows):
+        if not rows:
+            return
+        slugs = self.slugs.allocate([row['name'] for row in rows])
+        products = Product.objects.bulk_create([
+            Product(
+                name=row['name'], slug=slug, description=row['description'], price=row['price'],
+                discount=row['discount'], group_id=row['group'][0],
+            )
+            for row, slug in zip(rows, slugs)
+        ])
+
+        keys = self.resolve(AttributeKey, 'key', self.keys, {key for row in rows for key, _ in row['attributes']})
+        values = self.resolve(
+            AttributeValue, 'value', self.values, {value for row in rows for _, value in row['attributes']},
+        )
+        ProductAttribute.objects.bulk_create([
+            ProductAttribute(product_id=product.pk, key_id=keys[key], value_id=values[value])
+            for product, row in zip(products, rows) for key, value in row['attributes']
+        ])
+
+        # facet deltas before the tag bump, like the receivers in app.signals
+        facets.record_additions([
+            (row['group'][0], product.pk, key, value)
+            for product, row in zip(products, rows) for key, value in row['attributes']
+        ])
+        groups = {row['group'] for row in rows}
+        tags = [tag for _, slug, category_slug in groups for tag in (group_tag(slug), category_tag(category_slug))]
+        transaction.on_commit(lambda: bump(*tags))
+        product_ids = [product.pk for product in products]
+        search.reindex_on_commit(product_ids)
+        suggest.refresh_on_commit([
+            *((suggest.PRODUCT, pk) for pk in product_ids), *suggest.group_entries({pk for pk, _, _ in groups}),
+        ])
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'name': self.run.name,
+            'position': self.run.position,
+            'created': self.run.created,
+            'failed': self.run.failed,
+            'finished': self.run.finished_at is not None,
+            'rows_per_second': round(self.processed / elapsed, 1) if elapsed else 0,
+            'errors': [{'record': number, 'error': message} for number, message in self.errors],
+        }
+
+
+def import_products(stream, format, name, source='', restart=False, chunk_size=CHUNK_SIZE, progress=None):
+    """Import a CSV or JSONL ``stream`` as the run ``name``, continuing where an earlier attempt stopped."""
+    run = start_run(name, source, restart)
+    importer = ProductImporter(run, chunk_size, progress)
+    if run.finished_at is not None:
+        return importer
+    return importer.import_records(read_records(stream, format))
@@ -0,0 +1,64 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from app import tasks
+from app.cache import bump, category_tag, group_tag, product_tag
+from app.models import Product
+
+ProductLike = Product.user_like.through
+
+
+def liked_product_ids(user, products):
+    # one query for a whole page instead of scanning user_like per product
+    if not user.is_authenticated:
+        return set()
+    return set(
+        ProductLike.objects.filter(user_id=user.pk, product_id__in=[product.pk for product in products])
+        .values_list('product_id', flat=True)
+    )
+
+
+def has_liked(user, **product_lookup):
+    if not user.is_authenticated:
+        return False
+    product_lookup = {f'product__{key}': value for key, value in product_lookup.items()}
+    return ProductLike.objects.filter(user_id=user.pk, **product_lookup).exists()
+
+
+def like(user, product):
+    try:
+        with transaction.atomic():
+            product.user_like.add(user)
+    except IntegrityError:
+        # a concurrent request already stored the same like
+        pass
+
+
+def unlike(user, product):
+    with transaction.atomic():
+        product.user_like.remove(user)
+
+
+def increment_like_counts(product_ids, amount=1):
+    Product.objects.filter(pk__in=product_ids).update(like_count=F('like_count') + amount)
+
+
+def recount_likes(product_ids):
+    likes = (ProductLike.objects.filter(product_id=OuterRef('pk'))
+             .order_by()
+             .values('product_id')
+             .annotate(total=Count('id'))
+             .values('total'))
+    Product.objects.filter(pk__in=product_ids).update(like_count=Coalesce(Subquery(likes), Value(0)))
+
+
+@tasks.register('likes.recount')
+def recount_and_invalidate(product_ids):
+    """Recount ``product_ids`` in the background, for a clear() that may touch every product a user liked."""
+    recount_likes(product_ids)
+    rows = Product.objects.filter(pk__in=product_ids).values_list('slug', 'group__slug', 'group__category__slug')
+    tags = {tag for slug, group_slug, category_slug in rows
+            for tag in (product_tag(slug), group_tag(group_slug), category_tag(category_slug))}
+    if tags:
+        bump(*sorted(tags))
@@ -0,0 +1,105 @@
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from app import pricing
+from app.cache import product_tag, versioned_key
+from app.models import Product
+from app.serializers import ProductSerializer
+from app.views.app import views
+
+
+class Command(BaseCommand):
+    help = 'Micro benchmarks for the catalog hot paths, run against the configured database and cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=['responses', 'prices'])
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--rows', type=int, default=10000, help='records per bulk price update')
+
+    def handle(self, *args, **options):
+        getattr(self, f'bench_{options["scenario"]}')(options)
+
+    def report(self, label, timings):
+        timings = sorted(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'{label:<32} mean {statistics.mean(timings) * 1e6:8.1f} us   '
+            f'p50 {statistics.median(timings) * 1e6:8.1f} us   p95 {p95 * 1e6:8.1f} us'
+        )
+
+    def time_view(self, view, path, iterations, **kwargs):
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(iterations):
+            request = factory.get(path, HTTP_ACCEPT='application/json')
+            started = time.perf_counter()
+            response = view(request, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def bench_responses(self, options):
+        """Cache hit served as pre-rendered bytes vs. a cached dict pushed through DRF rendering."""
+        product = Product.objects.order_by('pk').first()
+        if product is None:
+            raise CommandError('Needs at least one product in the database')
+
+        iterations = options['iterations']
+        path = f'/olcha-uz/products/{product.slug}/'
+        detail = views.ProductDetail.as_view()
+        warm = self.time_view(detail, path, 1, slug=product.slug)
+
+        data = ProductSerializer(
+            Product.objects.get(pk=product.pk),
+            context={'request': APIRequestFactory().get(path), 'liked_ids': set()},
+        ).data
+
+        cache_key = versioned_key('benchmark_detail', [product.slug], [product_tag(product.slug)])
+        cache.set(cache_key, data, 60)
+
+        class CachedDictView(APIView):
+            # the previous behaviour: cached serializer.data, rendered by DRF on every hit
+            def get(self, request, *args, **kwargs):
+                key = versioned_key('benchmark_detail', [product.slug], [product_tag(product.slug)])
+                return Response(cache.get(key))
+
+        self.stdout.write(f'product detail hit, {iterations} iterations (first fill {warm[0] * 1e3:.1f} ms)')
+        self.report('cached dict + DRF render', self.time_view(CachedDictView.as_view(), path, iterations))
+        self.report('pre-rendered bytes', self.time_view(detail, path, iterations, slug=product.slug))
+
+    def bench_prices(self, options):
+        """Bulk price update through app.pricing vs. one save() per product, rolled back afterwards."""
+        rows = options['rows']
+        slugs = list(Product.objects.order_by('pk').values_list('slug', flat=True)[:rows])
+        if len(slugs) < rows:
+            raise CommandError(f'Needs at least {rows} products in the database, found {len(slugs)}')
+        records = [{'slug': slug, 'price': round(random.uniform(1, 1000), 2)} for slug in slugs]
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            results = pricing.apply_prices(records)
+            bulk = time.perf_counter() - started
+            transaction.set_rollback(True)
+        self.stdout.write(f'{pricing.summary(results)}')
+        self.stdout.write(f'{"bulk update":<32} {bulk:8.2f} s   {rows / bulk:10.0f} rows/s')
+
+        # the per-request path is too slow to run in full, a sample is timed and extrapolated
+        sample = records[:min(rows, 500)]
+        with transaction.atomic():
+            started = time.perf_counter()
+            for record in sample:
+                product = Product.objects.get(slug=record['slug'])
+                product.price = record['price']
+                product.save()
+            single = (time.perf_counter() - started) / len(sample) * rows
+            transaction.set_rollback(True)
+        self.stdout.write(f'{"save() per product":<32} {single:8.2f} s   {rows / single:10.0f} rows/s (from {len(sample)} rows)')
@@ -0,0 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app import images
+from app.models import Category, Group, Image
+from app.signals import image_tags
+
+
+def generate(job):
+    try:
+        images.generate(*job)
+    finally:
+        # each pool thread opened a connection of its own
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Render the thumbnails and WebP variants of every category, group and product image that lacks them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=images.WORKERS)
+        parser.add_argument('--force', action='store_true', help='render images that already have variants again')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        pending = []
+        for model in (Category, Group, Image):
+            for instance in model.objects.exclude(image='').iterator(chunk_size=2000):
+                if options['force'] or images.needs_variants(instance):
+                    pending.append((model, instance.pk, image_tags(instance)))
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for _ in executor.map(generate, pending):
+                pass
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(pending)} images rendered in {time.perf_counter() - started:.1f} s'
+        ))
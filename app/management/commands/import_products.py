@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import importer
+
+
+class Command(BaseCommand):
+    help = 'Import products from a CSV or JSONL file, continuing an interrupted run of the same name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=importer.FORMATS, help='taken from the file extension by default')
+        parser.add_argument('--name', help='run name used to resume, the file name by default')
+        parser.add_argument('--chunk-size', type=int, default=importer.CHUNK_SIZE)
+        parser.add_argument('--restart', action='store_true', help='start the run over from the first record')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        try:
+            format = importer.detect_format(path.name, options['format'])
+        except ValueError as error:
+            raise CommandError(error)
+        name = options['name'] or path.name
+
+        def progress(run_importer):
+            stats = run_importer.stats()
+            self.stdout.write(
+                f'record {stats["position"]:>9}  created {stats["created"]:>9}  failed {stats["failed"]:>7}  '
+                f'{stats["rows_per_second"]:>9.1f} rows/s'
+            )
+
+        try:
+            with path.open('rb') as stream:
+                result = importer.import_products(
+                    stream, format, name, source=str(path), restart=options['restart'],
+                    chunk_size=options['chunk_size'], progress=progress,
+                )
+        except (OSError, ValueError) as error:
+            raise CommandError(f'{error}, run the command again to continue after the last committed chunk')
+
+        stats = result.stats()
+        for error in stats['errors']:
+            self.stderr.write(f'record {error["record"]}: {error["error"]}')
+        if not result.processed:
+            self.stdout.write(f'run {name!r} already finished, use --restart to import the file again')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats["created"]} products created, {stats["failed"]} records failed, {stats["rows_per_second"]} rows/s'
+        ))
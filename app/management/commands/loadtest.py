@@ -0,0 +1,166 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+
+from app.models import Group, Product
+
+MODES = ('wsgi', 'asgi')
+# the same client for both handlers, outside INTERNAL_IPS so neither renders the debug toolbar
+CLIENT = ('192.0.2.1', 0)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the catalog reads through the WSGI handler and their async twins through the ASGI handler, '
+        'in-process and against the configured database and cache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=[*MODES, 'both'], default='both')
+        parser.add_argument('--requests', type=int, default=2000, help='requests per mode')
+        parser.add_argument('--concurrency', type=int, default=32, help='requests in flight')
+        parser.add_argument('--products', type=int, default=20, help='distinct products in the request mix')
+        parser.add_argument('--host', default='localhost', help='Host header, has to be in ALLOWED_HOSTS')
+        parser.add_argument('--db-latency', type=float, default=0,
+                            help='milliseconds added to every query, a local database answers too fast '
+                                 'to tell blocking from non-blocking waits')
+        parser.add_argument('--cold', action='store_true', help='clear the cache before each mode instead of warming it')
+
+    def handle(self, *args, **options):
+        paths = self.request_mix(options['products'])
+        if options['db_latency']:
+            self.add_db_latency(options['db_latency'] / 1000)
+
+        self.stdout.write(
+            f'{options["requests"]} requests per mode, {options["concurrency"]} in flight, '
+            f'{len(paths)} distinct urls, {options["db_latency"]} ms added per query'
+        )
+        modes = MODES if options['mode'] == 'both' else [options['mode']]
+        for mode in modes:
+            mode_paths = [pair[MODES.index(mode)] for pair in paths]
+            run = getattr(self, f'run_{mode}')
+            if options['cold']:
+                cache.clear()
+            else:
+                run(mode_paths, len(mode_paths), options)
+            started = time.perf_counter()
+            timings, errors = run(mode_paths, options['requests'], options)
+            self.report(mode, timings, errors, time.perf_counter() - started)
+
+    def request_mix(self, products):
+        """``(sync path, async path)`` of the category list, a product page of each group and the top products."""
+        urls = [('category-list', {})]
+        for category_slug, slug in Group.objects.values_list('category__slug', 'slug')[:products]:
+            urls.append(('product-list', {'category_slug': category_slug, 'slug': slug}))
+        slugs = list(Product.objects.order_by('-like_count', '-pk').values_list('slug', flat=True)[:products])
+        if not slugs:
+            raise CommandError('Needs at least one product in the database')
+        for slug in slugs:
+            urls.append(('product-detail', {'slug': slug}))
+            urls.append(('product-attributes', {'slug': slug}))
+        return [(reverse(name, kwargs=kwargs), reverse(f'async-{name}', kwargs=kwargs)) for name, kwargs in urls]
+
+    def add_db_latency(self, seconds):
+        def delay(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def install(sender, connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        # every connection opened from now on, by any thread
+        connections.close_all()
+        connection_created.connect(install, weak=False)
+
+    def run_wsgi(self, paths, requests, options):
+        application = get_wsgi_application()
+        host = options['host']
+
+        def call(path):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': host, 'HTTP_ACCEPT': 'application/json',
+                'REMOTE_ADDR': CLIENT[0], 'REMOTE_PORT': str(CLIENT[1]),
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'http',
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+                'wsgi.version': (1, 0),
+            }
+            statuses = []
+            started = time.perf_counter()
+            response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                b''.join(response)
+            finally:
+                # sends request_finished, which closes the thread's connections like a WSGI server does
+                response.close()
+            return time.perf_counter() - started, int(statuses[0].split()[0])
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(call, (paths[number % len(paths)] for number in range(requests))))
+        return [elapsed for elapsed, _ in results], sum(status >= 400 for _, status in results)
+
+    def run_asgi(self, paths, requests, options):
+        application = get_asgi_application()
+        headers = [(b'host', options['host'].encode()), (b'accept', b'application/json')]
+
+        async def call(path):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'headers': headers, 'client': CLIENT, 'server': (options['host'], 80),
+            }
+            received = False
+            status = None
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # the client never disconnects, Django cancels this once the response is sent
+                await asyncio.Future()
+
+            async def send(message):
+                nonlocal status
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            return time.perf_counter() - started, status
+
+        async def main():
+            queue = asyncio.Queue()
+            for number in range(requests):
+                queue.put_nowait(paths[number % len(paths)])
+            results = []
+
+            async def worker():
+                while not queue.empty():
+                    results.append(await call(queue.get_nowait()))
+
+            await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+            return results
+
+        results = asyncio.run(main())
+        return [elapsed for elapsed, _ in results], sum(status >= 400 for _, status in results)
+
+    def report(self, mode, timings, errors, elapsed):
+        timings = sorted(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'{mode:<5} {len(timings) / elapsed:8.1f} req/s   p50 {statistics.median(timings) * 1e3:7.2f} ms   '
+            f'p95 {p95 * 1e3:7.2f} ms   {errors} errors'
+        )
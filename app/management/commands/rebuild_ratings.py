@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.cache import bump, category_tag, group_tag, product_tag
+from app.models import Product
+from app.ratings import RATING_FIELDS, rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized rating aggregates on Product from the Comment table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        total = 0
+        while True:
+            with transaction.atomic():
+                products = list(
+                    Product.objects.select_for_update(of=('self',))
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .select_related('group__category')
+                    .only('pk', 'slug', 'group__slug', 'group__category__slug', *RATING_FIELDS)[:batch_size]
+                )
+                if not products:
+                    break
+                before = {product.pk: [getattr(product, field) for field in RATING_FIELDS] for product in products}
+                rebuild_ratings(products)
+                changed = [
+                    product for product in products
+                    if [getattr(product, field) for field in RATING_FIELDS] != before[product.pk]
+                ]
+                Product.objects.bulk_update(changed, RATING_FIELDS)
+
+                # bulk_update sends no post_save, the cached bodies showing the old ratings go here
+                tags = {product_tag(product.slug) for product in changed}
+                tags.update(group_tag(product.group.slug) for product in changed)
+                tags.update(category_tag(product.group.category.slug) for product in changed)
+                if tags:
+                    transaction.on_commit(lambda tags=sorted(tags): bump(*tags))
+
+            last_pk = products[-1].pk
+            total += len(products)
+            self.stdout.write(f'{total} products rebuilt')
+
+        self.stdout.write(self.style.SUCCESS(f'Rating aggregates rebuilt for {total} products'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from app.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run the tasks queued by the signal receivers: search reindexing, image variants, like recounts, cache warming'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='tasks run at the same time')
+        parser.add_argument('--mode', choices=('thread', 'process'), default='thread',
+                            help='run tasks in threads, or in processes for CPU bound ones')
+        parser.add_argument('--poll', type=float, default=1.0, help='seconds between polls of an empty queue')
+        parser.add_argument('--once', action='store_true', help='exit once the queue is drained')
+
+    def handle(self, *args, **options):
+        worker = Worker(options['concurrency'], options['mode'], options['poll'])
+        self.stdout.write(f'Worker {worker.name} running {options["concurrency"]} {options["mode"]}s')
+        try:
+            processed = worker.run(once=options['once'])
+        except KeyboardInterrupt:
+            processed = worker.processed
+        self.stdout.write(self.style.SUCCESS(f'{processed} tasks processed'))
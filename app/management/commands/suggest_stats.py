@@ -0,0 +1,39 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from app.suggest import Suggester
+
+
+class Command(BaseCommand):
+    help = 'Build the suggestion index once and report its build time, memory footprint and lookup latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', action='append', default=[], help='prefixes to time, repeatable')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        suggester = Suggester(generation=0)
+        suggester.bulk_load()
+        elapsed = time.perf_counter() - started
+
+        # a second build under tracemalloc, tracing slows the first one down too much to time it
+        tracemalloc.start()
+        traced = Suggester(generation=0)
+        traced.bulk_load()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del traced
+
+        stats = suggester.stats()
+        self.stdout.write(f'{stats["entries"]} entries, {stats["keys"]} keys built in {elapsed:.2f} s')
+        self.stdout.write(f'memory: {current / 2 ** 20:.1f} MiB retained, {peak / 2 ** 20:.1f} MiB peak while building')
+
+        queries = options['query'] or ['a', 'sa', 'sam', 'iph', 'phone']
+        for query in queries:
+            started = time.perf_counter()
+            for _ in range(100):
+                suggestions = suggester.suggest(query, 8)
+            per_call = (time.perf_counter() - started) / 100
+            self.stdout.write(f'{query!r:<12} {per_call * 1e6:8.1f} us  {len(suggestions)} suggestions')
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.warming import RANKINGS, Warmer
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the category list, the first product page of the hottest groups and the hottest product pages '
+        'into the response caches, e.g. after a deploy or a cache flush'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=settings.CACHE_WARM_URL,
+                            help='public address of the site, absolute urls in the responses use it '
+                                 '(default: CACHE_WARM_URL)')
+        parser.add_argument('--groups', type=int, default=50, help='how many groups to warm')
+        parser.add_argument('--products', type=int, default=500, help='how many products to warm')
+        parser.add_argument('--by', choices=RANKINGS, default='likes',
+                            help='rank by like count, or by comments written in the last --days')
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--workers', type=int, default=8, help='threads rendering responses')
+        parser.add_argument('--db-budget', type=int, default=4, help='queries allowed in flight at the same time')
+
+    def handle(self, *args, **options):
+        if not options['url']:
+            raise CommandError('Pass --url or set CACHE_WARM_URL, cached responses depend on the host')
+        warmer = Warmer(options['url'], options['workers'], options['db_budget'])
+        stats = warmer.run(options['groups'], options['products'], options['by'], options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats["warmed"]} keys warmed, {stats["fresh"]} already warm, {stats["failed"]} failed '
+            f'in {stats["seconds"]} s'
+        ))
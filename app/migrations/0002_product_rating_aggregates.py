@@ -0,0 +1,102 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    Comment = apps.get_model('app', 'Comment')
+    rows = Comment.objects.values('product_id', 'rating').annotate(total=Count('id')).order_by()
+    totals = {}
+    for row in rows:
+        fields = totals.setdefault(row['product_id'], {'rating_count': 0, 'rating_sum': 0})
+        fields['rating_count'] += row['total']
+        fields['rating_sum'] += row['total'] * row['rating']
+        fields[f'stars_{row["rating"]}'] = row['total']
+    for product_id, fields in totals.items():
+        Product.objects.filter(pk=product_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_0',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='app.product'),
+        ),
+        migrations.AlterField(
+            model_name='group',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='groups', to='app.category'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='app.product'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='app.group'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='user_like',
+            field=models.ManyToManyField(related_name='user_like', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='productattribute',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attributes', to='app.product'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_like_count(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    rows = Product.user_like.through.objects.values('product_id').annotate(total=Count('id')).order_by()
+    for row in rows:
+        Product.objects.filter(pk=row['product_id']).update(like_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_like_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+from django.db import OperationalError, migrations
+
+SEARCH_TABLE = 'app_product_search'
+VOCABULARY_TABLE = 'app_product_search_vocab'
+
+
+def create_search_table(apps, schema_editor):
+    """
+    FTS5 table for app.search on SQLite builds that have the extension.
+
+    Other databases, or SQLite without FTS5, skip it and app.search falls back to its in-process index.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Product = apps.get_model('app', 'Product')
+    Group = apps.get_model('app', 'Group')
+    Category = apps.get_model('app', 'Category')
+    ProductAttribute = apps.get_model('app', 'ProductAttribute')
+    AttributeValue = apps.get_model('app', 'AttributeValue')
+
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5('
+                "name, description, taxonomy, attributes, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            return
+        cursor.execute(f'CREATE VIRTUAL TABLE {VOCABULARY_TABLE} USING fts5vocab({SEARCH_TABLE}, row)')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, taxonomy, attributes) '
+            f"SELECT p.id, p.name, p.description, g.name || ' ' || c.title, "
+            f"(SELECT group_concat(v.value, ' ') FROM {ProductAttribute._meta.db_table} pa "
+            f'JOIN {AttributeValue._meta.db_table} v ON v.id = pa.value_id WHERE pa.product_id = p.id) '
+            f'FROM {Product._meta.db_table} p '
+            f'JOIN {Group._meta.db_table} g ON g.id = p.group_id '
+            f'JOIN {Category._meta.db_table} c ON c.id = g.category_id'
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {VOCABULARY_TABLE}')
+        cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_category_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
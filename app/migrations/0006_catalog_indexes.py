@@ -0,0 +1,58 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def demote_extra_primary_images(apps, schema_editor):
+    """Keep the oldest primary image of each product primary, the constraint below allows only one."""
+    Image = apps.get_model('app', 'Image')
+    duplicated = (
+        Image.objects.filter(is_primary=True).values('product_id')
+        .annotate(count=Count('id'), first=Min('id')).filter(count__gt=1)
+    )
+    for row in duplicated.iterator():
+        Image.objects.filter(product_id=row['product_id'], is_primary=True).exclude(pk=row['first']).update(
+            is_primary=False,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_product_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # the composite indexes first, the single column FK indexes they replace are dropped after them
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['group', 'created_at', 'id'], name='product_group_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['group', 'price', 'id'], name='product_group_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['product', 'rating'], name='comment_product_rating_idx'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='group',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='products', to='app.group'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='app.product'),
+        ),
+        migrations.RunPython(demote_extra_primary_images, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='image',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_primary', True)), fields=('product',), name='unique_primary_image'),
+        ),
+    ]
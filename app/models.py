@@ -1,7 +1,9 @@
-from django.db import models
-from django.utils.text import slugify
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 
+from app.slugs import save_with_unique_slug
+
 
 # Create your models here.
 
@@ -14,15 +16,16 @@ class TimestampedModel(models.Model):
         abstract = True
 
 
-class Category(models.Model):
+class Category(TimestampedModel):
     title = models.CharField(max_length=300, unique=True)
     slug = models.SlugField(max_length=300, unique=True, editable=False, blank=True, null=False)
     image = models.ImageField(upload_to='images/')
+    # resized and WebP renderings of image, written by app.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
-
+            return save_with_unique_slug(self, self.title, lambda: super(Category, self).save(*args, **kwargs))
         super(Category, self).save(*args, **kwargs)
 
     def __str__(self):
@@ -34,15 +37,12 @@ class Group(TimestampedModel):
     slug = models.SlugField(max_length=300, unique=True, editable=False, blank=True, null=False)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='groups')
     image = models.ImageField(upload_to='images/')
+    # resized and WebP renderings of image, written by app.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
-            original_slug = self.slug
-            counter = 1
-            while Group.objects.filter(slug=self.slug).exists():
-                self.slug = f'{original_slug}-{counter}'
-                counter += 1
+            return save_with_unique_slug(self, self.name, lambda: super(Group, self).save(*args, **kwargs))
         super(Group, self).save(*args, **kwargs)
 
     def __str__(self):
@@ -54,18 +54,32 @@ class Product(TimestampedModel):
     description = models.TextField()
     price = models.FloatField()
     slug = models.SlugField(max_length=300, unique=True, editable=False, blank=True, null=False)
-    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='products')
+    # looked up through the (group, ...) indexes below, a separate index on group alone would be redundant
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='products', db_index=False)
     discount = models.FloatField(default=0)
     user_like = models.ManyToManyField(User, related_name='user_like')
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # rating aggregates, maintained by app.ratings whenever a Comment changes
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    stars_0 = models.PositiveIntegerField(default=0, editable=False)
+    stars_1 = models.PositiveIntegerField(default=0, editable=False)
+    stars_2 = models.PositiveIntegerField(default=0, editable=False)
+    stars_3 = models.PositiveIntegerField(default=0, editable=False)
+    stars_4 = models.PositiveIntegerField(default=0, editable=False)
+    stars_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # a group's page in each keyset ordering, pk breaks ties the same way KeysetPagination does
+            models.Index(fields=['group', 'created_at', 'id'], name='product_group_created_idx'),
+            models.Index(fields=['group', 'price', 'id'], name='product_group_price_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
-            original_slug = self.slug
-            counter = 1
-            while Product.objects.filter(slug=self.slug).exists():
-                self.slug = f'{original_slug}-{counter}'
-                counter += 1
+            return save_with_unique_slug(self, self.name, lambda: super(Product, self).save(*args, **kwargs))
         super(Product, self).save(*args, **kwargs)
 
     @property
@@ -74,10 +88,22 @@ class Product(TimestampedModel):
             return self.price * (1 - self.discount / 100)
         return self.price
 
+    @property
+    def avg_rating(self):
+        if not self.rating_count:
+            return 0
+        return self.rating_sum / self.rating_count
+
+    @property
+    def rating_histogram(self) -> dict:
+        return {stars: getattr(self, f'stars_{stars}') for stars in range(6)}
+
     def get_attribute(self):
-        product_attribute = ProductAttribute.objects.filter(product=self)
+        # one query with keys and values joined in, none when they were prefetched
+        from app.attributes import load_attributes
+
         attributes = []
-        for prod_at in product_attribute:
+        for prod_at in load_attributes([self])[self.pk]:
             attributes.append({
                 'attribute_key': prod_at.key,
                 'attribute_value': prod_at.value
@@ -101,9 +127,19 @@ class Product(TimestampedModel):
 
 class Image(models.Model):
     image = models.ImageField(upload_to='images/')
+    # resized and WebP renderings of image, written by app.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     is_primary = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            # a partial unique index, it also serves the primary image lookups of the product serializers
+            models.UniqueConstraint(
+                fields=['product'], condition=models.Q(is_primary=True), name='unique_primary_image',
+            ),
+        ]
+
 
 class Comment(TimestampedModel):
     class Rating(models.IntegerChoices):
@@ -115,17 +151,29 @@ class Comment(TimestampedModel):
         five = 5
 
     rating = models.IntegerField(choices=Rating.choices, default=Rating.zero.value)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='comments')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='comments', db_index=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     comment = models.TextField()
 
+    class Meta:
+        indexes = [
+            # rebuild_ratings groups a product's comments by rating without reading the table
+            models.Index(fields=['product', 'rating'], name='comment_product_rating_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.user:
             request = kwargs.get('request')
             user = request.user
             self.user = user
 
-        super(Comment, self).save(*args, **kwargs)
+        # keeps the rating aggregates written by the signals in the same transaction
+        with transaction.atomic():
+            super(Comment, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super(Comment, self).delete(*args, **kwargs)
 
 
 class AttributeKey(models.Model):
@@ -146,3 +194,53 @@ class ProductAttribute(models.Model):
     product = models.ForeignKey('app.Product', on_delete=models.CASCADE, related_name='attributes')
     key = models.ForeignKey('app.AttributeKey', on_delete=models.CASCADE)
     value = models.ForeignKey('app.AttributeValue', on_delete=models.CASCADE)
+
+
+class ImportRun(TimestampedModel):
+    """Progress of one bulk product import, see app.importer. Updated in the transaction of every chunk."""
+    name = models.CharField(max_length=300, unique=True)
+    source = models.CharField(max_length=500, blank=True)
+    position = models.PositiveIntegerField(default=0)  # records consumed, valid or not
+    created = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Task(TimestampedModel):
+    """A unit of deferred work, run by the ``run_tasks`` worker; see app.tasks."""
+    class Status(models.TextChoices):
+        pending = 'pending'
+        running = 'running'
+        failed = 'failed'
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)  # higher runs first
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.pending)
+    # a pending task with the same key absorbs new enqueues, one that already started doesn't
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # the claim query, finished tasks are deleted so this index only holds the backlog
+            models.Index(
+                fields=['-priority', 'run_at', 'id'], condition=models.Q(status='pending'), name='task_pending_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'], condition=models.Q(status='pending'), name='unique_pending_task',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,188 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+Cursor = namedtuple('Cursor', ['value', 'pk', 'reverse'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a stable ``(sort field, id)`` key.
+
+    Every page is fetched with ``WHERE (field, id) > (last field, last id)`` instead of
+    OFFSET, so page 500 costs the same as page 1.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+
+    # allowed sort keys, `id` is always added as the tie breaker
+    orderings = ('created_at', '-created_at', 'price', '-price')
+    default_ordering = '-created_at'
+
+    # the total count is one extra COUNT(*) per page, clients can switch it off with ?count=false
+    include_count = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.start_page(request, queryset.model)
+        self.count = queryset.count() if self.get_include_count(request) else None
+        return self.end_page(list(self.page_queryset(queryset)))
+
+    def start_page(self, request, model):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        self.cursor = self.decode_cursor(request, model)
+
+    def page_queryset(self, queryset):
+        """The rows of the page plus one, which tells whether there is another page."""
+        cursor = self.cursor
+        field = self.ordering.lstrip('-')
+        # walking backwards means reading the same index in the opposite direction
+        descending = self.ordering.startswith('-') != bool(cursor and cursor.reverse)
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}pk')
+
+        # the cursor is built from the sort key, keep it loaded if the queryset was narrowed with only()
+        loaded, deferred = queryset.query.deferred_loading
+        if loaded and not deferred:
+            queryset = queryset.only(*loaded, field)
+
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(field, cursor.value, cursor.pk, descending))
+        return queryset[:self.page_size + 1]
+
+    def end_page(self, results):
+        cursor = self.cursor
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if cursor is not None and cursor.reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.next_cursor = self.make_cursor(results[-1], reverse=False) if results and self.has_next else None
+        self.previous_cursor = self.make_cursor(results[0], reverse=True) if results and self.has_previous else None
+        return results
+
+    def get_state(self):
+        # everything needed to rebuild the response for a page from a list of ids
+        return {'next': self.next_cursor, 'previous': self.previous_cursor, 'count': self.count}
+
+    def restore_state(self, request, state):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.next_cursor = state['next']
+        self.previous_cursor = state['previous']
+        self.count = state['count']
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        return self.build_link(self.next_cursor)
+
+    def get_previous_link(self):
+        return self.build_link(self.previous_cursor)
+
+    def build_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_keyset_filter(self, field, value, pk, descending):
+        if descending:
+            return Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk})
+        return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering not in self.orderings:
+            return self.default_ordering
+        return ordering
+
+    def get_include_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.include_count
+        return value.lower() not in ('0', 'false', 'no', 'off')
+
+    def make_cursor(self, obj, reverse):
+        value = getattr(obj, self.ordering.lstrip('-'))
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        payload = {'v': value, 'pk': obj.pk, 'o': self.ordering}
+        if reverse:
+            payload['r'] = 1
+        encoded = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(encoded).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            value = payload['v']
+            pk = int(payload['pk'])
+        except (TypeError, ValueError, KeyError, OverflowError, binascii.Error):
+            raise NotFound('Invalid cursor')
+        # a cursor is only meaningful for the ordering it was built with
+        if payload.get('o') != self.ordering:
+            raise NotFound('Invalid cursor')
+        # a well-formed cursor can still carry a value the sort field can't hold, or an id no row has
+        if value is None or isinstance(value, (bool, list, dict)) or not -2 ** 63 <= pk < 2 ** 63:
+            raise NotFound('Invalid cursor')
+        try:
+            value = model._meta.get_field(self.ordering.lstrip('-')).to_python(value)
+        except (TypeError, ValueError, OverflowError, ValidationError):
+            raise NotFound('Invalid cursor')
+        return Cursor(value, pk, bool(payload.get('r')))
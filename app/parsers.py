@@ -0,0 +1,18 @@
+import codecs
+
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    ``application/x-ndjson`` bodies as a lazy iterator over their non-blank lines.
+
+    Lines are left undecoded, the view decodes each one as it consumes it, so a large
+    body is processed while it is read and one broken line fails alone.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return iter(())
+        return (line for line in codecs.iterdecode(stream, 'utf-8-sig') if line.strip())
@@ -0,0 +1,88 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.permissions import SAFE_METHODS
+
+
+class QueryPlan:
+    def __init__(self, only=(), select=(), prefetch=()):
+        self.only = list(dict.fromkeys(only))
+        self.select = list(dict.fromkeys(select))
+        self.prefetch = list(prefetch)
+
+    def apply(self, queryset):
+        if self.select:
+            queryset = queryset.select_related(*self.select)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch)
+        return queryset.only(*self.only)
+
+
+def plan_queryset(queryset, serializer_class):
+    """
+    Restrict ``queryset`` to the columns and relations ``serializer_class`` renders.
+
+    Model fields are resolved from the serializer's field sources, everything else
+    (method fields, properties) has to be declared in ``Meta.relations``::
+
+        relations = {
+            'image': {'prefetch': [Prefetch('images', queryset=...)]},
+            'avg_rating': {'only': ['rating_count', 'rating_sum']},
+        }
+    """
+    return build_plan(serializer_class, queryset.model).apply(queryset)
+
+
+@lru_cache(maxsize=None)
+def build_plan(serializer_class, model):
+    declared = getattr(serializer_class.Meta, 'relations', {})
+    only = [model._meta.pk.name]
+    select = []
+    prefetch = []
+
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if name in declared:
+            plan = declared[name]
+            only += plan.get('only', [])
+            select += plan.get('select', [])
+            prefetch += plan.get('prefetch', [])
+            continue
+        if field.source == '*':
+            continue
+        resolve_source(model, field.source.split('.'), only, select, prefetch)
+
+    # a relation followed with select_related can't be deferred
+    for path in select:
+        only.append(path)
+    return QueryPlan(only, select, prefetch)
+
+
+def resolve_source(model, parts, only, select, prefetch, prefix=''):
+    try:
+        model_field = model._meta.get_field(parts[0])
+    except FieldDoesNotExist:
+        # a property or a method, only declared relations are planned for those
+        return
+    path = f'{prefix}{model_field.name}'
+
+    if model_field.many_to_many or model_field.one_to_many:
+        prefetch.append(path)
+    elif len(parts) > 1 and model_field.is_relation:
+        select.append(path)
+        resolve_source(model_field.related_model, parts[1:], only, select, prefetch, prefix=f'{path}__')
+    elif model_field.concrete:
+        only.append(path)
+
+
+class PlannedQuerysetMixin:
+    """Applies the serializer's query plan on top of the view's own filtering."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            # writes save the instance they load, a deferred one only saves its loaded fields
+            # and would leave out updated_at
+            return queryset
+        return plan_queryset(queryset, self.get_serializer_class())
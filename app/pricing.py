@@ -0,0 +1,165 @@
+import json
+import logging
+
+from django.db import DatabaseError, connections, router, transaction
+from django.utils import timezone
+
+from app.cache import bump, category_tag, group_tag, product_tag
+from app.importer import number
+from app.models import Product
+
+logger = logging.getLogger(__name__)
+
+# also bounds the slug__in list, older SQLite builds allow 999 bound parameters
+CHUNK_SIZE = 500
+FIELDS = ('price', 'discount')
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+
+def clean(record):
+    """``(slug, {field: value})`` of one ``{slug, price, discount}`` record, ValueError if it can't be applied."""
+    if isinstance(record, str):
+        # a line of an NDJSON body
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError as error:
+            raise ValueError(f'invalid JSON: {error.msg}')
+    if not isinstance(record, dict):
+        raise ValueError('expected an object')
+    slug = record.get('slug')
+    if not isinstance(slug, str) or not slug:
+        raise ValueError('slug is required')
+    changes = {field: number(record[field], field) for field in FIELDS if record.get(field) is not None}
+    if not changes:
+        raise ValueError('price or discount is required')
+    if changes.get('price', 0) < 0:
+        raise ValueError('price must not be negative')
+    if not 0 <= changes.get('discount', 0) <= 100:
+        raise ValueError('discount must be between 0 and 100')
+    return slug, changes
+
+
+def write_prices(alias, products):
+    """
+    Save the price fields of ``products`` with one UPDATE statement executed per product.
+
+    ``bulk_update`` builds a CASE expression per row and field, which costs about half a
+    millisecond of Python per product; executemany binds the parameters of a single
+    prepared statement instead, around 75 times faster on SQLite.
+    """
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    fields = [Product._meta.get_field(name) for name in (*FIELDS, 'updated_at')]
+    assignments = ', '.join(f'{quote(field.column)} = %s' for field in fields)
+    sql = f'UPDATE {quote(Product._meta.db_table)} SET {assignments} WHERE {quote(Product._meta.pk.column)} = %s'
+    rows = [
+        [*(field.get_db_prep_save(getattr(product, field.attname), connection) for field in fields), product.pk]
+        for product in products
+    ]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+def apply_chunk(records, first=1):
+    """Apply one chunk of records in one transaction, one result per record, ``first`` numbers the first."""
+    results = []
+    changes = {}  # slug -> fields, a later record for the same slug wins
+    for number, record in enumerate(records, first):
+        try:
+            slug, fields = clean(record)
+        except ValueError as error:
+            results.append({**reference(number, record), 'status': INVALID, 'error': str(error)})
+            continue
+        changes.setdefault(slug, {}).update(fields)
+        results.append({'slug': slug, 'status': None})
+
+    alias = router.db_for_write(Product)
+    with transaction.atomic(using=alias):
+        products = (
+            Product.objects.using(alias).select_for_update(of=('self',)).filter(slug__in=changes)
+            .only('pk', 'slug', 'price', 'discount', 'group__slug', 'group__category__slug')
+            .select_related('group__category')
+        )
+        products = {product.slug: product for product in products}
+        now = timezone.now()
+        updated = []
+        for slug, fields in changes.items():
+            product = products.get(slug)
+            if product is None or all(getattr(product, field) == value for field, value in fields.items()):
+                continue
+            for field, value in fields.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            updated.append(product)
+        write_prices(alias, updated)
+
+        # one bump for the whole chunk instead of a post_save per product
+        tags = {product_tag(product.slug) for product in updated}
+        tags.update(group_tag(product.group.slug) for product in updated)
+        tags.update(category_tag(product.group.category.slug) for product in updated)
+        if tags:
+            transaction.on_commit(lambda: bump(*sorted(tags)), using=alias)
+
+    updated_slugs = {product.slug for product in updated}
+    for result in results:
+        if result['status'] is None:
+            slug = result['slug']
+            result['status'] = UPDATED if slug in updated_slugs else UNCHANGED if slug in products else NOT_FOUND
+    return results
+
+
+def apply_prices(records, chunk_size=CHUNK_SIZE):
+    """
+    Apply a stream of ``{slug, price, discount}`` records, ``chunk_size`` per transaction.
+
+    ``records`` is consumed lazily, so NDJSON bodies are never held in memory whole. A
+    chunk whose transaction fails rolls back alone, its records are reported as failed
+    and the chunks before and after it still apply.
+    """
+    results = []
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            # one result per record, the next chunk starts after them
+            results.extend(apply_or_fail(chunk, len(results) + 1))
+            chunk = []
+    if chunk:
+        results.extend(apply_or_fail(chunk, len(results) + 1))
+    return results
+
+
+def apply_or_fail(records, first=1):
+    try:
+        return apply_chunk(records, first)
+    except DatabaseError as error:
+        logger.exception('Price chunk of %s records rolled back', len(records))
+        return [
+            {**reference(number, record), 'status': FAILED, 'error': str(error)}
+            for number, record in enumerate(records, first)
+        ]
+
+
+def reference(number, record):
+    """
+    How a result names its record: ``{'slug': ...}``, or ``{'record': number}`` for a record
+    without a usable slug, numbered from 1 in the stream like the importer's errors.
+    """
+    try:
+        slug = clean(record)[0]
+    except ValueError:
+        slug = record.get('slug') if isinstance(record, dict) else None
+    return {'slug': slug} if isinstance(slug, str) and slug else {'record': number}
+
+
+def summary(results):
+    counts = {status: 0 for status in (UPDATED, UNCHANGED, NOT_FOUND, INVALID, FAILED)}
+    for result in results:
+        counts[result['status']] += 1
+    return counts
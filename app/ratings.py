@@ -0,0 +1,46 @@
+from django.db.models import Count, F
+
+from app.models import Comment, Product
+
+RATING_FIELDS = ['rating_count', 'rating_sum'] + [f'stars_{stars}' for stars in range(6)]
+
+
+def apply_rating(product_id, rating, sign=1):
+    # F() expressions keep concurrent comment writes from losing updates
+    Product.objects.filter(pk=product_id).update(**{
+        'rating_count': F('rating_count') + sign,
+        'rating_sum': F('rating_sum') + sign * rating,
+        f'stars_{rating}': F(f'stars_{rating}') + sign,
+    })
+
+
+def add_rating(product_id, rating):
+    apply_rating(product_id, rating, 1)
+
+
+def remove_rating(product_id, rating):
+    apply_rating(product_id, rating, -1)
+
+
+def rebuild_ratings(products):
+    """
+    Recompute the aggregates of ``products`` from the Comment table with one GROUP BY query.
+
+    The instances are updated in place, saving them is up to the caller.
+    """
+    by_pk = {product.pk: product for product in products}
+    for product in by_pk.values():
+        for field in RATING_FIELDS:
+            setattr(product, field, 0)
+
+    rows = (Comment.objects.filter(product_id__in=by_pk)
+            .values('product_id', 'rating')
+            .annotate(total=Count('id'))
+            .order_by())
+    for row in rows:
+        product = by_pk[row['product_id']]
+        stars_field = f'stars_{row["rating"]}'
+        product.rating_count += row['total']
+        product.rating_sum += row['total'] * row['rating']
+        setattr(product, stars_field, getattr(product, stars_field) + row['total'])
+    return products
@@ -0,0 +1,27 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def ndjson_line(data):
+    """``data`` as one compact line of JSON, newline included."""
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    ``application/x-ndjson``, one line per item of a list, a single line for anything else.
+
+    Views streaming their body write the lines themselves, this renders the responses they
+    don't stream, like errors, and lets DRF negotiate the format.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return b''.join(ndjson_line(item) for item in items)
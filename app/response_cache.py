@@ -0,0 +1,45 @@
+import hashlib
+
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from app import singleflight
+
+
+def render_entry(data):
+    """Render ``data`` once into the bytes, ETag and content type that get cached."""
+    renderer = JSONRenderer()
+    body = renderer.render(data)
+    return {
+        'body': body,
+        'etag': '"%s"' % hashlib.sha1(body).hexdigest(),
+        'content_type': renderer.media_type,
+    }
+
+
+def entry_response(entry):
+    response = HttpResponse(entry['body'], content_type=entry['content_type'])
+    response['ETag'] = entry['etag']
+    return response
+
+
+class RenderedCacheMixin:
+    """
+    Serves GET responses from pre-rendered JSON bytes.
+
+    A hit skips serializers and renderers entirely, only authentication and content
+    negotiation still run. Clients asking for anything but JSON (the browsable API)
+    get the regular, uncached DRF response.
+    """
+
+    def cached_response(self, request, cache_key, fill, timeout, stale_key=None):
+        if request.accepted_renderer.format != 'json':
+            return Response(fill())
+
+        entry, cache_status = singleflight.get_or_fill(
+            cache_key, lambda: render_entry(fill()), timeout, stale_key=stale_key,
+        )
+        response = entry_response(entry)
+        response['X-Cache'] = cache_status
+        return response
@@ -0,0 +1,546 @@
+import bisect
+import hashlib
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from app import tasks
+from app.cache import LIST_TIMEOUT, ResultIdCache, bump, deltas_since, generations, publish_delta
+from app.models import Product, ProductAttribute
+
+# bumped with the ids of the reindexed products whenever a document's terms change, in-process
+# indexes replay it
+SEARCH_TAG = 'search'
+# bumped by a rebuild, every cached result depends on it
+RESULTS_TAG = 'search:results'
+SEARCH_TABLE = 'app_product_search'
+VOCABULARY_TABLE = 'app_product_search_vocab'
+
+# column order of the FTS5 table, bm25() takes the weights positionally
+FIELDS = ['name', 'description', 'taxonomy', 'attributes']
+FIELD_WEIGHTS = {'name': 4.0, 'description': 1.0, 'taxonomy': 2.0, 'attributes': 1.5}
+K1 = 1.2
+B = 0.75
+
+# the last word of a query matches as a prefix, expanded to this many of its most common terms
+MAX_PREFIX_EXPANSIONS = 20
+# completion looks at this many terms sharing the prefix before ranking them
+COMPLETION_SCAN = 5000
+# shorter prefixes are completed exactly, typos in 1-2 letters leave too many candidates
+MIN_FUZZY_PREFIX = 3
+# how often the FTS5 vocabulary behind completion and prefix matching is reloaded,
+# words that are newer than that only match when typed in full
+VOCABULARY_REFRESH = 300
+# cached results depend on the first letters of their words, a reindexed document bumps those of
+# the terms it gained or lost; results of queries sharing none stay cached. A one-letter last word
+# can expand to any term, those results depend on SEARCH_TAG
+TERM_TAG_LENGTH = 2
+# ids per statement, well below SQLite's bound parameter limit
+BATCH_SIZE = 500
+
+TOKEN_RE = re.compile(r'\w+')
+# how FTS5's unicode61 tokenizer splits, underscores separate words too
+WORD_RE = re.compile(r'[^\W_]+')
+
+search_cache = ResultIdCache('search', timeout=LIST_TIMEOUT)
+
+
+def normalize(text):
+    # casefolded and without diacritics, what FTS5's unicode61 tokenizer does with remove_diacritics 2
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text or ''))
+
+
+def term_tags(terms):
+    return sorted({f'search:terms:{word[:TERM_TAG_LENGTH]}' for term in terms for word in WORD_RE.findall(term)})
+
+
+def field_terms(fields):
+    """``{(field, term): count}`` of a document, empty for a missing one."""
+    counts = defaultdict(int)
+    for field, text in (fields or {}).items():
+        for token in tokenize(text):
+            counts[field, token] += 1
+    return counts
+
+
+def changed_terms(old, new):
+    """The terms whose count in some field differs between two versions of a document."""
+    before, after = field_terms(old), field_terms(new)
+    return {term for (field, term) in before.keys() | after.keys() if before.get((field, term)) != after.get((field, term))}
+
+
+def batches(ids, size=BATCH_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def documents(product_ids):
+    """``(pk, {field: text})`` for the products that still exist, two queries per batch."""
+    for batch in batches(product_ids):
+        attributes = defaultdict(list)
+        rows = ProductAttribute.objects.filter(product_id__in=batch).values_list('product_id', 'value__value')
+        for product_id, value in rows:
+            attributes[product_id].append(value)
+        products = Product.objects.filter(pk__in=batch).values_list(
+            'pk', 'name', 'description', 'group__name', 'group__category__title',
+        )
+        for pk, name, description, group, category in products:
+            yield pk, {
+                'name': name,
+                'description': description,
+                'taxonomy': f'{group} {category}',
+                'attributes': ' '.join(attributes[pk]),
+            }
+
+
+def weighted_frequencies(fields):
+    """``{term: frequency}`` of a document, each occurrence counted with the weight of its field (BM25F)."""
+    frequencies = defaultdict(float)
+    for field, text in fields.items():
+        weight = FIELD_WEIGHTS[field]
+        for token in tokenize(text):
+            frequencies[token] += weight
+    return frequencies
+
+
+def edits(word, alphabet):
+    """Every string one deletion, transposition, substitution or insertion away from ``word``."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    variants = {left + right[1:] for left, right in splits if right}
+    variants |= {left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1}
+    variants |= {left + char + right[1:] for left, right in splits if right for char in alphabet}
+    variants |= {left + char + right for left, right in splits[:-1] for char in alphabet}
+    variants.discard(word)
+    return variants
+
+
+class Vocabulary:
+    """Sorted terms with their document frequencies, answers prefix lookups with bisect."""
+
+    def __init__(self, frequencies=None):
+        self.frequencies = dict(frequencies or {})
+        self.terms = sorted(self.frequencies)
+        self.alphabet = set(''.join(self.terms))
+
+    def add(self, term):
+        if term not in self.frequencies:
+            bisect.insort(self.terms, term)
+            self.alphabet.update(term)
+        self.frequencies[term] = self.frequencies.get(term, 0) + 1
+
+    def discard(self, term):
+        count = self.frequencies.get(term, 0) - 1
+        if count > 0:
+            self.frequencies[term] = count
+        elif term in self.frequencies:
+            del self.frequencies[term]
+            del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def has_prefix(self, prefix):
+        position = bisect.bisect_left(self.terms, prefix)
+        return position < len(self.terms) and self.terms[position].startswith(prefix)
+
+    def prefixed(self, prefix, limit):
+        """The ``limit`` most frequent terms starting with ``prefix``."""
+        start = bisect.bisect_left(self.terms, prefix)
+        candidates = []
+        for term in self.terms[start:start + COMPLETION_SCAN]:
+            if not term.startswith(prefix):
+                break
+            candidates.append(term)
+        return heapq.nlargest(limit, candidates, key=self.frequencies.__getitem__)
+
+    def complete(self, prefix, limit):
+        """Completions of ``prefix``, the exact ones first, then those of prefixes one typo away."""
+        terms = self.prefixed(prefix, limit)
+        if len(terms) < limit and len(prefix) >= MIN_FUZZY_PREFIX:
+            fuzzy = set()
+            for variant in edits(prefix, self.alphabet):
+                if self.has_prefix(variant):
+                    fuzzy.update(self.prefixed(variant, limit))
+            fuzzy.difference_update(terms)
+            terms += heapq.nlargest(limit - len(terms), fuzzy, key=self.frequencies.__getitem__)
+        return terms
+
+
+class FTS5Backend:
+    """SQLite FTS5 table created by migration 0005, ranked by its built-in bm25()."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vocabulary = Vocabulary()
+        self.vocabulary_loaded = None
+        self.refreshing = False
+
+    def match_expression(self, tokens):
+        def quote(term):
+            return '"%s"' % term.replace('"', '""')
+
+        # the prefix is expanded from the vocabulary, FTS5's own prefix queries materialize
+        # the whole doclist of every matching term before the LIMIT applies
+        last = tokens[-1]
+        expansions = [last, *(term for term in self.get_vocabulary().prefixed(last, MAX_PREFIX_EXPANSIONS) if term != last)]
+        words = [quote(token) for token in tokens[:-1]]
+        words.append('(%s)' % ' OR '.join(quote(term) for term in expansions))
+        return ' AND '.join(words)
+
+    def search(self, tokens, limit, offset):
+        expression = self.match_expression(tokens)
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in FIELDS)
+        with connection.cursor() as cursor:
+            # every match is scored, the newest first among equal scores
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                f'ORDER BY bm25({SEARCH_TABLE}, {weights}), rowid DESC LIMIT %s OFFSET %s',
+                [expression, limit, offset],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [expression])
+            count = cursor.fetchone()[0]
+        return ids, count
+
+    def index(self, product_ids):
+        """Rewrite the documents of ``product_ids`` that changed, returns the terms they gained or lost."""
+        changed = set()
+        with transaction.atomic(), connection.cursor() as cursor:
+            # An FTS5 write reads the index before it asks for the write lock. In WAL mode a deferred
+            # transaction that read first fails with SQLITE_BUSY right away when another connection
+            # committed in between, busy_timeout doesn't apply. BEGIN IMMEDIATE would take the lock
+            # up front, but Django 5.0's atomic() only issues a plain BEGIN (transaction_mode came in
+            # 5.1) and this also runs nested in rebuild()'s and the caller's transactions, where no
+            # BEGIN can be sent. A write that matches no row takes the lock at this point in either
+            # case, waiting out busy_timeout, and is a no-op when the transaction already holds it.
+            cursor.execute(f'UPDATE {Product._meta.db_table} SET id = id WHERE 0')
+            for batch in batches(product_ids):
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f'SELECT rowid, {", ".join(FIELDS)} FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', batch)
+                old = {row[0]: dict(zip(FIELDS, row[1:])) for row in cursor.fetchall()}
+                new = dict(documents(batch))
+                # a price or like change leaves the document as it was
+                rewrite = [pk for pk in batch if old.get(pk) != new.get(pk)]
+                if not rewrite:
+                    continue
+                for pk in rewrite:
+                    changed |= changed_terms(old.get(pk), new.get(pk))
+                placeholders = ', '.join(['%s'] * len(rewrite))
+                cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', rewrite)
+                cursor.executemany(
+                    f'INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(FIELDS)}) VALUES (%s, %s, %s, %s, %s)',
+                    [(pk, *(new[pk][name] for name in FIELDS)) for pk in rewrite if pk in new],
+                )
+        return changed
+
+    def rebuild(self):
+        # one transaction, searches keep seeing the old rows until the new ones are complete
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            self.index(Product.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=BATCH_SIZE))
+            with connection.cursor() as cursor:
+                # merge the segments the batches left behind, bm25() reads every one of them
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+
+    def get_vocabulary(self):
+        # fts5vocab scans the whole index, an outdated vocabulary is reloaded in the background
+        with self.lock:
+            loaded, refreshing = self.vocabulary_loaded, self.refreshing
+            if loaded is not None and not refreshing and time.monotonic() - loaded > VOCABULARY_REFRESH:
+                self.refreshing = True
+                threading.Thread(target=self.refresh_vocabulary, daemon=True).start()
+        if loaded is None:
+            with self.lock:
+                if self.vocabulary_loaded is None:
+                    self.load_vocabulary()
+        return self.vocabulary
+
+    def load_vocabulary(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT term, doc FROM {VOCABULARY_TABLE}')
+            self.vocabulary = Vocabulary(cursor.fetchall())
+        self.vocabulary_loaded = time.monotonic()
+
+    def refresh_vocabulary(self):
+        try:
+            self.load_vocabulary()
+        finally:
+            self.refreshing = False
+            connection.close()
+
+
+class MemoryIndex:
+    """
+    BM25 over an in-process inverted index, for databases without FTS5.
+
+    Field weights scale the term frequencies (BM25F style). A posting is a pair of
+    arrays, product ids in ascending order and their weighted frequencies, so a product
+    is looked up in a posting with bisect and 200k documents fit in a few hundred
+    megabytes instead of gigabytes of dicts.
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.postings = {}  # term -> (sorted array of product ids, array of weighted term frequencies)
+        self.documents = {}  # product id -> (weighted length, terms)
+        self.total_length = 0.0
+        self.vocabulary = Vocabulary()
+
+    def add(self, pk, fields):
+        self.remove(pk)
+        frequencies = weighted_frequencies(fields)
+        length = sum(frequencies.values())
+        for term, frequency in frequencies.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array('q'), array('d'))
+            position = bisect.bisect_left(posting[0], pk)
+            posting[0].insert(position, pk)
+            posting[1].insert(position, frequency)
+            self.vocabulary.add(term)
+        self.documents[pk] = (length, tuple(frequencies))
+        self.total_length += length
+
+    def remove(self, pk):
+        document = self.documents.pop(pk, None)
+        if document is None:
+            return
+        length, terms = document
+        for term in terms:
+            ids, frequencies = self.postings[term]
+            position = bisect.bisect_left(ids, pk)
+            del ids[position]
+            del frequencies[position]
+            if not ids:
+                del self.postings[term]
+            self.vocabulary.discard(term)
+        self.total_length -= length
+
+    def reindex(self, product_ids):
+        """Index the current documents of ``product_ids``, returns the terms whose weights changed."""
+        product_ids = sorted(set(product_ids))
+        changed = set()
+        found = set()
+        for pk, fields in documents(product_ids):
+            changed |= self.changed_terms(pk, weighted_frequencies(fields))
+            self.add(pk, fields)
+            found.add(pk)
+        for pk in set(product_ids) - found:
+            changed |= self.changed_terms(pk, {})
+            self.remove(pk)
+        return changed
+
+    def changed_terms(self, pk, frequencies):
+        document = self.documents.get(pk)
+        before = {term: self.frequency(term, pk) for term in document[1]} if document else {}
+        return {term for term in before.keys() | frequencies.keys() if before.get(term) != frequencies.get(term)}
+
+    def frequency(self, term, pk):
+        ids, frequencies = self.postings[term]
+        position = bisect.bisect_left(ids, pk)
+        if position < len(ids) and ids[position] == pk:
+            return frequencies[position]
+        return 0.0
+
+    def search(self, tokens, limit, offset):
+        """Products containing every word (the last one as a prefix), best BM25 first."""
+        with self.lock:
+            if not self.documents:
+                return [], 0
+            groups = [[token] if token in self.postings else [] for token in tokens[:-1]]
+            groups.append(self.vocabulary.prefixed(tokens[-1], MAX_PREFIX_EXPANSIONS))
+            if not all(groups):
+                return [], 0
+
+            total = len(self.documents)
+            average_length = self.total_length / total
+            idf = {
+                term: math.log(1 + (total - len(self.postings[term][0]) + 0.5) / (len(self.postings[term][0]) + 0.5))
+                for terms in groups for term in terms
+            }
+
+            # candidates come from the rarest word, newest first, the other words are looked up per candidate
+            groups.sort(key=lambda terms: sum(len(self.postings[term][0]) for term in terms))
+            # merged lazily, the other postings are only looked up for the candidates
+            candidates = heapq.merge(*(reversed(self.postings[term][0]) for term in groups[0]), reverse=True)
+
+            scores = {}
+            previous = None
+            for pk in candidates:
+                if pk == previous:
+                    continue
+                previous = pk
+                norm = K1 * (1 - B + B * self.documents[pk][0] / average_length)
+                score = 0.0
+                for terms in groups:
+                    matched = False
+                    for term in terms:
+                        frequency = self.frequency(term, pk)
+                        if frequency:
+                            matched = True
+                            score += idf[term] * frequency * (K1 + 1) / (frequency + norm)
+                    if not matched:
+                        break
+                else:
+                    scores[pk] = score
+
+            best = heapq.nlargest(offset + limit, scores.items(), key=lambda item: item[1])
+            return [pk for pk, _ in best[offset:]], len(scores)
+
+
+class MemoryBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # held while every product is read into a new index, outside ``lock``
+        self.building = threading.Lock()
+        self.current = None
+
+    def get_index(self):
+        current = generations([SEARCH_TAG])[0]
+        with self.lock:
+            index = self.current
+            if index is not None and index.generation == current:
+                return index
+            if index is not None:
+                chain = deltas_since(SEARCH_TAG, index.generation, current)
+                if chain is not None:
+                    with index.lock:
+                        index.reindex({pk for product_ids in chain for pk in product_ids})
+                        index.generation = current
+                    return index
+        # too old to catch up: the other threads search it until the new one is swapped in,
+        # without an index they wait for the thread building one
+        if not self.building.acquire(blocking=index is None):
+            return index
+        try:
+            with self.lock:
+                if self.current is not None and self.current is not index:
+                    return self.current
+            return self.build(current)
+        finally:
+            self.building.release()
+
+    def build(self, generation):
+        # generation first, deltas committed while the rows are read are replayed later
+        index = MemoryIndex(generation)
+        index.reindex(Product.objects.values_list('pk', flat=True))
+        with self.lock:
+            self.current = index
+        return index
+
+    def search(self, tokens, limit, offset):
+        return self.get_index().search(tokens, limit, offset)
+
+    def index(self, product_ids):
+        # the other processes pick the change up from the published delta, replaying it here again is harmless
+        index = self.get_index()
+        with index.lock:
+            return index.reindex(product_ids)
+
+    def rebuild(self):
+        # search.rebuild() bumps SEARCH_TAG without a delta, the next get_index builds a new
+        # index while the other threads keep searching this one
+        pass
+
+    def get_vocabulary(self):
+        return self.get_index().vocabulary
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = FTS5Backend() if fts5_available() else MemoryBackend()
+        return _backend
+
+
+def search(query, limit, offset=0):
+    """``(product ids, total)`` of the products matching ``query``, best first."""
+    tokens = tokenize(query)
+    if not tokens:
+        return [], 0
+
+    def fill():
+        ids, count = get_backend().search(tokens, limit, offset)
+        return ids, {'count': count}
+
+    tags = [RESULTS_TAG, *term_tags(tokens)]
+    if len(tokens[-1]) < TERM_TAG_LENGTH:
+        tags.append(SEARCH_TAG)
+    # hashed, queries can be long and contain spaces which some cache backends reject in keys
+    digest = hashlib.sha1(' '.join(tokens).encode()).hexdigest()
+    entry, _ = search_cache.get_or_fill([digest, limit, offset], tags, fill)
+    return list(entry['ids']), entry['count']
+
+
+def complete(query, limit=10):
+    """Completed queries for a search-as-you-type box, the last word completed and typo tolerant."""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    head = ' '.join(tokens[:-1])
+    terms = get_backend().get_vocabulary().complete(tokens[-1], limit)
+    return [f'{head} {term}'.lstrip() for term in terms]
+
+
+def rebuild():
+    get_backend().rebuild()
+    # no delta, every process drops its cached results and in-process index
+    bump(SEARCH_TAG, RESULTS_TAG)
+
+
+def reindex(product_ids):
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    changed = get_backend().index(product_ids)
+    if changed:
+        # delta first, a process filling a result for a bumped term catches its index up before
+        publish_delta(SEARCH_TAG, product_ids)
+        bump(*term_tags(changed))
+
+
+def reindex_on_commit(product_ids):
+    """Reindex ``product_ids`` once the transaction commits, products that are gone by then are dropped."""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: reindex(product_ids))
+
+
+@tasks.register('search.reindex_group')
+def reindex_group(group_id):
+    reindex(Product.objects.filter(group_id=group_id).values_list('pk', flat=True))
+
+
+@tasks.register('search.reindex_category')
+def reindex_category(category_id):
+    reindex(Product.objects.filter(group__category_id=category_id).values_list('pk', flat=True))
+
+
+@tasks.register('search.reindex_value')
+def reindex_value(value_id):
+    reindex(ProductAttribute.objects.filter(value_id=value_id).values_list('product_id', flat=True).distinct())
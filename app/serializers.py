@@ -1,51 +1,100 @@
 from django.contrib.auth.models import User
-from django.db.models import Avg
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from .models import Category, Comment, Product, Group, ProductAttribute
+from .attributes import as_dict, attributes_prefetch, load_attributes
+from .images import srcset
+from .likes import has_liked
+from .models import Category, Comment, Product, Group, ProductAttribute, Image
 
 
 class CategorySerializer(serializers.ModelSerializer):
+    image_srcset = serializers.SerializerMethodField()
+
+    def get_image_srcset(self, obj):
+        return srcset(self.context.get('request'), obj.image, obj.variants)
+
     class Meta:
         model = Category
-        fields = '__all__'
+        # the timestamps stay internal, Last-Modified comes from the generation of the list's tag
+        exclude = ['variants', 'created_at', 'updated_at']
+        relations = {
+            'image_srcset': {'only': ['image', 'variants']},
+        }
 
 
 class ProductSerializer(serializers.ModelSerializer):
     avg_rating = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
 
     def get_avg_rating(self, obj):
-        # Use the precomputed average rating from the annotated field
-        avg_rating = getattr(obj, 'avg_rating', 0)
-        return round(avg_rating, 1) if avg_rating is not None else 0
+        # Read from the denormalized rating aggregates instead of an Avg() join
+        return round(obj.avg_rating, 1)
 
     def get_image(self, obj):
         # Since images are prefetched, this avoids an additional query
         request = self.context.get('request')
-        image = next((img for img in obj.images.all() if img.is_primary), None)
+        image = self.primary_image(obj)
         if image:
             return request.build_absolute_uri(image.image.url)
         return None
 
+    def get_image_srcset(self, obj):
+        image = self.primary_image(obj)
+        if image:
+            return srcset(self.context.get('request'), image.image, image.variants)
+        return None
+
+    def primary_image(self, obj):
+        return next((img for img in obj.images.all() if img.is_primary), None)
+
     def get_is_liked(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            # Using the prefetched user_like relationship
-            return user in obj.user_like.all()
-        return False
+        # list views put the ids the user liked on the current page into the context
+        liked_ids = self.context.get('liked_ids')
+        if liked_ids is not None:
+            return obj.pk in liked_ids
+        return has_liked(self.context.get('request').user, pk=obj.pk)
 
     class Meta:
         model = Product
-        fields = ['name', 'description', 'price', 'avg_rating', 'image', 'is_liked']
+        fields = ['name', 'description', 'price', 'avg_rating', 'image', 'image_srcset', 'is_liked', 'like_count']
+        # what the method fields read, used by app.planner to build the queryset
+        relations = {
+            'avg_rating': {'only': ['rating_count', 'rating_sum']},
+            'image': {'prefetch': [Prefetch(
+                'images',
+                queryset=Image.objects.filter(is_primary=True).only('id', 'image', 'variants', 'is_primary', 'product'),
+            )]},
+            # reads the images prefetched for 'image'
+            'image_srcset': {},
+            'is_liked': {'only': []},
+        }
+
+
+class ProductExportSerializer(ProductSerializer):
+    # the listing fields plus the ids and discount resellers sync on, minus the per-user is_liked
+    class Meta(ProductSerializer.Meta):
+        fields = [
+            'id', 'slug', 'name', 'description', 'price', 'discount', 'avg_rating', 'image', 'image_srcset',
+            'like_count',
+        ]
 
 
 class GroupSerializer(serializers.ModelSerializer):
+    image_srcset = serializers.SerializerMethodField()
+
+    def get_image_srcset(self, obj):
+        return srcset(self.context.get('request'), obj.image, obj.variants)
+
     class Meta:
         model = Group
-        fields = '__all__'
+        exclude = ['variants']
+        relations = {
+            'image_srcset': {'only': ['image', 'variants']},
+        }
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -60,18 +109,30 @@ class CommentSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ProductAttributeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, 'all') else data)
+        # the attributes of the whole page in one query, unless they were prefetched
+        self.child.context['attributes'] = load_attributes(products)
+        return super().to_representation(products)
+
+
 class ProductAttributeSerializer(serializers.ModelSerializer):
     attributes = serializers.SerializerMethodField()
 
     def get_attributes(self, obj):
-        attributes_dict = {}
-        for attr in obj.attributes.all():
-            attributes_dict[attr['attribute_key']] = attr['attribute_value']
-        return attributes_dict
+        loaded = self.context.get('attributes')
+        if loaded is not None and obj.pk in loaded:
+            return as_dict(loaded[obj.pk])
+        return as_dict(load_attributes([obj])[obj.pk])
 
     class Meta:
         model = Product
         fields = ['id', 'name', 'slug', 'attributes']
+        list_serializer_class = ProductAttributeListSerializer
+        relations = {
+            'attributes': {'prefetch': [attributes_prefetch()]},
+        }
 
 
 class UserLoginSerializer(serializers.ModelSerializer):
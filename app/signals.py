@@ -1,10 +1,13 @@
 from django.contrib.auth.models import User
-from django.core.cache import cache
-from django.db.models.signals import post_save, pre_save, post_delete
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed
+from django.core.signals import request_started
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
-from app.models import Product
+from app import facets, images, likes, ratings, search, suggest, tasks, warming
+from app.cache import CATEGORY_LIST_TAG, GROUP_LIST_TAG, bump, category_tag, group_tag, product_tag
+from app.models import AttributeKey, AttributeValue, Category, Comment, Group, Image, Product, ProductAttribute
 
 
 # @receiver(post_save, sender=User)
@@ -12,12 +15,231 @@ from app.models import Product
 #     if created:
 #         Token.objects.create(user=instance)
 
+def group_tags(group_id):
+    row = Group.objects.filter(pk=group_id).values_list('slug', 'category__slug').first()
+    if row is None:
+        return []
+    return [group_tag(row[0]), category_tag(row[1])]
+
+
+def product_tags(product_id):
+    row = Product.objects.filter(pk=product_id).values_list('slug', 'group__slug', 'group__category__slug').first()
+    if row is None:
+        # deleted with its product, the product's own post_delete covers it
+        return []
+    return [product_tag(row[0]), group_tag(row[1]), category_tag(row[2])]
+
+
+def invalidate_on_commit(tags):
+    # bumping before commit would let a concurrent request cache the old rows under the new generation
+    if tags:
+        transaction.on_commit(lambda: bump(*tags))
+
+
 @receiver(pre_save, sender=Product)
+def remember_product_group(sender, instance, **kwargs):
+    instance._previous_group_id = instance._previous_label = None
+    if instance.pk:
+        previous = Product.objects.filter(pk=instance.pk).values_list('group_id', 'name', 'slug').first()
+        if previous is not None:
+            instance._previous_group_id, *instance._previous_label = previous
+
+
 @receiver(post_save, sender=Product)
 @receiver(post_delete, sender=Product)
-def delete_saved_product(sender, instance, **kwargs):
-    category_slug = kwargs.get('slug')
-    group_slug = kwargs.get('slug')
-    cache.delete(f'product_list_{category_slug}_{group_slug}')
-    cache.delete(f'product_detail_{instance.id}')
+def invalidate_product(sender, instance, **kwargs):
+    tags = [product_tag(instance.slug), *group_tags(instance.group_id)]
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id and previous_group_id != instance.group_id:
+        tags += group_tags(previous_group_id)
+        # the product's attributes moved to another group's index
+        facets.invalidate(previous_group_id, instance.group_id)
+    invalidate_on_commit(tags)
+    search.reindex_on_commit([instance.pk])
+    # the suggester only indexes the name and slug, its weights follow likes and ratings on its own
+    deleted = kwargs['signal'] is post_delete
+    entries = []
+    if deleted or getattr(instance, '_previous_label', None) != [instance.name, instance.slug]:
+        entries.append((suggest.PRODUCT, instance.pk))
+    if deleted or (previous_group_id and previous_group_id != instance.group_id):
+        # the product's likes weigh its group and category
+        entries += suggest.group_entries({instance.group_id, previous_group_id} - {None})
+    suggest.refresh_on_commit(entries)
+
+
+@receiver(post_save, sender=Product)
+def warm_product(sender, instance, **kwargs):
+    # the page of a changed product is rendered again before the next visitor asks for it
+    warming.schedule(instance.slug)
+
+
+@receiver(pre_save, sender=ProductAttribute)
+def remember_product_attribute(sender, instance, **kwargs):
+    instance._previous_attribute = facets.attribute_row(instance.pk) if instance.pk else None
+
+
+# registered before invalidate_product_relation so the index delta is published before the
+# group tag moves, a reader of the new generation must not get the old index
+@receiver(post_save, sender=ProductAttribute)
+def index_product_attribute(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_attribute', None)
+    current = facets.attribute_row(instance.pk)
+    if previous != current:
+        facets.record_changes(removed=previous, added=current)
+
+
+@receiver(pre_delete, sender=ProductAttribute)
+def unindex_product_attribute(sender, instance, **kwargs):
+    # the row and its product are still there, post_delete would be too late to read the group
+    facets.record_changes(removed=facets.attribute_row(instance.pk))
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+def invalidate_product_relation(sender, instance, **kwargs):
+    invalidate_on_commit(product_tags(instance.product_id))
+
+
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+def reindex_product_attribute(sender, instance, **kwargs):
+    # attribute values are part of the search document
+    search.reindex_on_commit([instance.product_id])
+
+
+@receiver(post_save, sender=AttributeKey)
+@receiver(post_save, sender=AttributeValue)
+def invalidate_facet_names(sender, instance, created, **kwargs):
+    # the indexes are keyed by name, a rename touches every group using it
+    if not created:
+        invalidate_on_commit([facets.FACETS_TAG])
+        if sender is AttributeValue:
+            tasks.enqueue(
+                'search.reindex_value', {'value_id': instance.pk}, dedupe_key=f'search.reindex_value:{instance.pk}',
+            )
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_category(sender, instance, **kwargs):
+    instance._previous_category_id = None
+    if instance.pk:
+        instance._previous_category_id = Group.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, instance, **kwargs):
+    category_ids = {instance.category_id, getattr(instance, '_previous_category_id', None)} - {None}
+    category_slugs = Category.objects.filter(pk__in=category_ids).values_list('slug', flat=True)
+    invalidate_on_commit([group_tag(instance.slug), GROUP_LIST_TAG, *(category_tag(slug) for slug in category_slugs)])
+    suggest.refresh_on_commit([(suggest.GROUP, instance.pk), *((suggest.CATEGORY, pk) for pk in category_ids)])
+
+
+@receiver(post_save, sender=Group)
+def reindex_group_products(sender, instance, created, **kwargs):
+    # the group name is in the search document of each of its products, too many of them to reindex inline
+    if not created:
+        tasks.enqueue(
+            'search.reindex_group', {'group_id': instance.pk}, dedupe_key=f'search.reindex_group:{instance.pk}',
+        )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    invalidate_on_commit([category_tag(instance.slug), CATEGORY_LIST_TAG])
+    suggest.refresh_on_commit([(suggest.CATEGORY, instance.pk)])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if not created:
+        tasks.enqueue(
+            'search.reindex_category', {'category_id': instance.pk},
+            dedupe_key=f'search.reindex_category:{instance.pk}',
+        )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=Image)
+def render_image_variants(sender, instance, **kwargs):
+    # a new or replaced image, the variants of the previous one no longer apply
+    if images.needs_variants(instance):
+        images.schedule(instance, image_tags(instance))
+
+
+def image_tags(instance):
+    """Tags of everything rendering the image of a Category, Group or Image."""
+    if isinstance(instance, Category):
+        return [category_tag(instance.slug), CATEGORY_LIST_TAG]
+    if isinstance(instance, Group):
+        return [*group_tags(instance.pk), GROUP_LIST_TAG]
+    return product_tags(instance.product_id)
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_rating(sender, instance, **kwargs):
+    # the old rating is needed to move the aggregates when a comment is edited
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = (
+            Comment.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+        )
+
+
+@receiver(post_save, sender=Comment)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if previous == (instance.product_id, instance.rating):
+        return
+    if previous is not None:
+        ratings.remove_rating(*previous)
+    ratings.add_rating(instance.product_id, instance.rating)
+
+
+@receiver(post_delete, sender=Comment)
+def update_rating_on_delete(sender, instance, **kwargs):
+    ratings.remove_rating(instance.product_id, instance.rating)
+
+
+@receiver(m2m_changed, sender=Product.user_like.through)
+def update_like_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # clear() doesn't report what it removed, remember it for post_clear
+        if reverse:
+            instance._cleared_product_ids = list(instance.user_like.values_list('pk', flat=True))
+        return
+
+    product_ids = pk_set if reverse else [instance.pk]
+    if action == 'post_add':
+        # pk_set only holds the rows that were actually inserted
+        if reverse:
+            likes.increment_like_counts(product_ids)
+        else:
+            likes.increment_like_counts(product_ids, len(pk_set))
+    elif action == 'post_remove':
+        likes.recount_likes(product_ids)
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_cleared_product_ids', []) if reverse else product_ids
+        # a user's clear() can touch any number of products, the recount and invalidation run in a worker
+        if product_ids:
+            tasks.enqueue('likes.recount', {'product_ids': list(product_ids)})
+        return
+    else:
+        return
+
+    # like_count is part of the cached product representation
+    for product_id in product_ids:
+        invalidate_on_commit(product_tags(product_id))
+
 
+@receiver(request_started)
+def warm_suggestions(sender, **kwargs):
+    # once per process, in the background, as soon as it starts serving requests
+    request_started.disconnect(warm_suggestions)
+    suggest.warm()
@@ -0,0 +1,104 @@
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+HIT = 'HIT'
+MISS = 'MISS'
+STALE = 'STALE'
+SHARED = 'SHARED'
+
+# how long a fill may hold the cross-process lock before someone else is allowed to try
+LOCK_TIMEOUT = 30
+# how long followers wait for the leader when there is no stale value to fall back on
+WAIT_TIMEOUT = 5
+POLL_INTERVAL = 0.05
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def get_or_fill(key, fill, timeout, stale_key=None, stale_timeout=None):
+    """
+    Return ``(value, status)`` for ``key``, running ``fill()`` at most once per key at a time.
+
+    Threads of one process share the leader's result directly, other processes are kept
+    out by a lock in the cache. While a fill is running everybody else gets the last value
+    stored under ``stale_key`` or, if there is none, waits for the leader.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value, HIT
+
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+
+    if not leader:
+        stale = cache.get(stale_key) if stale_key else None
+        if stale is not None:
+            return stale, STALE
+        call.done.wait(WAIT_TIMEOUT)
+        if call.error is not None:
+            raise call.error
+        if call.value is not None:
+            return call.value, SHARED
+        return _fill(key, fill, timeout, stale_key, stale_timeout), MISS
+
+    try:
+        value, status = _lead(key, fill, timeout, stale_key, stale_timeout)
+        call.value = value
+        return value, status
+    except Exception as exc:
+        call.error = exc
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+
+def _lead(key, fill, timeout, stale_key, stale_timeout):
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, LOCK_TIMEOUT):
+        try:
+            # another process may have finished its fill between our get and add
+            value = cache.get(key)
+            if value is not None:
+                return value, HIT
+            return _fill(key, fill, timeout, stale_key, stale_timeout), MISS
+        finally:
+            # not atomic, but a lock that expired under a slow fill is only released early once
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    # another process is filling the key
+    stale = cache.get(stale_key) if stale_key else None
+    if stale is not None:
+        return stale, STALE
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value, SHARED
+    return _fill(key, fill, timeout, stale_key, stale_timeout), MISS
+
+
+def _fill(key, fill, timeout, stale_key, stale_timeout):
+    value = fill()
+    cache.set(key, value, timeout)
+    if stale_key:
+        cache.set(stale_key, value, stale_timeout or timeout)
+    return value
@@ -0,0 +1,110 @@
+import re
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import BigIntegerField, Count, Max, Q
+from django.db.models.functions import Cast, Substr
+from django.utils.text import slugify
+
+# how many base slugs share one lookup query, each takes about ten parameters and SQLite
+# builds before 3.32 allow 999 per query
+LOOKUP_BATCH = 50
+# longer numeric tails aren't suffixes this allocator handed out, and wouldn't fit a bigint
+MAX_SUFFIX_DIGITS = 18
+# a save whose slug was taken by a concurrent insert is retried this many times with a new suffix
+SAVE_ATTEMPTS = 5
+
+
+def base_slug(model, text, field='slug'):
+    """``slugify(text)`` with room left for a ``-<n>`` suffix, the model name when nothing is left of the text."""
+    max_length = model._meta.get_field(field).max_length
+    return (slugify(text) or model._meta.model_name)[:max_length - 8].rstrip('-')
+
+
+def suffix_lookup(alias, field, base):
+    """The ``base-<digits>`` slugs: an indexed range or prefix, narrowed by an anchored regex."""
+    exact = Q(**{f'{field}__regex': rf'^{re.escape(base)}-[0-9]{{1,{MAX_SUFFIX_DIGITS}}}$'})
+    if connections[alias].vendor == 'sqlite':
+        # under the BINARY collation the range holds exactly the strings continuing base with '-'
+        # and a digit, and unlike LIKE ... ESCAPE it is answered from the index
+        return Q(**{f'{field}__gte': f'{base}-0', f'{field}__lt': f'{base}-:'}) & exact
+    # PostgreSQL answers LIKE 'prefix%' from the varchar_pattern_ops index Django adds to slug fields
+    return Q(**{f'{field}__startswith': f'{base}-'}) & exact
+
+
+class SlugAllocator:
+    """
+    Unique slugs for many new rows of ``model``, checked against the table one query per batch of names.
+
+    The first row with a base gets the base itself, the next ones ``base-1``, ``base-2``,
+    ... Suffixes handed out are remembered, so this is only
+    exact while nobody else inserts rows of the model; callers retry on IntegrityError
+    after ``forget``-ing the bases.
+    """
+
+    def __init__(self, model, field='slug'):
+        self.model = model
+        self.field = field
+        self.alias = router.db_for_write(model)
+        self.next_suffix = {}  # base -> next free suffix, 0 when the base itself is free
+
+    def load(self, bases):
+        """One aggregate query per batch: whether each bare base is taken and its highest suffix."""
+        bases = sorted(set(bases) - set(self.next_suffix))
+        for start in range(0, len(bases), LOOKUP_BATCH):
+            batch = bases[start:start + LOOKUP_BATCH]
+            lookup = Q(**{f'{self.field}__in': batch})
+            aggregates = {}
+            for number, base in enumerate(batch):
+                suffixed = suffix_lookup(self.alias, self.field, base)
+                lookup |= suffixed
+                aggregates[f'bare_{number}'] = Count('pk', filter=Q(**{self.field: base}))
+                aggregates[f'suffix_{number}'] = Max(
+                    Cast(Substr(self.field, len(base) + 2), BigIntegerField()), filter=suffixed,
+                )
+            taken = self.model._base_manager.using(self.alias).filter(lookup).aggregate(**aggregates)
+            for number, base in enumerate(batch):
+                # highest suffix in use, 0 for the bare base, -1 when neither is
+                highest = taken[f'suffix_{number}'] or (0 if taken[f'bare_{number}'] else -1)
+                self.next_suffix[base] = highest + 1
+
+    def allocate(self, texts):
+        """One unique slug per text, in order."""
+        bases = [base_slug(self.model, text, self.field) for text in texts]
+        self.load(bases)
+        slugs = []
+        for base in bases:
+            number = self.next_suffix[base]
+            self.next_suffix[base] = number + 1
+            slugs.append(f'{base}-{number}' if number else base)
+        return slugs
+
+    def forget(self, bases=None):
+        """Drop what is known about ``bases`` (all of them when None), they are looked up again."""
+        if bases is None:
+            self.next_suffix.clear()
+        for base in bases or ():
+            self.next_suffix.pop(base, None)
+
+
+def save_with_unique_slug(instance, text, save, field='slug'):
+    """
+    Give ``instance`` a free slug built from ``text`` and ``save()`` it.
+
+    The next suffix comes from one indexed query. Two inserts racing for the same slug
+    are told apart by the unique index: the loser's insert fails inside a savepoint, so
+    an outer transaction stays usable, and is tried again with the suffix after the
+    winner's.
+    """
+    model = type(instance)
+    alias = router.db_for_write(model, instance=instance)
+    for attempt in range(1, SAVE_ATTEMPTS + 1):
+        slug = SlugAllocator(model, field).allocate([text])[0]
+        setattr(instance, field, slug)
+        try:
+            with transaction.atomic(using=alias):
+                return save()
+        except IntegrityError:
+            setattr(instance, field, '')
+            # another unique field (a duplicate name or title) isn't fixed by a new suffix
+            if attempt == SAVE_ATTEMPTS or not model._base_manager.using(alias).filter(**{field: slug}).exists():
+                raise
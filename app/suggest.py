@@ -0,0 +1,285 @@
+import bisect
+import heapq
+import math
+import threading
+import time
+from array import array
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Sum
+
+from app.cache import deltas_since, generations, publish_delta
+from app.models import Category, Group, Product
+from app.search import tokenize
+
+# bumped with the (kind, pk) of every entry whose name or slug changed, or whose group moved
+SUGGEST_TAG = 'suggest'
+
+PRODUCT, GROUP, CATEGORY = 'product', 'group', 'category'
+KINDS = [PRODUCT, GROUP, CATEGORY]
+# groups and categories answer a broad query better than any single product
+TAXONOMY_BOOST = 2.0
+# a name is findable from each of its first words, not only from its beginning
+MAX_WORDS = 6
+# prefixes this short match a large share of all keys, their best entries are kept until the next change
+SHORT_PREFIX = 2
+# longer prefixes rank at most this many matching keys
+SCAN_LIMIT = 2000
+# keys are cut here, longer prefixes are matched on their first KEY_LENGTH characters
+KEY_LENGTH = 32
+BATCH_SIZE = 500
+# likes and ratings change too often to publish each one, the weights they make up are reloaded
+# with a rebuild in the background this often
+REBUILD_INTERVAL = 300
+
+
+def product_weight(like_count, rating_count, rating_sum):
+    average = rating_sum / rating_count if rating_count else 0
+    return math.log1p(like_count) + average / 5
+
+
+def taxonomy_weight(like_count):
+    return TAXONOMY_BOOST + math.log1p(like_count or 0)
+
+
+def load_entries(kind, pks=None):
+    """``(pk, label, slug, weight)`` of the rows of ``kind``, all of them when ``pks`` is None."""
+    if kind == PRODUCT:
+        rows = Product.objects.values_list('pk', 'name', 'slug', 'like_count', 'rating_count', 'rating_sum')
+        convert = lambda pk, name, slug, *weight: (pk, name, slug, product_weight(*weight))
+    elif kind == GROUP:
+        rows = Group.objects.annotate(likes=Sum('products__like_count')).values_list('pk', 'name', 'slug', 'likes')
+        convert = lambda pk, name, slug, likes: (pk, name, slug, taxonomy_weight(likes))
+    else:
+        rows = Category.objects.annotate(likes=Sum('groups__products__like_count')).values_list(
+            'pk', 'title', 'slug', 'likes',
+        )
+        convert = lambda pk, title, slug, likes: (pk, title, slug, taxonomy_weight(likes))
+
+    if pks is None:
+        for row in rows.order_by('pk').iterator(chunk_size=2000):
+            yield convert(*row)
+        return
+    pks = list(pks)
+    for start in range(0, len(pks), BATCH_SIZE):
+        for row in rows.filter(pk__in=pks[start:start + BATCH_SIZE]):
+            yield convert(*row)
+
+
+def entry_keys(label):
+    words = tokenize(label)
+    return sorted({' '.join(words[start:])[:KEY_LENGTH] for start in range(min(len(words), MAX_WORDS))})
+
+
+class Suggester:
+    """
+    Names of products, groups and categories in one sorted array of keys, searched with bisect.
+
+    Each name is stored once per word it can be found from ("apple iphone 15", "iphone 15",
+    "15"), a parallel array holds the number of the entry each key belongs to. Entries live
+    in parallel arrays too, a removed one keeps its slot with a negative weight.
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.keys = []
+        self.key_refs = array('l')  # entry number of each key
+        self.refs = {kind: {} for kind in KINDS}  # kind -> {pk: entry number}
+        self.kinds = array('b')
+        self.labels = []
+        self.slugs = []
+        self.weights = array('d')
+        self.top = {}  # short prefix -> (how many were ranked, best entries)
+
+    def append(self, kind, pk, label, slug, weight):
+        ref = self.refs[kind][pk] = len(self.labels)
+        self.kinds.append(KINDS.index(kind))
+        self.labels.append(label)
+        self.slugs.append(slug)
+        self.weights.append(weight)
+        return ref
+
+    def put(self, kind, pk, label, slug, weight):
+        ref = self.refs[kind].get(pk)
+        if ref is None:
+            ref = self.append(kind, pk, label, slug, weight)
+        else:
+            self.remove_keys(ref)
+            self.labels[ref] = label
+            self.slugs[ref] = slug
+            self.weights[ref] = weight
+        for key in entry_keys(label):
+            position = bisect.bisect_left(self.keys, key)
+            self.keys.insert(position, key)
+            self.key_refs.insert(position, ref)
+
+    def remove(self, kind, pk):
+        ref = self.refs[kind].pop(pk, None)
+        if ref is not None:
+            self.remove_keys(ref)
+            self.labels[ref] = self.slugs[ref] = ''
+            self.weights[ref] = -1
+
+    def remove_keys(self, ref):
+        for key in entry_keys(self.labels[ref]):
+            position = bisect.bisect_left(self.keys, key)
+            # equal keys of different entries sit next to each other
+            while position < len(self.keys) and self.keys[position] == key:
+                if self.key_refs[position] == ref:
+                    del self.keys[position]
+                    del self.key_refs[position]
+                    break
+                position += 1
+
+    def load(self, kind, pks=None):
+        found = set()
+        for pk, label, slug, weight in load_entries(kind, pks):
+            self.put(kind, pk, label, slug, weight)
+            found.add(pk)
+        for pk in set(pks or ()) - found:
+            self.remove(kind, pk)
+        self.top.clear()
+
+    def bulk_load(self):
+        """Initial build: the keys are sorted once instead of inserted one by one."""
+        pairs = []
+        for kind in KINDS:
+            for pk, label, slug, weight in load_entries(kind):
+                ref = self.append(kind, pk, label, slug, weight)
+                pairs.extend((key, ref) for key in entry_keys(label))
+        pairs.sort(key=itemgetter(0))
+        self.keys = [key for key, _ in pairs]
+        self.key_refs = array('l', (ref for _, ref in pairs))
+
+    def matches(self, prefix, scan_limit):
+        prefix = prefix[:KEY_LENGTH]
+        start = bisect.bisect_left(self.keys, prefix)
+        end = len(self.keys) if scan_limit is None else min(len(self.keys), start + scan_limit)
+        refs = set()
+        for position in range(start, end):
+            if not self.keys[position].startswith(prefix):
+                break
+            refs.add(self.key_refs[position])
+        return refs
+
+    def suggest(self, query, limit):
+        prefix = ' '.join(tokenize(query))
+        if not prefix:
+            return []
+        with self.lock:
+            if len(prefix) <= SHORT_PREFIX:
+                computed, best = self.top.get(prefix, (0, []))
+                if computed < limit:
+                    computed = max(limit, 10)
+                    best = self.rank(self.matches(prefix, None), computed)
+                    self.top[prefix] = (computed, best)
+                best = best[:limit]
+            else:
+                best = self.rank(self.matches(prefix, SCAN_LIMIT), limit)
+            return [
+                {'type': KINDS[self.kinds[ref]], 'name': self.labels[ref], 'slug': self.slugs[ref]}
+                for ref in best
+            ]
+
+    def rank(self, refs, limit):
+        return heapq.nlargest(limit, refs, key=self.weights.__getitem__)
+
+    def stats(self):
+        return {'entries': sum(map(len, self.refs.values())), 'slots': len(self.labels), 'keys': len(self.keys)}
+
+
+_suggester = None
+_suggester_lock = threading.Lock()
+_rebuilding = False
+
+
+def build():
+    # generation first, deltas committed while the rows are read are replayed later
+    suggester = Suggester(generations([SUGGEST_TAG])[0])
+    suggester.bulk_load()
+    return suggester
+
+
+def get_suggester():
+    """
+    The suggester of this process, built on first use.
+
+    Deltas are replayed on the way, a broken chain or an old build starts one rebuild in the
+    background and the current suggester keeps answering until it is swapped in.
+    """
+    global _suggester
+    current = generations([SUGGEST_TAG])[0]
+    with _suggester_lock:
+        suggester = _suggester
+        if suggester is None:
+            suggester = _suggester = build()
+        if suggester.generation != current:
+            chain = deltas_since(SUGGEST_TAG, suggester.generation, current)
+            if chain is None:
+                start_rebuild()
+            else:
+                with suggester.lock:
+                    for kind in KINDS:
+                        pks = {pk for delta in chain for entry_kind, pk in delta if entry_kind == kind}
+                        if pks:
+                            suggester.load(kind, pks)
+                    suggester.generation = current
+        if time.monotonic() - suggester.built_at > REBUILD_INTERVAL:
+            start_rebuild()
+        return suggester
+
+
+def start_rebuild():
+    """Start a rebuild unless one is running, called with ``_suggester_lock`` held."""
+    global _rebuilding
+    if not _rebuilding:
+        _rebuilding = True
+        in_background(rebuild, 'suggest-rebuild')
+
+
+def rebuild():
+    global _suggester, _rebuilding
+    try:
+        suggester = build()
+        with _suggester_lock:
+            _suggester = suggester
+    finally:
+        with _suggester_lock:
+            _rebuilding = False
+
+
+def in_background(func, name):
+    def run():
+        from django.db import connection
+
+        try:
+            func()
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+
+
+def warm():
+    """Build the suggester in the background, the first suggest request then finds it ready."""
+    in_background(get_suggester, 'suggest-warm')
+
+
+def suggest(query, limit=8):
+    return get_suggester().suggest(query, limit)
+
+
+def refresh_on_commit(entries):
+    """Reload ``(kind, pk)`` entries in every process once the transaction commits."""
+    entries = sorted(set(entries))
+    if entries:
+        transaction.on_commit(lambda: publish_delta(SUGGEST_TAG, entries))
+
+
+def group_entries(group_ids):
+    # a product's likes also weigh its group and category
+    rows = Group.objects.filter(pk__in=group_ids).values_list('pk', 'category_id')
+    return [entry for group_id, category_id in rows for entry in ((GROUP, group_id), (CATEGORY, category_id))]
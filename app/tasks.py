@@ -0,0 +1,191 @@
+import logging
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app.models import Task
+
+logger = logging.getLogger(__name__)
+
+# a running task whose worker hasn't finished it after this long is assumed dead and retried
+LOCK_TIMEOUT = timedelta(minutes=10)
+# seconds before retry n is base ** n
+RETRY_BASE = 4
+
+_registry = {}
+
+
+class TaskSpec:
+    def __init__(self, func, name, priority, max_attempts):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+
+def register(name, priority=0, max_attempts=3):
+    """
+    Make the decorated function runnable as the task ``name``.
+
+    Payloads are passed as keyword arguments and have to be JSON serializable. Tasks
+    may run more than once (a retry, a worker dying mid-task), they must be idempotent.
+    """
+    def decorator(func):
+        _registry[name] = TaskSpec(func, name, priority, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, dedupe_key=None, priority=None, delay=0):
+    """
+    Store a task in the current transaction, it only becomes visible to workers if that commits.
+
+    While a pending task with the same ``dedupe_key`` exists, that one runs instead, with
+    the new payload.
+    """
+    spec = _registry[name]
+    task = Task(
+        name=name, payload=payload or {}, dedupe_key=dedupe_key,
+        priority=spec.priority if priority is None else priority,
+        max_attempts=spec.max_attempts, run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if settings.TASKS_EAGER:
+        # no worker, e.g. during development: run it right after the commit instead
+        transaction.on_commit(lambda: spec.func(**task.payload))
+        return
+    if dedupe_key is not None:
+        # the pending duplicate stays locked until this transaction ends, so no worker runs it
+        # against rows this transaction hasn't committed yet
+        if Task.objects.filter(dedupe_key=dedupe_key, status=Task.Status.pending).update(
+                payload=task.payload, updated_at=timezone.now()):
+            return
+    # INSERT ... ON CONFLICT DO NOTHING (INSERT OR IGNORE on SQLite) against the partial unique index
+    Task.objects.bulk_create([task], ignore_conflicts=True)
+
+
+def release_stale():
+    """Put tasks of workers that died back in the queue, or fail them when out of attempts."""
+    stale = Task.objects.filter(status=Task.Status.running, locked_at__lt=timezone.now() - LOCK_TIMEOUT)
+    for task in stale.only('pk', 'attempts', 'max_attempts', 'dedupe_key'):
+        finish(task, 'worker lost the task, lock timed out')
+
+
+def claim(worker, limit):
+    """Mark up to ``limit`` due tasks as running for ``worker`` and return their ids, highest priority first."""
+    token = f'{worker}:{uuid.uuid4().hex[:8]}'
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.Status.pending, run_at__lte=now).order_by('-priority', 'run_at', 'id')
+    changes = {
+        'status': Task.Status.running, 'locked_by': token, 'locked_at': now,
+        'attempts': F('attempts') + 1, 'updated_at': now,
+    }
+    if connection.vendor == 'sqlite':
+        # no row locks, and a transaction reading before it writes fails outright when another
+        # connection wrote in between; one UPDATE takes the database's write lock up front
+        Task.objects.filter(pk__in=due.values('pk')[:limit]).update(**changes)
+    else:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            if not ids:
+                return []
+            Task.objects.filter(pk__in=ids).update(**changes)
+    return list(
+        Task.objects.filter(locked_by=token, status=Task.Status.running)
+        .order_by('-priority', 'run_at', 'id').values_list('pk', flat=True)
+    )
+
+
+def finish(task, error=None):
+    """Delete a task that succeeded; put a failed one back in the queue with a backoff, or fail it for good."""
+    if error is None:
+        Task.objects.filter(pk=task.pk).delete()
+        return
+    stored = Task.objects.filter(pk=task.pk)
+    changes = {'last_error': error, 'locked_by': '', 'locked_at': None, 'updated_at': timezone.now()}
+    if task.attempts < task.max_attempts:
+        try:
+            with transaction.atomic():
+                stored.update(
+                    status=Task.Status.pending, run_at=timezone.now() + timedelta(seconds=RETRY_BASE ** task.attempts),
+                    **changes,
+                )
+            return
+        except IntegrityError:
+            # a newer task with the same dedupe key is pending, it covers the retry
+            pass
+    stored.update(status=Task.Status.failed, **changes)
+
+
+def execute(pk):
+    """Run one claimed task; safe to call in a worker thread or a child process."""
+    close_old_connections()
+    try:
+        task = Task.objects.filter(pk=pk, status=Task.Status.running).first()
+        if task is None:
+            return
+        spec = _registry.get(task.name)
+        try:
+            if spec is None:
+                raise LookupError(f'no task registered as {task.name!r}')
+            started = time.perf_counter()
+            spec.func(**task.payload)
+        except Exception:
+            logger.exception('Task %s %s failed (attempt %s of %s)', task.pk, task.name, task.attempts, task.max_attempts)
+            finish(task, traceback.format_exc(limit=20))
+        else:
+            logger.info('Task %s %s done in %.3f s', task.pk, task.name, time.perf_counter() - started)
+            finish(task)
+    finally:
+        close_old_connections()
+
+
+class Worker:
+    """
+    Polls the Task table and runs due tasks in a pool of ``concurrency`` threads or processes.
+
+    Threads suit tasks waiting on the database or the cache; processes suit CPU bound ones
+    like image rendering, at the price of a connection per process.
+    """
+
+    def __init__(self, concurrency=4, mode='thread', poll_interval=1.0):
+        self.concurrency = concurrency
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+
+    def pool(self):
+        if self.mode == 'process':
+            # children must not share the parent's connections, they open their own
+            connections.close_all()
+            return ProcessPoolExecutor(max_workers=self.concurrency, initializer=django.setup)
+        return ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='task')
+
+    def run(self, once=False):
+        """Run until interrupted, or with ``once`` until the queue is drained."""
+        running = set()
+        with self.pool() as pool:
+            while True:
+                release_stale()
+                free = self.concurrency - len(running)
+                ids = claim(self.name, free) if free else []
+                running.update(pool.submit(execute, pk) for pk in ids)
+                if not running:
+                    if once:
+                        return self.processed
+                    time.sleep(self.poll_interval)
+                    continue
+                done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                self.processed += len(done)
+                running = set(running)
+
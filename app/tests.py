@@ -1,3 +1,1219 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Count
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date, parse_http_date
+from PIL import Image as PILImage
+from rest_framework.test import APITestCase
+
+from app import facets, images, importer, likes, pricing, search, signals, singleflight, suggest, tasks
+from app.attributes import as_dict, load_attributes
+from app.cache_backends import LocalTier
+from app.db import ReplicaRouter, reading_from
+from app.cache import (
+    CATEGORY_LIST_TAG, GENERATION_TIMEOUT, GROUP_LIST_TAG, READ_GENERATION_TIMEOUT, bump, category_tag, clock_generation,
+    generation_key, generations, group_tag, product_tag, versioned_key,
+)
+from app.models import (
+    AttributeKey, AttributeValue, Category, Comment, Group, Image, ImportRun, Product, ProductAttribute, Task,
+)
+from app.planner import plan_queryset
+from app.serializers import ProductAttributeSerializer
+from app.slugs import SlugAllocator
+
+# the shared tier is the file cache production runs on without REDIS_URL, so the tests see its
+# get+set INCR and TTL handling rather than locmem's
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'app.cache_backends.TieredCache',
+        'LOCATION': 'tests',
+        'OPTIONS': {'SHARED': 'shared', 'LOCAL_TIMEOUT': 5, 'STALE_WHILE_REVALIDATE': 30},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'olcha-test-cache'),
+    },
+}
+
+
+def shared_ttl(key):
+    """Seconds until ``key`` expires in the shared file cache, None if it doesn't."""
+    shared = caches['shared']
+    with open(shared._key_to_file(key), 'rb') as file:
+        expires_at = pickle.load(file)
+    return None if expires_at is None else expires_at - time.time()
+
+
+def add_attributes(products):
+    """A ``color`` of its own and a shared ``memory`` for every product."""
+    color = AttributeKey.objects.get_or_create(key='color')[0]
+    memory = AttributeKey.objects.get_or_create(key='memory')[0]
+    shared = AttributeValue.objects.get_or_create(value='128 GB')[0]
+    for number, product in enumerate(products):
+        value = AttributeValue.objects.get_or_create(value=f'color {number}')[0]
+        ProductAttribute.objects.create(product=product, key=color, value=value)
+        ProductAttribute.objects.create(product=product, key=memory, value=shared)
+
+
+def encode_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+@override_settings(CACHES=TEST_CACHES, TASKS_EAGER=False, CACHE_WARM_URL=None)
+class CatalogTestCase(APITestCase):
+    """A category with one group of ``product_count`` products and a clean cache for every test."""
+    product_count = 5
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # its thread would read the test database outside the test's transaction
+        request_started.disconnect(signals.warm_suggestions)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Phones', image='images/phones.jpg')
+        cls.group = Group.objects.create(name='Smartphones', category=cls.category, image='images/smart.jpg')
+        cls.products = [
+            Product.objects.create(name=f'Phone {number}', description='A phone', price=100 + number, group=cls.group)
+            for number in range(cls.product_count)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def list_url(self, **query):
+        url = reverse('product-list', kwargs={'category_slug': self.category.slug, 'slug': self.group.slug})
+        return url, query
+
+
+class KeysetPaginationTests(CatalogTestCase):
+    def test_pages_follow_each_other(self):
+        url, query = self.list_url(ordering='price', page_size=2)
+        names = []
+        while url:
+            response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            names += [product['name'] for product in response.data['results']]
+            url, query = response.data['next'], {}
+        self.assertEqual(names, [product.name for product in self.products])
+
+    def test_cursor_with_a_value_the_sort_field_cant_hold_is_not_found(self):
+        url, _ = self.list_url()
+        cursors = [
+            ('price', 'abc'), ('price', None), ('price', [1]), ('price', True), ('price', {}),
+            ('-created_at', 'not a date'), ('-created_at', 5),
+        ]
+        for ordering, value in cursors:
+            with self.subTest(ordering=ordering, value=value):
+                cursor = encode_cursor({'v': value, 'pk': 1, 'o': ordering})
+                response = self.client.get(url, {'ordering': ordering, 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_malformed_cursor_is_not_found(self):
+        url, _ = self.list_url()
+        for cursor in ['!!!', encode_cursor([1, 2]), encode_cursor({'v': 1, 'pk': 10 ** 30, 'o': 'price'})]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url, {'ordering': 'price', 'cursor': cursor}).status_code, 404)
+
+
+class QueryPlanTests(CatalogTestCase):
+    """The read views load what their serializer renders in a fixed number of queries, however many rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        add_attributes(cls.products)
+        for number, product in enumerate(cls.products):
+            Image.objects.create(product=product, image=f'images/phone-{number}.jpg', is_primary=True)
+            Image.objects.create(product=product, image=f'images/phone-{number}-back.jpg')
+
+    def test_list(self):
+        url, query = self.list_url(ordering='price')
+        # count, page of ids, rows, primary images
+        with self.assertNumQueries(4):
+            response = self.client.get(url, query)
+        self.assertEqual(len(response.data['results']), self.product_count)
+        self.assertTrue(all(product['image'] for product in response.data['results']))
+
+    def test_list_with_liked_products(self):
+        user = User.objects.create_user('buyer')
+        self.products[0].user_like.add(user)
+        self.client.force_authenticate(user)
+        url, query = self.list_url(ordering='price')
+        # plus the user's likes among the page
+        with self.assertNumQueries(5):
+            response = self.client.get(url, query)
+        self.assertEqual([product['is_liked'] for product in response.data['results']], [True, False, False, False, False])
+
+    def test_detail(self):
+        # the product and its primary image
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('product-detail', kwargs={'slug': self.products[0].slug}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'Phone 0')
+
+    def test_attributes(self):
+        # the product and its attributes with keys and values joined in
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('product-attributes', kwargs={'slug': self.products[0].slug}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_hit_skips_the_database(self):
+        url = reverse('product-detail', kwargs={'slug': self.products[0].slug})
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_put_saves_every_field(self):
+        product = self.products[0]
+        before = Product.objects.get(pk=product.pk).updated_at
+        response = self.client.put(
+            reverse('product-detail', kwargs={'slug': product.slug}),
+            {'name': 'Phone 0 Pro', 'description': 'A better phone', 'price': 999},
+        )
+        self.assertEqual(response.status_code, 200)
+        saved = Product.objects.get(pk=product.pk)
+        self.assertEqual((saved.name, saved.price), ('Phone 0 Pro', 999))
+        self.assertGreater(saved.updated_at, before)
+
+
+class IndexTests(CatalogTestCase):
+    """SQLite answers the catalog's hot queries from the composite and partial indexes, without a sort step."""
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_group_pages_in_every_ordering(self):
+        products = Product.objects.filter(group=self.group)
+        self.assertUsesIndex(products.order_by('price', 'id'), 'product_group_price_idx')
+        self.assertUsesIndex(products.order_by('-price', '-id'), 'product_group_price_idx')
+        self.assertUsesIndex(products.order_by('-created_at', '-id'), 'product_group_created_idx')
+
+    def test_rating_aggregation_reads_only_the_index(self):
+        rows = (Comment.objects.filter(product_id__in=[product.pk for product in self.products])
+                .values('product_id', 'rating').annotate(total=Count('id')).order_by())
+        self.assertIn('COVERING INDEX comment_product_rating_idx', rows.explain())
+
+    def test_primary_images(self):
+        for product in self.products:
+            Image.objects.create(product=product, image='images/front.jpg', is_primary=True)
+        images = Image.objects.filter(is_primary=True, product_id__in=[product.pk for product in self.products])
+        self.assertIn('unique_primary_image', images.explain())
+
+        Image.objects.create(product=self.products[0], image='images/back.jpg')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Image.objects.create(product=self.products[0], image='images/side.jpg', is_primary=True)
+
+
+class GenerationCounterTests(CatalogTestCase):
+    def test_reading_an_unknown_tag_creates_an_expiring_counter(self):
+        response = self.client.get(reverse('product-detail', kwargs={'slug': 'no-such-product'}))
+        self.assertEqual(response.status_code, 404)
+        ttl = shared_ttl(generation_key(product_tag('no-such-product')))
+        self.assertIsNotNone(ttl)
+        self.assertAlmostEqual(ttl, READ_GENERATION_TIMEOUT, delta=60)
+
+    def test_bumping_a_missing_counter_keeps_it_longer(self):
+        bump('fresh-tag')
+        self.assertAlmostEqual(shared_ttl(generation_key('fresh-tag')), GENERATION_TIMEOUT, delta=60)
+
+    def test_bumping_keeps_the_counter_timeout(self):
+        generations(['kept-tag'])
+        bump('kept-tag')
+        self.assertAlmostEqual(shared_ttl(generation_key('kept-tag')), GENERATION_TIMEOUT, delta=60)
+
+    def test_bump_steps_from_the_shared_counter(self):
+        # this process last saw the counter six hours ago, another one bumped it since
+        key = generation_key('busy-tag')
+        cache.set(key, clock_generation() - 6 * 60 * 60 * 1_000_000)
+        caches['shared'].set(key, clock_generation())
+        bump('busy-tag')
+        self.assertLessEqual(generations(['busy-tag'])[0], clock_generation())
+
+
+class TieredCacheTests(CatalogTestCase):
+    def test_local_tier_evicts_the_least_recently_used(self):
+        tier = LocalTier(max_bytes=30)
+        for key in 'abc':
+            tier.set(key, b'x' * 10, 100, 100)
+        tier.get('a', 0)
+        tier.set('d', b'x' * 10, 100, 100)
+        self.assertEqual(list(tier.entries), ['c', 'a', 'd'])
+        self.assertEqual(tier.as_dict()['evictions'], 1)
+
+    def test_expired_value_is_served_stale_while_revalidated(self):
+        cache.set('page', 'old', 60)
+        caches['shared'].set('page', 'new', 60)
+        self.assertEqual(cache.get('page'), 'old')
+
+        local_key = cache.make_and_validate_key('page')
+        pickled, _, stale_until = cache.local.entries[local_key]
+        # past LOCAL_TIMEOUT, within STALE_WHILE_REVALIDATE
+        cache.local.entries[local_key] = (pickled, time.monotonic() - 1, stale_until)
+        self.assertEqual(cache.get('page'), 'old')
+        deadline = time.monotonic() + 5
+        while local_key in cache.local.refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.get('page'), 'new')
+
+    def test_counters_and_locks_bypass_the_local_tier(self):
+        for key in (generation_key('product:phone'), 'lock:page'):
+            cache.set(key, 1, 60)
+            self.assertEqual(cache.get(key), 1)
+            caches['shared'].set(key, 2, 60)
+            # another process' write is seen at once
+            self.assertEqual(cache.get(key), 2)
+            self.assertEqual(cache.get_many([key]), {key: 2})
+            self.assertNotIn(cache.make_and_validate_key(key), cache.local.entries)
+            caches['shared'].delete(key)
+            self.assertTrue(cache.add(key, 3, 60))
+
+
+class InvalidationTests(CatalogTestCase):
+    """Writes bump the tags of everything rendered from the changed rows once their transaction commits."""
+
+    @contextmanager
+    def assertBumps(self, tags, untouched=()):
+        """The writes inside move every tag in ``tags`` forward and none in ``untouched``."""
+        tags, untouched = list(tags), list(untouched)
+        before = dict(zip(tags + untouched, generations(tags + untouched)))
+        with self.captureOnCommitCallbacks(execute=True):
+            yield
+        after = dict(zip(tags + untouched, generations(tags + untouched)))
+        for tag in tags:
+            self.assertGreater(after[tag], before[tag], f'{tag} was not bumped')
+        for tag in untouched:
+            self.assertEqual(after[tag], before[tag], f'{tag} was bumped')
+
+    def test_product_save(self):
+        product = self.products[0]
+        with self.assertBumps(
+                [product_tag(product.slug), group_tag(self.group.slug), category_tag(self.category.slug)],
+                untouched=[product_tag(self.products[1].slug), GROUP_LIST_TAG, CATEGORY_LIST_TAG]):
+            product.price = 1
+            product.save()
+
+    def test_product_moved_to_another_group(self):
+        other = Group.objects.create(name='Feature phones', category=self.category, image='images/feature.jpg')
+        product = self.products[0]
+        with self.assertBumps([product_tag(product.slug), group_tag(self.group.slug), group_tag(other.slug)]):
+            product.group = other
+            product.save()
+
+    def test_product_delete(self):
+        product = self.products[0]
+        with self.assertBumps([product_tag(product.slug), group_tag(self.group.slug), category_tag(self.category.slug)]):
+            product.delete()
+
+    def test_group_save_and_delete(self):
+        tags = [group_tag(self.group.slug), GROUP_LIST_TAG, category_tag(self.category.slug)]
+        with self.assertBumps(tags, untouched=[CATEGORY_LIST_TAG]):
+            self.group.name = 'Smart phones'
+            self.group.save()
+        with self.assertBumps(tags):
+            self.group.delete()
+
+    def test_category_save_and_delete(self):
+        tags = [category_tag(self.category.slug), CATEGORY_LIST_TAG]
+        with self.assertBumps(tags, untouched=[GROUP_LIST_TAG]):
+            self.category.title = 'Mobile phones'
+            self.category.save()
+        with self.assertBumps(tags):
+            self.category.delete()
+
+    def test_cached_detail_follows_a_price_change(self):
+        product = self.products[0]
+        url = reverse('product-detail', kwargs={'slug': product.slug})
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 111
+            product.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['price'], 111)
+
+    def test_cached_list_follows_a_rename(self):
+        url, query = self.list_url(ordering='price')
+        self.client.get(url, query)
+        self.assertEqual(self.client.get(url, query)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].name = 'Renamed'
+            self.products[0].save()
+        response = self.client.get(url, query)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Renamed')
+
+    def test_cached_list_follows_a_delete(self):
+        url, query = self.list_url(ordering='price')
+        self.client.get(url, query)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].delete()
+        response = self.client.get(url, query)
+        self.assertEqual(len(response.data['results']), self.product_count - 1)
+
+    def test_cached_category_list_follows_a_rename(self):
+        url = reverse('category-list')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.title = 'Mobile phones'
+            self.category.save()
+        self.assertEqual([category['title'] for category in self.client.get(url).json()], ['Mobile phones'])
+
+
+class ResponseCacheTests(CatalogTestCase):
+    """Pre-rendered bodies and conditional GETs of the views fronted by RenderedCacheMixin."""
+
+    def setUp(self):
+        super().setUp()
+        slug = self.products[0].slug
+        # url and the tag whose bump changes its body
+        self.views = [
+            (reverse('category-list'), CATEGORY_LIST_TAG),
+            (reverse('product-detail', kwargs={'slug': slug}), product_tag(slug)),
+            (reverse('product-attributes', kwargs={'slug': slug}), product_tag(slug)),
+        ]
+
+    def test_hit_serves_the_same_bytes(self):
+        for url, _ in self.views:
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                second = self.client.get(url)
+                self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_bump_misses(self):
+        for url, tag in self.views:
+            with self.subTest(url=url):
+                self.client.get(url)
+                bump(tag)
+                self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_browsable_api_is_rendered_uncached(self):
+        url, _ = self.views[0]
+        response = self.client.get(url, headers={'Accept': 'text/html'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Cache', response)
+
+    def test_matching_etag_is_not_modified(self):
+        for url, tag in self.views:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+                bump(tag)
+                response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        for url, _ in self.views:
+            with self.subTest(url=url):
+                last_modified = self.client.get(url)['Last-Modified']
+                response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+                self.assertEqual(response.status_code, 304)
+
+                earlier = http_date(parse_http_date(last_modified) - 1)
+                response = self.client.get(url, headers={'If-Modified-Since': earlier})
+                self.assertEqual(response.status_code, 200)
+
+    def test_detail_etag_differs_per_user(self):
+        url, _ = self.views[1]
+        anonymous = self.client.get(url)
+        self.client.force_authenticate(User.objects.create_user('buyer'))
+        response = self.client.get(url, headers={'If-None-Match': anonymous['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Authorization', response['Vary'])
+
+
+class SingleflightTests(CatalogTestCase):
+    def run_concurrently(self, count, target):
+        results = [None] * count
+        barrier = threading.Barrier(count)
+
+        def run(number):
+            barrier.wait()
+            results[number] = target()
+
+        threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_one_fill_under_concurrent_misses(self):
+        fills = []
+
+        def fill():
+            fills.append(1)
+            time.sleep(0.2)
+            return 'rendered'
+
+        results = self.run_concurrently(8, lambda: singleflight.get_or_fill('page', fill, 60))
+        self.assertEqual(len(fills), 1)
+        self.assertEqual({value for value, _ in results}, {'rendered'})
+        statuses = sorted(status for _, status in results)
+        self.assertEqual(statuses, [singleflight.MISS] + [singleflight.SHARED] * 7)
+        self.assertEqual(singleflight.get_or_fill('page', fill, 60), ('rendered', singleflight.HIT))
+
+    def test_followers_get_the_stale_value_while_the_leader_fills(self):
+        cache.set('page:stale', 'old', 60)
+        filling = threading.Event()
+        release = threading.Event()
+
+        def fill():
+            filling.set()
+            release.wait(5)
+            return 'new'
+
+        leader = threading.Thread(target=singleflight.get_or_fill, args=('page', fill, 60), kwargs={'stale_key': 'page:stale'})
+        leader.start()
+        filling.wait(5)
+        try:
+            follower = singleflight.get_or_fill('page', fill, 60, stale_key='page:stale')
+        finally:
+            release.set()
+            leader.join()
+        self.assertEqual(follower, ('old', singleflight.STALE))
+        self.assertEqual(singleflight.get_or_fill('page', fill, 60), ('new', singleflight.HIT))
+
+    def test_waits_for_another_process_filling_the_key(self):
+        # the other process holds the lock in the cache and stores its value a little later
+        cache.add('lock:page', 'other-process', singleflight.LOCK_TIMEOUT)
+        timer = threading.Timer(0.2, lambda: cache.set('page', 'theirs', 60))
+        timer.start()
+        try:
+            result = singleflight.get_or_fill('page', lambda: 'ours', 60)
+        finally:
+            timer.join()
+        self.assertEqual(result, ('theirs', singleflight.SHARED))
+
+    def test_stale_response_keeps_the_etag_of_its_body(self):
+        product = self.products[0]
+        url = reverse('product-detail', kwargs={'slug': product.slug})
+        first = self.client.get(url)
+        self.assertEqual(first.json()['price'], 100)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 111
+            product.save()
+
+        # another process is filling the new generation's entry
+        key = versioned_key('product_detail', ['http://testserver/', product.slug, 0], [product_tag(product.slug)])
+        cache.add(f'lock:{key}', 'other-process', singleflight.LOCK_TIMEOUT)
+        stale = self.client.get(url)
+        self.assertEqual(stale['X-Cache'], singleflight.STALE)
+        self.assertEqual(stale.json()['price'], 100)
+        # the hash of the old bytes, not the current generation's validator
+        self.assertEqual(stale['ETag'], '"%s"' % hashlib.sha1(stale.content).hexdigest())
+        self.assertNotEqual(stale['ETag'], first['ETag'])
+        self.assertNotIn('Last-Modified', stale)
+        # under the current generation's ETag this would be a 304 for the old price
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=stale['ETag']).status_code, 200)
+
+        cache.delete(f'lock:{key}')
+        fresh = self.client.get(url, HTTP_IF_NONE_MATCH=stale['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(fresh.json()['price'], 111)
+        self.assertNotEqual(fresh['ETag'], stale['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=fresh['ETag']).status_code, 304)
+
+
+class FacetFilterTests(CatalogTestCase):
+    def test_filter_key_is_unambiguous(self):
+        keys = [
+            facets.filter_key({'color': ['red,blue']}),
+            facets.filter_key({'color': ['blue', 'red']}),
+            facets.filter_key({'color': ['red;size=XL']}),
+            facets.filter_key({'color': ['red'], 'size': ['XL']}),
+        ]
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_cached_pages_of_lookalike_filters_stay_apart(self):
+        finish = AttributeKey.objects.create(key='finish')
+        gloss_matte = AttributeValue.objects.create(value='gloss,matte')
+        matte = AttributeValue.objects.create(value='matte')
+        ProductAttribute.objects.create(product=self.products[0], key=finish, value=gloss_matte)
+        ProductAttribute.objects.create(product=self.products[1], key=finish, value=matte)
+        url, _ = self.list_url()
+
+        combined = self.client.get(f'{url}?attr[finish]=gloss,matte')
+        separate = self.client.get(f'{url}?attr[finish]=matte&attr[finish]=gloss')
+        self.assertEqual([product['name'] for product in combined.data['results']], ['Phone 0'])
+        self.assertEqual([product['name'] for product in separate.data['results']], ['Phone 1'])
+        self.assertEqual(separate['X-Cache'], 'MISS')
+
+    def test_duplicate_attribute_row_keeps_the_product_in_the_facet(self):
+        finish = AttributeKey.objects.create(key='finish')
+        matte = AttributeValue.objects.create(value='matte')
+        first, second = (
+            ProductAttribute.objects.create(product=self.products[0], key=finish, value=matte) for _ in range(2)
+        )
+        self.assertEqual(facets.get_index(self.group.pk).match({'finish': ['matte']}), [self.products[0].pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(facets.get_index(self.group.pk).match({'finish': ['matte']}), [self.products[0].pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(facets.get_index(self.group.pk).match({'finish': ['matte']}), [])
+
+
+class AttributeTests(CatalogTestCase):
+    product_count = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        add_attributes(cls.products)
+
+    def test_attribute_view_renders_a_dict_of_names(self):
+        product = self.products[3]
+        response = self.client.get(reverse('product-attributes', kwargs={'slug': product.slug}))
+        self.assertEqual(response.json(), {
+            'id': product.pk, 'name': 'Phone 3', 'slug': product.slug,
+            'attributes': {'color': 'color 3', 'memory': '128 GB'},
+        })
+
+    def test_a_page_of_products_loads_its_attributes_in_one_query(self):
+        products = list(Product.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            data = ProductAttributeSerializer(products, many=True).data
+        self.assertEqual(len(data), self.product_count)
+        self.assertEqual(data[0]['attributes'], {'color': 'color 0', 'memory': '128 GB'})
+
+    def test_prefetched_attributes_cost_no_query(self):
+        products = list(plan_queryset(Product.objects.order_by('pk'), ProductAttributeSerializer))
+        with self.assertNumQueries(0):
+            loaded = load_attributes(products)
+        self.assertEqual(sum(map(len, loaded.values())), 2 * self.product_count)
+
+    def test_model_helpers(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        with self.assertNumQueries(1):
+            attributes = product.get_attributes_as_dict
+        # keyed by AttributeKey with AttributeValue values, as before; app.attributes.as_dict gives strings
+        self.assertEqual(
+            {key.key: value.value for key, value in attributes.items()}, {'color': 'color 0', 'memory': '128 GB'},
+        )
+        self.assertEqual(
+            [(item['attribute_key'].key, item['attribute_value'].value) for item in product.get_attribute()],
+            [('color', 'color 0'), ('memory', '128 GB')],
+        )
+
+
+class SearchTests(CatalogTestCase):
+    """``Phone N`` has the word in its name, the newer cases only in their description."""
+    case_count = 550
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cases = Product.objects.bulk_create(
+            Product(name=f'Case {number}', slug=f'case-{number}', description='Fits a phone', price=10, group=cls.group)
+            for number in range(cls.case_count)
+        )
+        # bulk_create sends no signals
+        search.reindex([product.pk for product in cls.products + cls.cases])
+
+    def test_older_better_matches_rank_first(self):
+        response = self.client.get(reverse('search'), {'q': 'phone', 'limit': self.product_count})
+        self.assertEqual(response.data['count'], self.product_count + self.case_count)
+        self.assertEqual(
+            sorted(product['name'] for product in response.data['results']),
+            [product.name for product in self.products],
+        )
+
+    def test_pages_past_the_newest_matches(self):
+        ids, count = search.search('phone', 10, offset=self.product_count + self.case_count - 10)
+        self.assertEqual(count, self.product_count + self.case_count)
+        self.assertEqual(len(ids), 10)
+
+    def test_only_changed_terms_drop_cached_results(self):
+        phones = search.search('phone', self.product_count)
+        self.assertEqual(search.search('tablet', 10), ([], 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].price = 1
+            self.products[0].save()
+            self.cases[0].name = 'Cover 0'
+            self.cases[0].save()
+        with self.assertNumQueries(0):
+            self.assertEqual(search.search('phone', self.product_count), phones)
+            self.assertEqual(search.search('tablet', 10), ([], 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].name = 'Tablet 0'
+            self.products[0].description = 'A tablet'
+            self.products[0].save()
+        self.assertNotIn(self.products[0].pk, search.search('phone', self.product_count)[0])
+        self.assertEqual(search.search('tablet', 10), ([self.products[0].pk], 1))
+
+    def test_memory_index_is_replaced_behind_the_searches(self):
+        backend = search.MemoryBackend()
+        old = backend.get_index()
+        # no delta, the index can't catch up
+        bump(search.SEARCH_TAG)
+        with backend.building:
+            # while another thread reads every product into the new index
+            with self.assertNumQueries(0):
+                self.assertIs(backend.get_index(), old)
+        new = backend.get_index()
+        self.assertIsNot(new, old)
+        self.assertIs(backend.get_index(), new)
+        self.assertEqual(new.search(['phone'], 10, 0)[1], self.product_count + self.case_count)
+
+
+class SuggestTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, suggest, '_suggester', None)
+        suggest._suggester = suggest.build()
+
+    def test_broken_chain_rebuilds_in_the_background(self):
+        old = suggest.get_suggester()
+        Product.objects.create(name='Pager', description='A pager', price=5, group=self.group)
+        # no delta for the bump, the chain is broken
+        bump(suggest.SUGGEST_TAG)
+        with mock.patch.object(suggest, 'in_background') as in_background:
+            self.assertIs(suggest.get_suggester(), old)
+            self.assertIs(suggest.get_suggester(), old)
+        in_background.assert_called_once_with(suggest.rebuild, 'suggest-rebuild')
+
+        suggest.rebuild()
+        self.assertFalse(suggest._rebuilding)
+        self.assertEqual([entry['name'] for entry in suggest.suggest('pag')], ['Pager'])
+
+    def test_only_indexed_fields_publish_deltas(self):
+        product = self.products[0]
+        user = User.objects.create_user('buyer', password='secret')
+        before = generations([suggest.SUGGEST_TAG])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 1
+            product.save()
+            likes.like(user, product)
+        self.assertEqual(generations([suggest.SUGGEST_TAG]), before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Pager'
+            product.save()
+        self.assertNotEqual(generations([suggest.SUGGEST_TAG]), before)
+        self.assertEqual([entry['name'] for entry in suggest.suggest('pag')], ['Pager'])
+
+
+class SlugTests(CatalogTestCase):
+    """The fixture products hold ``phone-0`` to ``phone-4``."""
+
+    def test_suffix_follows_the_highest_numbered_slug(self):
+        for name in ['Phone case', 'Phones', 'Phone 7 case', 'Phone 12345678901234567890']:
+            Product.objects.create(name=name, description='', price=1, group=self.group)
+        with self.assertNumQueries(1):
+            slugs = SlugAllocator(Product).allocate(['Phone', 'Phone', 'Phone case', 'Tablet'])
+        self.assertEqual(slugs, ['phone-5', 'phone-6', 'phone-case-1', 'tablet'])
+
+    def test_bare_base_is_handed_out_first(self):
+        Product.objects.create(name='Tablet', description='', price=1, group=self.group)
+        self.assertEqual(SlugAllocator(Product).allocate(['Tablet', 'Tablet']), ['tablet-1', 'tablet-2'])
+        self.assertEqual(Product.objects.create(name='Tablet', description='', price=1, group=self.group).slug, 'tablet-1')
+
+
+@override_settings(MEDIA_ROOT=os.path.join(tempfile.gettempdir(), 'olcha-test-media'))
+class ImageVariantTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(shutil.rmtree, default_storage.location, ignore_errors=True)
+
+    def upload(self, name, mode):
+        buffer = io.BytesIO()
+        PILImage.new(mode, (400, 300)).save(buffer, 'PNG' if mode == 'RGBA' else 'JPEG')
+        stored = default_storage.save(name, ContentFile(buffer.getvalue()))
+        return Image.objects.create(product=self.products[0], image=stored)
+
+    def test_same_name_other_extension_keeps_its_own_variants(self):
+        jpeg, png = self.upload('images/front.jpg', 'RGB'), self.upload('images/front.png', 'RGBA')
+        # run like an eager task, inside the caller's transaction
+        images.generate(Image, jpeg.pk, [product_tag(self.products[0].slug)])
+        images.generate(Image, png.pk, [product_tag(self.products[0].slug)])
+        self.assertTrue(connection.in_atomic_block)
+
+        jpeg.refresh_from_db()
+        png.refresh_from_db()
+        jpeg_webp = [name for _, _, name in jpeg.variants['sources']['webp']]
+        png_webp = [name for _, _, name in png.variants['sources']['webp']]
+        self.assertEqual(jpeg_webp, ['derivatives/images/front.jpg/160.webp', 'derivatives/images/front.jpg/320.webp',
+                                     'derivatives/images/front.jpg/400.webp'])
+        self.assertTrue(set(jpeg_webp).isdisjoint(png_webp))
+        self.assertTrue(all(default_storage.exists(name) for name in jpeg_webp + png_webp))
+
+
+class PriceUpdateTests(CatalogTestCase):
+    def test_failing_chunk_is_reported_and_the_others_apply(self):
+        write_prices = pricing.write_prices
+        calls = []
+
+        def fail_second_chunk(alias, products):
+            calls.append(products)
+            if len(calls) == 2:
+                raise OperationalError('database is locked')
+            write_prices(alias, products)
+
+        records = [{'slug': product.slug, 'price': 50 + number} for number, product in enumerate(self.products)]
+        with mock.patch.object(pricing, 'write_prices', fail_second_chunk), self.assertLogs('app.pricing', 'ERROR'):
+            results = pricing.apply_prices(records, chunk_size=2)
+
+        self.assertEqual([result['status'] for result in results], ['updated'] * 2 + ['failed'] * 2 + ['updated'])
+        self.assertEqual(results[2], {'slug': self.products[2].slug, 'status': 'failed', 'error': 'database is locked'})
+        self.assertEqual(pricing.summary(results)['failed'], 2)
+        prices = dict(Product.objects.values_list('slug', 'price'))
+        self.assertEqual([prices[product.slug] for product in self.products], [50, 51, 102, 103, 54])
+
+    def test_records_without_a_slug_are_reported_by_number(self):
+        product = self.products[0]
+        records = [
+            {'slug': product.slug, 'price': 1},
+            'not json',
+            {'slug': product.slug, 'price': -1},
+            json.dumps({'price': 5}),
+            [product.slug],
+        ]
+        results = pricing.apply_prices(records, chunk_size=2)
+        self.assertEqual([result['status'] for result in results], ['updated'] + ['invalid'] * 4)
+        self.assertEqual(
+            [result.get('slug', result.get('record')) for result in results],
+            [product.slug, 2, product.slug, 4, 5],
+        )
+
+
+class RatingTests(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create_user('reviewer')
+
+    def aggregates(self, product):
+        product = Product.objects.get(pk=product.pk)
+        return product.rating_count, product.rating_sum, [getattr(product, f'stars_{stars}') for stars in range(6)]
+
+    def test_comment_create_edit_and_delete(self):
+        product = self.products[0]
+        comment = Comment.objects.create(product=product, user=self.user, comment='Good', rating=4)
+        Comment.objects.create(product=product, user=self.user, comment='Fine', rating=3)
+        self.assertEqual(self.aggregates(product), (2, 7, [0, 0, 0, 1, 1, 0]))
+
+        comment.rating = 2
+        comment.save()
+        self.assertEqual(self.aggregates(product), (2, 5, [0, 0, 1, 1, 0, 0]))
+        comment.comment = 'Edited, same rating'
+        comment.save()
+        self.assertEqual(self.aggregates(product), (2, 5, [0, 0, 1, 1, 0, 0]))
+
+        comment.delete()
+        self.assertEqual(self.aggregates(product), (1, 3, [0, 0, 0, 1, 0, 0]))
+
+    def test_rebuild_command_fixes_the_aggregates_and_cached_bodies(self):
+        product = self.products[0]
+        Comment.objects.create(product=product, user=self.user, comment='Good', rating=5)
+        Comment.objects.create(product=product, user=self.user, comment='Bad', rating=1)
+        # drifted, e.g. written before the signals kept them
+        Product.objects.filter(pk=product.pk).update(rating_count=1, rating_sum=1, stars_5=0)
+        url = reverse('product-detail', kwargs={'slug': product.slug})
+        self.assertEqual(self.client.get(url).json()['avg_rating'], 1.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_ratings', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(self.aggregates(product), (2, 6, [0, 1, 0, 0, 0, 1]))
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['avg_rating'], 3.0)
+
+
+class LikeTests(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create_user('buyer')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.product = self.products[0]
+        self.like_url = reverse('product-like', kwargs={'slug': self.product.slug})
+        self.detail_url = reverse('product-detail', kwargs={'slug': self.product.slug})
+
+    def like_count(self):
+        return Product.objects.values_list('like_count', flat=True).get(pk=self.product.pk)
+
+    def test_like_and_unlike(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.like_url)
+        self.assertEqual(response.data, {'is_liked': True, 'like_count': 1})
+        self.assertTrue(self.product.user_like.filter(pk=self.user.pk).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(self.like_url)
+        self.assertEqual(response.data, {'is_liked': False, 'like_count': 0})
+        self.assertFalse(self.product.user_like.exists())
+
+    def test_liking_twice_counts_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.like_url)
+            response = self.client.post(self.like_url)
+        self.assertEqual(response.data, {'is_liked': True, 'like_count': 1})
+        self.assertEqual(self.product.user_like.count(), 1)
+        self.assertEqual(self.like_count(), 1)
+
+    def test_like_is_not_served_from_the_detail_cache(self):
+        self.client.get(self.detail_url)
+        response = self.client.get(self.detail_url)
+        self.assertEqual((response['X-Cache'], response.json()['like_count'], response.json()['is_liked']), ('HIT', 0, False))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.like_url)
+        response = self.client.get(self.detail_url)
+        self.assertEqual((response['X-Cache'], response.json()['like_count'], response.json()['is_liked']), ('MISS', 1, True))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(self.like_url)
+        response = self.client.get(self.detail_url)
+        self.assertEqual((response['X-Cache'], response.json()['like_count'], response.json()['is_liked']), ('MISS', 0, False))
+
+    def test_clearing_a_users_likes_recounts_in_a_task(self):
+        for product in self.products[:3]:
+            product.user_like.add(self.user)
+        self.client.get(self.detail_url)
+        Task.objects.all().delete()
+
+        self.user.user_like.clear()
+        # the counts are only fixed by the worker
+        self.assertEqual(self.like_count(), 1)
+        task = Task.objects.get()
+        self.assertEqual(task.name, 'likes.recount')
+        self.assertEqual(sorted(task.payload['product_ids']), sorted(product.pk for product in self.products[:3]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.execute(tasks.claim('worker', 1)[0])
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=task.payload['product_ids']).values_list('like_count', flat=True)),
+            [0, 0, 0],
+        )
+        response = self.client.get(self.detail_url)
+        self.assertEqual((response['X-Cache'], response.json()['like_count']), ('MISS', 0))
+
+
+class ImportTests(CatalogTestCase):
+    def jsonl(self, *names):
+        return [json.dumps({'name': name, 'price': 10, 'group': 'smartphones'}).encode() + b'\n' for name in names]
+
+    def test_resumed_run_skips_the_committed_chunks(self):
+        lines = self.jsonl('Pager 1', 'Pager 2', 'Pager 3', 'Pager 4')
+
+        def interrupted():
+            yield from lines[:2]
+            raise OSError('connection reset')
+
+        with self.assertRaises(OSError):
+            importer.import_products(interrupted(), 'jsonl', 'pagers', chunk_size=2)
+        self.assertEqual(ImportRun.objects.get(name='pagers').position, 2)
+
+        result = importer.import_products(iter(lines), 'jsonl', 'pagers', chunk_size=2)
+        self.assertEqual(result.processed, 2)
+        self.assertEqual(
+            sorted(Product.objects.filter(name__startswith='Pager').values_list('name', flat=True)),
+            ['Pager 1', 'Pager 2', 'Pager 3', 'Pager 4'],
+        )
+        # a finished run imports nothing again
+        self.assertEqual(importer.import_products(iter(lines), 'jsonl', 'pagers').processed, 0)
+
+    def test_bad_rows_are_reported_and_the_chunk_goes_on(self):
+        body = (
+            'name,price,group,attr:color\n'
+            'Pager 1,10,smartphones,red\n'
+            'Pager 2,cheap,smartphones,red\n'
+            ',10,smartphones,\n'
+            'Pager 3,12,smartphones,blue\n'
+        ).encode()
+        stats = importer.import_products(io.BytesIO(body), 'csv', 'pagers.csv').stats()
+        self.assertEqual((stats['created'], stats['failed']), (2, 2))
+        self.assertEqual(stats['errors'], [
+            {'record': 2, 'error': 'price must be a number'}, {'record': 3, 'error': 'name is required'},
+        ])
+        pager = Product.objects.get(name='Pager 3')
+        self.assertEqual(as_dict(load_attributes([pager])[pager.pk]), {'color': 'blue'})
+
+    def test_groups_match_by_slug_or_name(self):
+        feature = Group.objects.create(name='Feature phones', category=self.category, image='images/feature.jpg')
+        lines = [
+            json.dumps({'name': f'Pager {number}', 'price': 10, 'group': group}).encode()
+            for number, group in enumerate([feature.slug, 'FEATURE PHONES', ' Smartphones ', 'tablets'])
+        ]
+        stats = importer.import_products(iter(lines), 'jsonl', 'groups').stats()
+        self.assertEqual(stats['errors'], [{'record': 4, 'error': "unknown group 'tablets'"}])
+        groups = dict(Product.objects.filter(name__startswith='Pager').values_list('name', 'group_id'))
+        self.assertEqual(groups, {'Pager 0': feature.pk, 'Pager 1': feature.pk, 'Pager 2': self.group.pk})
+
+
+class ExportTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(User.objects.create_user('reseller'))
+
+    def export(self, **query):
+        response = self.client.get(reverse('product-export'), query)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        response, body = self.export(category=self.category.slug)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [product.pk for product in self.products])
+        self.assertEqual(rows[0]['slug'], self.products[0].slug)
+        self.assertNotIn('is_liked', rows[0])
+
+    def test_json(self):
+        response, body = self.export(group=self.group.slug, format='json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual([row['name'] for row in json.loads(body)], [product.name for product in self.products])
+
+    def test_empty_export_is_an_empty_array(self):
+        _, body = self.export(category='no-such-category', format='json')
+        self.assertEqual(json.loads(body), [])
+        _, body = self.export(category='no-such-category')
+        self.assertEqual(body, b'')
+
+    def test_category_or_group_is_required(self):
+        response = self.client.get(reverse('product-export'), {'format': 'json'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': 'category or group is required'})
+
+    def test_queries_dont_grow_with_the_products(self):
+        with CaptureQueriesContext(connection) as few:
+            self.export(category=self.category.slug)
+        for number in range(10):
+            Product.objects.create(name=f'Phone {self.product_count + number}', price=1, group=self.group)
+        with CaptureQueriesContext(connection) as more:
+            _, body = self.export(category=self.category.slug)
+        self.assertEqual(len(body.splitlines()), self.product_count + 10)
+        self.assertEqual(len(more), len(few))
+
+
+@override_settings(CACHE_WARM_URL='http://testserver')
+class WarmingTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        Task.objects.all().delete()
+
+    def warms(self):
+        return list(Task.objects.filter(name='cache.warm_product').values_list('payload__slug', flat=True))
+
+    def test_a_save_schedules_one_warm(self):
+        product = self.products[0]
+        product.price = 150
+        product.save()
+        self.assertEqual(self.warms(), [product.slug])
+
+        # still pending: the same task runs, once
+        product.description = 'A better phone'
+        product.save()
+        self.assertEqual(self.warms(), [product.slug])
+
+    def test_bulk_writes_schedule_none(self):
+        records = [{'slug': product.slug, 'price': 50} for product in self.products]
+        pricing.apply_prices(records)
+        lines = [json.dumps({'name': 'Pager', 'price': 10, 'group': self.group.slug}).encode() + b'\n']
+        importer.import_products(iter(lines), 'jsonl', 'pagers')
+        self.assertEqual(Product.objects.filter(price=50).count(), self.product_count)
+        self.assertTrue(Product.objects.filter(name='Pager').exists())
+        self.assertEqual(self.warms(), [])
+
+    def test_warm_renders_the_page_into_the_cache(self):
+        product = self.products[0]
+        product.save()
+        tasks.execute(tasks.claim('worker', 1)[0])
+        response = self.client.get(reverse('product-detail', kwargs={'slug': product.slug}))
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+
+task_calls = []
+
+
+@tasks.register('tests.record')
+def record_task(**payload):
+    task_calls.append(payload)
+
+
+@tasks.register('tests.fail', max_attempts=2)
+def failing_task():
+    raise RuntimeError('handler broke')
+
+
+class TaskQueueTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        task_calls.clear()
+        # the image renders queued by the fixtures
+        Task.objects.all().delete()
+
+    def test_pending_duplicate_takes_the_new_payload(self):
+        tasks.enqueue('tests.record', {'version': 1}, dedupe_key='record:1')
+        tasks.enqueue('tests.record', {'version': 2}, dedupe_key='record:1')
+        self.assertEqual(list(Task.objects.values_list('payload', flat=True)), [{'version': 2}])
+
+        # once it runs, a new enqueue queues another task instead of changing the running one
+        claimed = tasks.claim('worker', 10)
+        tasks.enqueue('tests.record', {'version': 3}, dedupe_key='record:1')
+        self.assertEqual(Task.objects.filter(status=Task.Status.pending).get().payload, {'version': 3})
+        tasks.execute(claimed[0])
+        self.assertEqual(task_calls, [{'version': 2}])
+
+    def test_claim_order(self):
+        tasks.enqueue('tests.record', {'name': 'low'}, priority=-1)
+        tasks.enqueue('tests.record', {'name': 'first'})
+        tasks.enqueue('tests.record', {'name': 'second'})
+        tasks.enqueue('tests.record', {'name': 'high'}, priority=5)
+        tasks.enqueue('tests.record', {'name': 'later'}, priority=9, delay=60)
+        for pk in tasks.claim('worker', 10):
+            tasks.execute(pk)
+        self.assertEqual([call['name'] for call in task_calls], ['high', 'first', 'second', 'low'])
+        self.assertEqual(list(Task.objects.values_list('payload', flat=True)), [{'name': 'later'}])
+
+    def test_failing_task_is_retried_with_backoff_then_failed(self):
+        tasks.enqueue('tests.fail')
+        with self.assertLogs('app.tasks', 'ERROR'):
+            tasks.execute(tasks.claim('worker', 1)[0])
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, task.locked_by), (Task.Status.pending, 1, ''))
+        self.assertIn('RuntimeError: handler broke', task.last_error)
+        self.assertAlmostEqual(
+            (task.run_at - task.updated_at).total_seconds(), tasks.RETRY_BASE, delta=1,
+        )
+        self.assertEqual(tasks.claim('worker', 1), [])
+
+        Task.objects.update(run_at=task.run_at - timedelta(seconds=tasks.RETRY_BASE))
+        with self.assertLogs('app.tasks', 'ERROR'):
+            tasks.execute(tasks.claim('worker', 1)[0])
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.Status.failed, 2))
+        self.assertEqual(tasks.claim('worker', 1), [])
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    """Outside TestCase's transaction, which would send every read to the primary."""
+
+    def test_reads_go_to_the_chosen_replica(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Product))
+        with reading_from('replica1'):
+            self.assertEqual(router.db_for_read(Product), 'replica1')
+            self.assertEqual(router.db_for_write(Product), 'default')
+        self.assertIsNone(router.db_for_read(Product))
+
+    def test_reads_inside_atomic_stay_on_the_primary(self):
+        router = ReplicaRouter()
+        with reading_from('replica1'):
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Product), 'default')
+                self.assertEqual(router.db_for_write(Product), 'default')
+            self.assertEqual(router.db_for_read(Product), 'replica1')
+
+    def test_migrations_run_on_the_primary_only(self):
+        router = ReplicaRouter()
+        self.assertTrue(router.allow_migrate('default', 'app'))
+        self.assertFalse(router.allow_migrate('replica1', 'app'))
+
+
+@override_settings(CACHES=TEST_CACHES, TASKS_EAGER=False, CACHE_WARM_URL=None)
+class AsyncViewTests(TransactionTestCase):
+    """The async twins run the sync views in another thread, which can't see a TestCase's transaction."""
+
+    routes = ['category-list', 'group-list', 'product-list', 'product-detail', 'product-attributes']
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        request_started.disconnect(signals.warm_suggestions)
+
+    def setUp(self):
+        category = Category.objects.create(title='Phones', image='images/phones.jpg')
+        group = Group.objects.create(name='Smartphones', category=category, image='images/smart.jpg')
+        product = Product.objects.create(name='Phone', description='A phone', price=100, group=group)
+        add_attributes([product])
+        self.kwargs = {
+            'category-list': {},
+            'group-list': {'slug': category.slug},
+            'product-list': {'category_slug': category.slug, 'slug': group.slug},
+            'product-detail': {'slug': product.slug},
+            'product-attributes': {'slug': product.slug},
+        }
+        cache.clear()
+
+    def test_async_routes_answer_like_their_sync_twins(self):
+        for name in self.routes:
+            with self.subTest(name=name):
+                # each rendered from the database, not from the other's cache entry
+                cache.clear()
+                twin = async_to_sync(self.async_client.get)(reverse(f'async-{name}', kwargs=self.kwargs[name]))
+                cache.clear()
+                response = self.client.get(reverse(name, kwargs=self.kwargs[name]))
+                self.assertEqual(twin.status_code, 200)
+                twin_body, body = json.loads(twin.content), json.loads(response.content)
+                if isinstance(body, dict) and 'results' in body:
+                    # page links point at the route that served the page
+                    for link in ('next', 'previous'):
+                        twin_body.pop(link, None), body.pop(link, None)
+                self.assertEqual(twin_body, body)
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def test_sqlite_pragmas_are_set_on_connect(self):
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        path = os.path.join(tempfile.mkdtemp(), 'pragmas.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': path}, alias='pragmas')
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    def test_settings_load_without_database_variables(self):
+        env = {name: value for name, value in os.environ.items() if not name.startswith('DB_')}
+        output = subprocess.run(
+            [sys.executable, '-c', 'import root.settings as s; print(sorted(s.DATABASES), s.DATABASES["default"]["ENGINE"])'],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertEqual(output.strip(), "['default'] django.db.backends.sqlite3")
@@ -1,8 +1,7 @@
-from app.views.app import views
+from app.views.app import async_views, views
 from app.views.auth import views as auth_views
 from django.urls import path
 from root import token_vieww
-from django.views.decorators.cache import cache_page
 
 urlpatterns = [
     path('categories/', views.CategoryListView.as_view(), name='category-list'),
@@ -10,13 +9,29 @@ urlpatterns = [
     path('category-create/', views.CreateCategoryView.as_view(), name='category-create'),
     path('category/<slug:slug>/update/', views.UpdateCategoryView.as_view(), name='category-update'),
     path('category/<slug:slug>/delete/', views.DeleteCategoryView.as_view(), name='category-delete'),
+    # before product-list, which would take `groups` for a group slug
+    path('category/<slug:slug>/groups/', views.GroupListView.as_view(), name='group-list'),
     path('category/<slug:category_slug>/<slug:slug>/',  views.ProductListView.as_view(), name='product-list'),
-    path('<slug:slug>/product/attributes/', cache_page(60 * 3)(views.ProductAttributeView.as_view()),
-         name='product-attributes'),
+    path('category/<slug:category_slug>/<slug:slug>/facets/', views.FacetCountsView.as_view(), name='product-facets'),
+    path('<slug:slug>/product/attributes/', views.ProductAttributeView.as_view(), name='product-attributes'),
+    path('products-import/', views.ProductImportView.as_view(), name='product-import'),
+    path('products-prices/', views.ProductPriceUpdateView.as_view(), name='product-prices'),
+    path('products-export/', views.ProductExportView.as_view(), name='product-export'),
     path('products/<slug:slug>/', (views.ProductDetail.as_view()), name='product-detail'),
+    path('products/<slug:slug>/like/', views.ProductLikeView.as_view(), name='product-like'),
 
-    # group
-    path('category/<slug:slug>/groups/', views.GroupListView.as_view(), name='group-list'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('search/complete/', views.SearchCompletionView.as_view(), name='search-complete'),
+    path('suggest/', views.suggest_view, name='suggest'),
+
+    path('cache/stats/', views.CacheStatsView.as_view(), name='cache-stats'),
+
+    # async twins of the catalog reads, for ASGI servers
+    path('async/categories/', async_views.category_list, name='async-category-list'),
+    path('async/category/<slug:slug>/groups/', async_views.group_list, name='async-group-list'),
+    path('async/category/<slug:category_slug>/<slug:slug>/', async_views.product_list, name='async-product-list'),
+    path('async/products/<slug:slug>/', async_views.product_detail, name='async-product-detail'),
+    path('async/<slug:slug>/product/attributes/', async_views.product_attributes, name='async-product-attributes'),
 
     # auth
     path("login/", token_vieww.LoginView.as_view(), name="user_login"),
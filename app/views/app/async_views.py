@@ -0,0 +1,43 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from app.views.app import views
+
+# Async entry points of the read-only catalog views, served under async/. Each one hands the
+# request to its sync twin at a single sync_to_async boundary, so both paths share the cache,
+# hydrate and conditional GET code and render the same bytes.
+#
+# Under ASGI Django runs a sync view through sync_to_async(thread_sensitive=True): one thread
+# for the whole process, every request waits for the one before it. These run in the event
+# loop's executor instead, as many requests at once as it has threads.
+
+
+def async_twin(view_class):
+    view = view_class.as_view()
+
+    def run(request, *args, **kwargs):
+        # the executor's threads outlive requests, their connections are handled like a WSGI
+        # server's: closed when unusable or past CONN_MAX_AGE, before and after each request
+        close_old_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            # rendered here, not in a thread_sensitive hop of the handler
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    async def twin(request, *args, **kwargs):
+        return await sync_to_async(run, thread_sensitive=False)(request, *args, **kwargs)
+
+    twin.csrf_exempt = True
+    twin.view_class = view_class
+    return twin
+
+
+category_list = async_twin(views.CategoryListView)
+group_list = async_twin(views.GroupListView)
+product_list = async_twin(views.ProductListView)
+product_detail = async_twin(views.ProductDetail)
+product_attributes = async_twin(views.ProductAttributeView)
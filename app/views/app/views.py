@@ -1,184 +1,474 @@
-# Create your views here.
-
-from urllib import request
-
-from django.core.cache import cache
-from django.db.models import Prefetch, Avg
-from django.views.decorators.cache import cache_page
-from rest_framework.exceptions import NotFound
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.shortcuts import get_object_or_404
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import generics, status
-from app.models import Category, Product, Group, Image, Comment
-from app.serializers import CategorySerializer, ProductSerializer, GroupSerializer, ProductAttributeSerializer
-from app import permissions
-
-
-# cac4he
-
-
-class CategoryListView(generics.ListAPIView):
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
-
-
-class CategoryDetail(generics.RetrieveAPIView):
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
-    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
-
-    def retrieve(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-
-        category = Category.objects.get(slug=slug)
-        serializer = CategorySerializer(category)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
-    def put(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-        category = Category.objects.get(slug=slug)
-        serializer = CategorySerializer(category, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-    def delete(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-        category = Category.objects.get(slug=slug)
-        category.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-class CreateCategoryView(generics.CreateAPIView):
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
-    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
-
-
-class UpdateCategoryView(generics.UpdateAPIView):
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
-    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
-
-    def get(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-        category = get_object_or_404(Category, slug=slug)
-        serializer = CategorySerializer(category)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
-    def put(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-        category = get_object_or_404(Category, slug=slug)
-        serializer = CategorySerializer(category, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
-class DeleteCategoryView(generics.DestroyAPIView):
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
-    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
-    lookup_field = 'slug'
-
-    def get(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-        category = get_object_or_404(Category, slug=slug)
-        serializer = CategorySerializer(category)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
-    #
-    def delete(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-        category = get_object_or_404(Category, slug=slug)
-        category.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
-    serializer_class = ProductSerializer
-    lookup_field = 'slug'
-
-    def get_queryset(self):
-        # Return the queryset as usual
-        return Product.objects.all().prefetch_related('images', 'comments').annotate(avg_rating=Avg('comments__rating'))
-
-    def get(self, request, *args, **kwargs):
-        slug = self.kwargs['slug']
-        cache_key = f'product_detail_{slug}'
-
-        # Try to get cached data
-        cached_data = cache.get(cache_key)
-        if cached_data is not None:
-            return Response(cached_data, status=status.HTTP_200_OK)
-
-        # Fetch the product instance
-        product = self.get_object()
-
-        # Serialize the product instance
-        serializer = self.get_serializer(product)
-        data = serializer.data
-
-        # Cache the serialized data
-        cache.set(cache_key, data, timeout=3)  # Cache for 15 minutes
-
-        return Response(data, status=status.HTTP_200_OK)
-
-
-class GroupListView(generics.ListCreateAPIView):
-    queryset = Group.objects.select_related('category')
-    serializer_class = GroupSerializer
-    lookup_field = 'slug'
-
-    def get_object(self):
-        obj = get_object_or_404(Group, slug=self.kwargs['slug'])
-        if not obj:
-            raise NotFound("Group not found")
-        return obj
-
-
-class ProductListView(generics.ListCreateAPIView):
-    serializer_class = ProductSerializer
-    lookup_field = 'slug'
-    permission_classes = [permissions.IsOwnerIsAuthenticated]
-    authentication_classes = [JWTAuthentication]
-
-    def get_queryset(self):
-        category_slug = self.kwargs.get('category_slug')
-        group_slug = self.kwargs.get('slug')
-
-        cache_key = f'product_list_{category_slug}_{group_slug}'
-        cached_queryset = cache.get(cache_key)
-        # Use select_related for foreign keys and prefetch_related for many-to-many and reverse relationships
-
-        if cached_queryset is not None:
-            return cached_queryset
-
-        queryset = Product.objects.select_related('group__category').prefetch_related(
-            Prefetch('images', queryset=Image.objects.filter(is_primary=True)),
-            Prefetch('comments', queryset=Comment.objects.all()),
-            'user_like'
-        ).annotate(avg_rating=Avg('comments__rating'))
-
-        if category_slug and group_slug:
-            queryset = queryset.filter(group__category__slug=category_slug, group__slug=group_slug)
-        elif category_slug:
-            queryset = queryset.filter(group__category__slug=category_slug)
-        elif group_slug:
-            queryset = queryset.filter(group__slug=group_slug)
-        cache.set(cache_key, queryset, 60 * 13)
-        return queryset
-
-
-class ProductAttributeView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.select_related('group').prefetch_related('attributes__key', 'attributes__value')
-    serializer_class = ProductAttributeSerializer
-    lookup_field = 'slug'
+# Create your views here.
+
+from urllib import request
+
+from django.core.cache import cache
+from django.db import router
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.shortcuts import get_object_or_404
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import generics, status
+from app.models import Category, Product, Group
+from app.serializers import CategorySerializer, ProductSerializer, GroupSerializer, ProductAttributeSerializer
+from app import export, facets, importer, likes, permissions, pricing, search, suggest
+from app.cache import (
+    CATEGORY_LIST_TAG, DETAIL_TIMEOUT, GROUP_LIST_TAG, LIST_TIMEOUT, category_tag, group_tag, hydrate,
+    product_list_cache, product_tag, versioned_key,
+)
+from app.conditional import ConditionalGetMixin, PerUserConditionalGetMixin
+from app.db import ReplicaReadMixin
+from app.pagination import KeysetPagination
+from app.parsers import NDJSONParser
+from app.planner import PlannedQuerysetMixin, plan_queryset
+from app.renderers import NDJSONRenderer
+from app.response_cache import RenderedCacheMixin
+
+
+# cac4he
+
+
+class CategoryListView(ReplicaReadMixin, ConditionalGetMixin, RenderedCacheMixin, PlannedQuerysetMixin,
+                       generics.ListAPIView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+
+    def get_condition_tags(self):
+        return [CATEGORY_LIST_TAG]
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+
+        cache_key = versioned_key('category_list', [request.build_absolute_uri('/')], [CATEGORY_LIST_TAG])
+
+        def fill_categories():
+            return self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+
+        return self.cached_response(request, cache_key, fill_categories, LIST_TIMEOUT)
+
+
+class CategoryDetail(generics.RetrieveAPIView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
+
+    def retrieve(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+
+        category = Category.objects.get(slug=slug)
+        serializer = CategorySerializer(category)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def put(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        category = Category.objects.get(slug=slug)
+        serializer = CategorySerializer(category, data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def delete(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        category = Category.objects.get(slug=slug)
+        category.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CreateCategoryView(generics.CreateAPIView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
+
+
+class UpdateCategoryView(generics.UpdateAPIView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
+
+    def get(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        category = get_object_or_404(Category, slug=slug)
+        serializer = CategorySerializer(category)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def put(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        category = get_object_or_404(Category, slug=slug)
+        serializer = CategorySerializer(category, data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class DeleteCategoryView(generics.DestroyAPIView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+    permission_classes = (permissions.IsSuperAdminOrReadOnly,)
+    lookup_field = 'slug'
+
+    def get(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        category = get_object_or_404(Category, slug=slug)
+        serializer = CategorySerializer(category)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    #
+    def delete(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        category = get_object_or_404(Category, slug=slug)
+        category.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ProductDetail(ReplicaReadMixin, PerUserConditionalGetMixin, RenderedCacheMixin, PlannedQuerysetMixin,
+                    generics.RetrieveUpdateDestroyAPIView):
+    queryset = Product.objects.all()
+    serializer_class = ProductSerializer
+    lookup_field = 'slug'
+
+    def get_condition_tags(self):
+        return [product_tag(self.kwargs['slug'])]
+
+    def get(self, request, *args, **kwargs):
+        not_modified = self.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+
+        slug = self.kwargs['slug']
+        # is_liked is the only per-user field, so there are just two variants of the rendered body
+        is_liked = likes.has_liked(request.user, slug=slug)
+        # absolute image urls depend on the host the request came in on
+        parts = [request.build_absolute_uri('/'), slug, int(is_liked)]
+        # any change to the product bumps its generation and the key with it
+        cache_key = versioned_key('product_detail', parts, [product_tag(slug)])
+
+        def fill_detail():
+            # Fetch and serialize the product instance
+            product = self.get_object()
+            serializer = self.get_serializer(product, context={
+                **self.get_serializer_context(), 'liked_ids': {product.pk} if is_liked else set(),
+            })
+            return serializer.data
+
+        # one request per key rebuilds the entry, the others get the previous version or wait for it
+        return self.cached_response(
+            request, cache_key, fill_detail, DETAIL_TIMEOUT, stale_key=':'.join(['product_detail', *map(str, parts)]),
+        )
+
+
+class GroupListView(ReplicaReadMixin, ConditionalGetMixin, PlannedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = Group.objects.all()
+    serializer_class = GroupSerializer
+    lookup_field = 'slug'
+
+    def get_condition_tags(self):
+        return [GROUP_LIST_TAG]
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+        return super().list(request, *args, **kwargs)
+
+    def get_object(self):
+        obj = get_object_or_404(Group, slug=self.kwargs['slug'])
+        if not obj:
+            raise NotFound("Group not found")
+        return obj
+
+
+def catalog_products(category_slug=None, group_slug=None):
+    """The products listed under a category, a group or both, as ProductListView filters them."""
+    queryset = Product.objects.all()
+
+    if category_slug and group_slug:
+        queryset = queryset.filter(group__category__slug=category_slug, group__slug=group_slug)
+    elif category_slug:
+        queryset = queryset.filter(group__category__slug=category_slug)
+    elif group_slug:
+        queryset = queryset.filter(group__slug=group_slug)
+    return queryset
+
+
+def catalog_groups(category_slug, group_slug):
+    groups = Group.objects.filter(slug=group_slug)
+    if category_slug:
+        groups = groups.filter(category__slug=category_slug)
+    return groups
+
+
+class ProductListView(ReplicaReadMixin, PerUserConditionalGetMixin, generics.ListCreateAPIView):
+    serializer_class = ProductSerializer
+    lookup_field = 'slug'
+    permission_classes = [permissions.IsOwnerIsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        category_slug = self.kwargs.get('category_slug')
+        group_slug = self.kwargs.get('slug')
+        queryset = catalog_products(category_slug, group_slug)
+
+        filters = facets.parse_filters(self.request.query_params)
+        if filters and group_slug:
+            group_id = self.get_group_id()
+            if group_id is None:
+                return queryset.none()
+            queryset = facets.filter_products(queryset, group_id, filters)
+        return queryset
+
+    def get_group_id(self):
+        groups = catalog_groups(self.kwargs.get('category_slug'), self.kwargs.get('slug'))
+        return groups.values_list('pk', flat=True).first()
+
+    def get_condition_tags(self):
+        return [category_tag(self.kwargs.get('category_slug')), group_tag(self.kwargs.get('slug'))]
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+
+        paginator = self.paginator
+        page_parts = [
+            self.kwargs.get('category_slug'),
+            self.kwargs.get('slug'),
+            paginator.get_ordering(request),
+            paginator.get_page_size(request),
+            int(paginator.get_include_count(request)),
+            request.query_params.get(paginator.cursor_query_param, ''),
+            facets.filter_key(facets.parse_filters(request.query_params)),
+        ]
+        tags = self.get_condition_tags()
+
+        def fill_page():
+            # paging only needs the ids and the sort key, the rows are hydrated below
+            page = paginator.paginate_queryset(self.filter_queryset(self.get_queryset()).only('pk'), request, view=self)
+            return [product.pk for product in page], paginator.get_state()
+
+        entry, cache_status = product_list_cache.get_or_fill(page_parts, tags, fill_page)
+        paginator.restore_state(request, entry)
+
+        # only the columns and relations ProductSerializer actually renders
+        products = hydrate(plan_queryset(Product.objects.all(), self.get_serializer_class()), entry['ids'])
+        serializer = self.get_serializer(products, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        response['X-Cache'] = cache_status
+        return response
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args:
+            # one query for the liked products of the whole page
+            kwargs['context'] = self.get_serializer_context()
+            kwargs['context']['liked_ids'] = likes.liked_product_ids(self.request.user, args[0])
+        return super().get_serializer(*args, **kwargs)
+
+
+class ProductExportView(ReplicaReadMixin, APIView):
+    """
+    Every product of a category, a group or both (``?category=``, ``?group=``, plus ProductListView's
+    ``attr[...]`` filters), streamed as NDJSON or, with ``?format=json``, as one JSON array.
+
+    Rows are read and rendered in chunks as the client consumes the body, so memory use
+    doesn't grow with the size of the category.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [NDJSONRenderer, JSONRenderer]
+
+    def get(self, request, *args, **kwargs):
+        category_slug = request.query_params.get('category')
+        group_slug = request.query_params.get('group')
+        if not category_slug and not group_slug:
+            raise ValidationError({'detail': 'category or group is required'})
+        queryset = catalog_products(category_slug, group_slug)
+
+        filters = facets.parse_filters(request.query_params)
+        if filters:
+            if not group_slug:
+                raise ValidationError({'detail': 'attribute filters need a group'})
+            group_id = catalog_groups(category_slug, group_slug).values_list('pk', flat=True).first()
+            queryset = queryset.none() if group_id is None else facets.filter_products(queryset, group_id, filters)
+
+        # the body is produced after dispatch returns, outside ReplicaReadMixin's reading_from
+        queryset = queryset.using(router.db_for_read(Product))
+        renderer = request.accepted_renderer
+        body = export.export_products(queryset, renderer.format, context={'request': request})
+        return StreamingHttpResponse(body, content_type=renderer.media_type)
+
+
+class FacetCountsView(ReplicaReadMixin, ConditionalGetMixin, APIView):
+    """Attribute values of a group with the number of products having them, under the same ``attr[...]`` filters."""
+
+    def get_condition_tags(self):
+        # attribute changes bump the group tag, renames the facets tag
+        return [group_tag(self.kwargs['slug']), facets.FACETS_TAG]
+
+    def get(self, request, *args, **kwargs):
+        not_modified = self.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+
+        group = get_object_or_404(
+            Group.objects.only('id'), slug=self.kwargs['slug'], category__slug=self.kwargs['category_slug'],
+        )
+        filters = facets.parse_filters(request.query_params)
+        index = facets.get_index(group.pk)
+        data = {'facets': index.counts(filters)}
+        if filters:
+            data['count'] = len(index.match(filters))
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class SearchView(APIView):
+    """Products ranked by BM25 over name, description, group/category and attribute values."""
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), self.max_limit)
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            raise ValidationError({'detail': 'limit and offset must be integers'})
+        if limit < 1 or offset < 0:
+            raise ValidationError({'detail': 'limit must be positive and offset not negative'})
+
+        ids, count = search.search(query, limit, offset)
+        products = hydrate(plan_queryset(Product.objects.all(), ProductSerializer), ids)
+        serializer = ProductSerializer(products, many=True, context={
+            'request': request, 'view': self, 'liked_ids': likes.liked_product_ids(request.user, products),
+        })
+        return Response({'query': query, 'count': count, 'results': serializer.data}, status=status.HTTP_200_OK)
+
+
+class SearchCompletionView(APIView):
+    """Completions of what has been typed so far, tolerating one typo in the last word."""
+
+    def get(self, request, *args, **kwargs):
+        suggestions = search.complete(request.query_params.get('q', ''))
+        return Response({'suggestions': suggestions}, status=status.HTTP_200_OK)
+
+
+@require_GET
+def suggest_view(request):
+    """
+    Keystroke level suggestions for the storefront header.
+
+    A plain Django view: no authentication, negotiation or serializers, the suggester
+    already holds the response fields.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    return JsonResponse({'suggestions': suggest.suggest(request.GET.get('q', ''), limit)})
+
+
+class ProductAttributeView(ReplicaReadMixin, ConditionalGetMixin, RenderedCacheMixin, PlannedQuerysetMixin,
+                           generics.RetrieveUpdateDestroyAPIView):
+    queryset = Product.objects.all()
+    serializer_class = ProductAttributeSerializer
+    lookup_field = 'slug'
+
+    def get_condition_tags(self):
+        return [product_tag(self.kwargs['slug'])]
+
+    def get(self, request, *args, **kwargs):
+        not_modified = self.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+
+        slug = self.kwargs['slug']
+        cache_key = versioned_key('product_attributes', [slug], [product_tag(slug)])
+
+        def fill_attributes():
+            return self.get_serializer(self.get_object()).data
+
+        return self.cached_response(request, cache_key, fill_attributes, DETAIL_TIMEOUT)
+
+
+class ProductLikeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        product = get_object_or_404(Product.objects.only('id'), slug=self.kwargs['slug'])
+        likes.like(request.user, product)
+        return self.like_response(product, True)
+
+    def delete(self, request, *args, **kwargs):
+        product = get_object_or_404(Product.objects.only('id'), slug=self.kwargs['slug'])
+        likes.unlike(request.user, product)
+        return self.like_response(product, False)
+
+    def like_response(self, product, is_liked):
+        like_count = Product.objects.filter(pk=product.pk).values_list('like_count', flat=True).first()
+        return Response({'is_liked': is_liked, 'like_count': like_count}, status=status.HTTP_200_OK)
+
+
+class ProductImportView(APIView):
+    """
+    Bulk import of an uploaded CSV or JSONL file (``file``), see app.importer for the record format.
+
+    ``name`` identifies the run, posting the same file under the same name again continues
+    after the last committed chunk; ``restart`` imports it from the beginning.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'A CSV or JSONL file is required'})
+        try:
+            format = importer.detect_format(upload.name, request.data.get('format'))
+            result = importer.import_products(
+                upload, format, request.data.get('name') or upload.name, source=upload.name,
+                restart=request.data.get('restart') in ('1', 'true'),
+            )
+        except ValueError as error:
+            raise ValidationError({'detail': str(error)})
+        return Response(result.stats(), status=status.HTTP_200_OK)
+
+
+class ProductPriceUpdateView(APIView):
+    """
+    Bulk price and discount changes, a JSON array or an NDJSON stream of ``{slug, price, discount}`` records.
+
+    Applied by app.pricing in chunked transactions, the response has one result per record;
+    the records of a chunk whose transaction failed have the ``failed`` status. A record is
+    named by its slug or, without one, by its number in the body.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        records = request.data
+        if isinstance(records, dict):
+            raise ValidationError({'detail': 'Expected a list of {slug, price, discount} records'})
+        results = pricing.apply_prices(records)
+        return Response({'summary': pricing.summary(results), 'results': results}, status=status.HTTP_200_OK)
+
+
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        # counters are per process, they reset on restart
+        stats = {'product_list': product_list_cache.stats.as_dict()}
+        if hasattr(cache, 'stats'):
+            stats['tiers'] = cache.stats()
+        return Response(stats, status=status.HTTP_200_OK)
@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from app import singleflight, tasks
+from app.models import Group, Product
+
+logger = logging.getLogger(__name__)
+
+# how hot slugs are ranked: by like_count, or by comments written in the last `days`
+RANKINGS = ('likes', 'activity')
+
+
+def warm_request(path, base_url=None):
+    """An anonymous JSON GET of ``path`` as if it came in on ``base_url``, absolute urls are built from it."""
+    url = urlsplit(base_url or settings.CACHE_WARM_URL)
+    return RequestFactory().get(
+        path, HTTP_HOST=url.netloc, HTTP_ACCEPT='application/json', secure=url.scheme == 'https',
+    )
+
+
+def render(view_name, base_url=None, **kwargs):
+    """GET the view named ``view_name`` in-process, filling its caches as for a visitor; returns its X-Cache."""
+    path = reverse(view_name, kwargs=kwargs)
+    match = resolve(path)
+    response = match.func(warm_request(path, base_url), *match.args, **match.kwargs)
+    if response.status_code != 200:
+        raise LookupError(f'{path} answered {response.status_code}')
+    return response.get('X-Cache', singleflight.MISS)
+
+
+@tasks.register('cache.warm_product', priority=-5)
+def warm_product(slug):
+    """Render the product page into the response cache, the next visitor gets a hit."""
+    try:
+        render('product-detail', slug=slug)
+    except LookupError as error:
+        logger.info('Product %s not warmed: %s', slug, error)
+
+
+def schedule(slug):
+    if settings.CACHE_WARM_URL:
+        tasks.enqueue('cache.warm_product', {'slug': slug}, dedupe_key=f'cache.warm_product:{slug}')
+
+
+def hot_products(limit, by='likes', days=7):
+    """Slugs of the ``limit`` hottest products."""
+    products = Product.objects.all()
+    if by == 'activity':
+        since = timezone.now() - timedelta(days=days)
+        products = products.annotate(activity=Count('comments', filter=Q(comments__created_at__gte=since)))
+        products = products.order_by('-activity', '-like_count', '-pk')
+    else:
+        products = products.order_by('-like_count', '-pk')
+    return list(products.values_list('slug', flat=True)[:limit])
+
+
+def hot_groups(limit, by='likes', days=7):
+    """``(category slug, group slug)`` of the ``limit`` hottest groups, by the likes or activity of their products."""
+    if by == 'activity':
+        since = timezone.now() - timedelta(days=days)
+        heat = Count('products__comments', filter=Q(products__comments__created_at__gte=since))
+    else:
+        # a group without products sums to NULL, which PostgreSQL sorts first in descending order
+        heat = Coalesce(Sum('products__like_count'), 0)
+    groups = Group.objects.annotate(heat=heat).order_by('-heat', '-pk')
+    return list(groups.values_list('category__slug', 'slug')[:limit])
+
+
+class QueryBudget:
+    """
+    Lets at most ``size`` queries of the warming threads run at the same time.
+
+    Rendering a response is mostly serializing and cache I/O, so more threads than the
+    budget keep busy while the database sees no more than ``size`` queries in flight.
+    """
+
+    def __init__(self, size):
+        self.semaphore = threading.BoundedSemaphore(size)
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.semaphore:
+            return execute(sql, params, many, context)
+
+    def applied(self):
+        """Context manager installing the budget on the current thread's connections."""
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        return stack
+
+
+class Warmer:
+    """Renders the category list, the first page of the hottest groups and the hottest product pages into the cache."""
+
+    def __init__(self, base_url, workers=8, db_budget=4):
+        self.base_url = base_url
+        self.workers = workers
+        self.budget = QueryBudget(db_budget)
+        self.warmed = 0  # responses rendered into the cache
+        self.fresh = 0  # already cached under the current generation
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def jobs(self, groups, products, by='likes', days=7):
+        yield 'category-list', {}
+        for category_slug, slug in hot_groups(groups, by, days):
+            yield 'product-list', {'category_slug': category_slug, 'slug': slug}
+        for slug in hot_products(products, by, days):
+            yield 'product-detail', {'slug': slug}
+
+    def warm(self, job):
+        view_name, kwargs = job
+        try:
+            cache_status = render(view_name, self.base_url, **kwargs)
+        except Exception as error:
+            logger.warning('Not warmed %s %s: %s', view_name, kwargs, error)
+            return 'failed'
+        # a hit or a response shared with a concurrent visitor was already warm
+        return 'warmed' if cache_status == singleflight.MISS else 'fresh'
+
+    def work(self, jobs):
+        try:
+            with self.budget.applied():
+                while True:
+                    try:
+                        job = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    outcome = self.warm(job)
+                    with self.lock:
+                        setattr(self, outcome, getattr(self, outcome) + 1)
+        finally:
+            # the thread's own connections, nothing else would close them
+            connections.close_all()
+
+    def run(self, groups, products, by='likes', days=7):
+        started = time.perf_counter()
+        # ranked up front, on the calling thread and outside the budget
+        jobs = queue.SimpleQueue()
+        for job in self.jobs(groups, products, by, days):
+            jobs.put(job)
+        threads = [
+            threading.Thread(target=self.work, args=(jobs,), name=f'warm-{number}') for number in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            'warmed': self.warmed,
+            'fresh': self.fresh,
+            'failed': self.failed,
+            'seconds': round(time.perf_counter() - started, 2),
+        }
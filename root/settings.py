@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -77,12 +78,56 @@ WSGI_APPLICATION = 'root.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# DB_ENGINE=postgres switches to PostgreSQL, the DB_* variables below configure it. Without it the
+# local SQLite file is used, app.db turns on WAL and tunes its pragmas when a connection opens.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    PRIMARY_DATABASE = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'olcha'),
+        'USER': os.environ.get('DB_USER', 'olcha'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        # connections are kept per thread and reused across requests instead of opened for each one,
+        # a connection that died while idle is found by the health check before the request uses it
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': 5,
+            'application_name': 'olcha',
+        },
+    }
+    if os.environ.get('DB_POOLER') == 'pgbouncer':
+        # Django 5.0 has no pool of its own, PgBouncer in transaction mode pools in front of the server;
+        # a server-side cursor (.iterator()) can't outlive the transaction it was opened in there
+        PRIMARY_DATABASE['DISABLE_SERVER_SIDE_CURSORS'] = True
+else:
+    PRIMARY_DATABASE = {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            # seconds a writer waits for the lock before "database is locked"
+            'timeout': 20,
+        },
     }
-}
+
+DATABASES = {'default': PRIMARY_DATABASE}
+
+# comma separated replica hosts (PostgreSQL) or files (SQLite), the catalog read views query them,
+# see app.db.ReplicaRouter
+for number, location in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **PRIMARY_DATABASE,
+        'HOST' if DB_ENGINE == 'postgres' else 'NAME': location.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['app.db.ReplicaRouter']
+# seconds after a change during which the views that show it read from the primary,
+# replicas lagging longer than this would have stale rows cached under the new generation
+REPLICA_LAG = float(os.environ.get('DB_REPLICA_LAG', 5))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -140,12 +185,37 @@ REST_FRAMEWORK = {
     #     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     #     'PAGE_SIZE': 100,
 }
-CACHES = {
-    "default": {
+# REDIS_URL switches the shared cache to Redis, the generation counters in app.cache rely on its atomic INCR
+if os.environ.get('REDIS_URL'):
+    SHARED_CACHE = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ['REDIS_URL'],
+    }
+else:
+    SHARED_CACHE = {
         "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
         "LOCATION": BASE_DIR / 'cache',
     }
+
+CACHES = {
+    # per-process LRU in front of the shared backend, see app.cache_backends.TieredCache
+    "default": {
+        "BACKEND": "app.cache_backends.TieredCache",
+        "LOCATION": "catalog",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_MAX_BYTES": 32 * 1024 * 1024,
+            "LOCAL_TIMEOUT": 5,
+            "STALE_WHILE_REVALIDATE": 30,
+        },
+    },
+    "shared": SHARED_CACHE,
 }
+
+# run queued tasks right after the commit that queued them instead of in `manage.py run_tasks`
+TASKS_EAGER = os.environ.get('TASKS_EAGER') == '1'
+# public address of the site, product pages are re-rendered into the cache after a change when set
+CACHE_WARM_URL = os.environ.get('CACHE_WARM_URL')
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=180),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=50),